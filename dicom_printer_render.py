@@ -0,0 +1,300 @@
+"""In-process rendering of Hardcopy Grayscale (HG) films for the virtual printer.
+
+Turns the stored pixel data of an uncompressed grayscale film into 8-bit
+display values by applying, in order, the Modality LUT (rescale slope and
+intercept), the VOI LUT (window center/width, or a VOI LUT sequence), the
+Presentation LUT (sequence or shape) and MONOCHROME1 inversion. Everything
+is done with lookup tables over the stored value range, so no NumPy is
+needed; 8-bit films are mapped with a single bytes.translate call.
+
+Films this module cannot handle (compressed transfer syntaxes, color,
+multi-frame, unusual bit depths) raise UnsupportedFilm so the caller can fall
+back to DCMTK's dcm2img.
+"""
+import math
+import sys
+from array import array
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+UNCOMPRESSED_TRANSFER_SYNTAXES = {
+    "1.2.840.10008.1.2": "<",  # Implicit VR Little Endian
+    "1.2.840.10008.1.2.1": "<",  # Explicit VR Little Endian
+    "1.2.840.10008.1.2.2": ">",  # Explicit VR Big Endian (retired)
+}
+
+
+class UnsupportedFilm(ValueError):
+    """The film needs the external renderer (compressed, color, multi-frame, ...)."""
+
+
+class RenderedFilm:
+    """8-bit grayscale pixels (row-major, MONOCHROME2) ready for PDF composition."""
+
+    __slots__ = ("width", "height", "pixels")
+
+    def __init__(self, width: int, height: int, pixels: bytes):
+        self.width = width
+        self.height = height
+        self.pixels = pixels
+
+    def to_image(self):
+        """PIL image for reportlab (Pillow ships as a reportlab dependency)."""
+        from PIL import Image
+
+        return Image.frombytes("L", (self.width, self.height), self.pixels)
+
+
+def _first(value, default=None):
+    if value is None or value == "":
+        return default
+    if isinstance(value, (list, tuple)) or type(value).__name__ == "MultiValue":
+        return value[0] if len(value) else default
+    return value
+
+
+def _lut_data(item) -> Tuple[List[int], int, int]:
+    """(entries, first mapped value, bits) of a VOI/Presentation LUT sequence item."""
+    descriptor = list(item.LUTDescriptor)
+    count = int(descriptor[0]) or 65536
+    first = int(descriptor[1])
+    bits = int(descriptor[2])
+    data = item.LUTData
+    if isinstance(data, (bytes, bytearray)):
+        words = array("H")
+        words.frombytes(bytes(data[: count * 2]))
+        if sys.byteorder != "little":
+            words.byteswap()
+        data = words
+    entries = [int(v) for v in list(data)[:count]]
+    if not entries:
+        raise UnsupportedFilm("empty LUT data")
+    return entries, first, bits
+
+
+def _window_fn(center: float, width: float, function: str):
+    """VOI window as a function of the rescaled value onto [0, 1] (PS3.3 C.11.2.1.2)."""
+    function = (function or "LINEAR").upper()
+    if function == "SIGMOID":
+        return lambda x: 1.0 / (1.0 + math.exp(-4.0 * (x - center) / width))
+    if function == "LINEAR_EXACT":
+        bottom, top = center - width / 2.0, center + width / 2.0
+        span = max(width, 1e-9)
+        return lambda x: 0.0 if x <= bottom else 1.0 if x > top else (x - bottom) / span
+    width = max(width, 1.0)
+    bottom, top = center - 0.5 - (width - 1) / 2.0, center - 0.5 + (width - 1) / 2.0
+    span = max(width - 1, 1e-9)
+    return lambda x: 0.0 if x <= bottom else 1.0 if x > top else ((x - (center - 0.5)) / span + 0.5)
+
+
+def _display_lut(attrs: Dict[str, Any], stored_values: List[int]) -> bytes:
+    """8-bit output value for each entry of stored_values (see module docstring)."""
+    slope = float(_first(attrs.get("RescaleSlope"), 1) or 1)
+    intercept = float(_first(attrs.get("RescaleIntercept"), 0) or 0)
+    rescaled = [v * slope + intercept for v in stored_values]
+
+    voi_items = attrs.get("VOILUTSequence") or []
+    center = _first(attrs.get("WindowCenter"))
+    width = _first(attrs.get("WindowWidth"))
+    if voi_items:
+        entries, first, bits = _lut_data(voi_items[0])
+        top = float((1 << bits) - 1) or 1.0
+        last = len(entries) - 1
+        unit = [entries[min(last, max(0, int(x) - first))] / top for x in rescaled]
+    elif center is not None and width is not None and float(width) > 0:
+        fn = _window_fn(float(center), float(width), str(attrs.get("VOILUTFunction") or ""))
+        unit = [fn(x) for x in rescaled]
+    else:
+        # No VOI: span the representable stored range, not the pixels present.
+        allocated = int(attrs.get("BitsAllocated") or 8)
+        stored = int(attrs.get("BitsStored") or allocated)
+        if int(attrs.get("PixelRepresentation") or 0) == 1:
+            low, high = -(1 << (stored - 1)), (1 << (stored - 1)) - 1
+        else:
+            low, high = 0, (1 << stored) - 1
+        lo, hi = sorted((low * slope + intercept, high * slope + intercept))
+        span = (hi - lo) or 1.0
+        unit = [(x - lo) / span for x in rescaled]
+
+    presentation = attrs.get("PresentationLUTSequence") or []
+    if presentation:
+        entries, _, bits = _lut_data(presentation[0])
+        top = float((1 << bits) - 1) or 1.0
+        last = len(entries) - 1
+        unit = [entries[int(round(u * last))] / top for u in unit]
+
+    invert = str(attrs.get("PresentationLUTShape") or "").strip().upper() == "INVERSE"
+    if str(attrs.get("PhotometricInterpretation") or "").strip().upper() == "MONOCHROME1":
+        invert = True
+    if invert:
+        return bytes(255 - int(round(min(1.0, max(0.0, u)) * 255)) for u in unit)
+    return bytes(int(round(min(1.0, max(0.0, u)) * 255)) for u in unit)
+
+
+def _needs_lut(attrs: Dict[str, Any]) -> bool:
+    """False when 8-bit stored values are already the display values."""
+    if str(attrs.get("PhotometricInterpretation") or "").strip().upper() != "MONOCHROME2":
+        return True
+    if str(attrs.get("PresentationLUTShape") or "").strip().upper() == "INVERSE":
+        return True
+    if attrs.get("VOILUTSequence") or attrs.get("PresentationLUTSequence"):
+        return True
+    if _first(attrs.get("WindowWidth")) is not None:
+        return True
+    if float(_first(attrs.get("RescaleSlope"), 1) or 1) != 1 or float(_first(attrs.get("RescaleIntercept"), 0) or 0) != 0:
+        return True
+    return int(attrs.get("PixelRepresentation") or 0) != 0
+
+
+def render_pixels(attrs: Dict[str, Any], pixel_data: bytes, byte_order: str = "<") -> RenderedFilm:
+    """Render raw (uncompressed, native) grayscale pixel data to an 8-bit film."""
+    photometric = str(attrs.get("PhotometricInterpretation") or "").strip().upper()
+    if photometric not in ("MONOCHROME1", "MONOCHROME2"):
+        raise UnsupportedFilm(f"photometric interpretation {photometric or '?'}")
+    if int(attrs.get("SamplesPerPixel") or 1) != 1 or int(_first(attrs.get("NumberOfFrames"), 1) or 1) != 1:
+        raise UnsupportedFilm("multi-sample or multi-frame pixel data")
+    rows, cols = int(attrs.get("Rows") or 0), int(attrs.get("Columns") or 0)
+    allocated = int(attrs.get("BitsAllocated") or 0)
+    stored = int(attrs.get("BitsStored") or allocated)
+    high_bit = int(attrs.get("HighBit") if attrs.get("HighBit") is not None else stored - 1)
+    signed = int(attrs.get("PixelRepresentation") or 0) == 1
+    if rows <= 0 or cols <= 0:
+        raise UnsupportedFilm("missing image dimensions")
+    if allocated not in (8, 16) or not 0 < stored <= allocated or high_bit >= allocated:
+        raise UnsupportedFilm(f"bits allocated/stored {allocated}/{stored}")
+    count = rows * cols
+    if len(pixel_data) < count * allocated // 8:
+        raise UnsupportedFilm("pixel data shorter than Rows x Columns")
+
+    # One LUT entry per raw word value; masking and sign extension are folded in.
+    shift = high_bit - stored + 1
+    mask = (1 << stored) - 1
+    sign = 1 << (stored - 1)
+
+    def stored_value(raw: int) -> int:
+        value = (raw >> shift) & mask
+        return value - (1 << stored) if signed and value & sign else value
+
+    if allocated == 8:
+        if not _needs_lut(attrs) and stored == 8 and shift == 0:
+            return RenderedFilm(cols, rows, bytes(pixel_data[:count]))
+        lut = _display_lut(attrs, [stored_value(raw) for raw in range(256)])
+        return RenderedFilm(cols, rows, bytes(pixel_data[:count]).translate(lut))
+
+    words = array("H")
+    words.frombytes(bytes(pixel_data[: count * 2]))
+    if (byte_order == "<") != (sys.byteorder == "little"):
+        words.byteswap()
+    # Indexed from raw word 0 so every pixel is a plain table lookup.
+    used = range(max(words) + 1) if words else range(1)
+    lut = _display_lut(attrs, [stored_value(raw) for raw in used])
+    return RenderedFilm(cols, rows, bytes(map(lut.__getitem__, words)))
+
+
+def render_film(path: Path) -> RenderedFilm:
+    """Read an HG file with pydicom and render it without touching the disk again."""
+    from pydicom import dcmread
+
+    ds = dcmread(str(path), force=True)
+    transfer_syntax = str(getattr(getattr(ds, "file_meta", None), "TransferSyntaxUID", "") or "1.2.840.10008.1.2")
+    byte_order = UNCOMPRESSED_TRANSFER_SYNTAXES.get(transfer_syntax)
+    if byte_order is None:
+        raise UnsupportedFilm(f"transfer syntax {transfer_syntax}")
+    if "PixelData" not in ds:
+        raise UnsupportedFilm("no pixel data")
+    keywords = (
+        "PhotometricInterpretation", "SamplesPerPixel", "NumberOfFrames", "Rows", "Columns",
+        "BitsAllocated", "BitsStored", "HighBit", "PixelRepresentation", "RescaleSlope",
+        "RescaleIntercept", "WindowCenter", "WindowWidth", "VOILUTFunction", "VOILUTSequence",
+        "PresentationLUTSequence", "PresentationLUTShape",
+    )
+    attrs: Dict[str, Optional[Any]] = {kw: ds.get(kw) for kw in keywords}
+    return render_pixels(attrs, ds.PixelData, byte_order)
+
+
+def invert(film: RenderedFilm) -> RenderedFilm:
+    """REVERSE polarity: white becomes black."""
+    return RenderedFilm(film.width, film.height, film.pixels.translate(bytes(range(255, -1, -1))))
+
+
+def display_layout(image_display_format: str) -> Tuple[int, int, List[int]]:
+    """(columns, rows, grid cell of each image box) for a Film Box Image Display Format.
+
+    STANDARD\\C,R is a C x R grid. ROW\\n1,n2,... puts n1 image boxes in the
+    first row, n2 in the second and so on; COL\\n1,n2,... does the same by
+    column. Grid cells are numbered left-to-right, top-to-bottom. SLIDE,
+    SUPERSLIDE and CUSTOM depend on the printer configuration and raise
+    UnsupportedFilm, as does a malformed format.
+    """
+    text = str(image_display_format or "").strip().upper()
+    kind, _, values = text.partition("\\")
+    try:
+        counts = [int(v) for v in values.split(",")]
+    except ValueError:
+        counts = []
+    if kind not in ("STANDARD", "ROW", "COL") or not counts or min(counts) <= 0:
+        raise UnsupportedFilm(f"image display format {text or '?'}")
+    if kind == "STANDARD":
+        if len(counts) != 2:
+            raise UnsupportedFilm(f"image display format {text}")
+        cols, rows = counts
+        return cols, rows, list(range(cols * rows))
+    if kind == "ROW":
+        cols, rows = max(counts), len(counts)
+        return cols, rows, [row * cols + col for row, n in enumerate(counts) for col in range(n)]
+    cols, rows = len(counts), max(counts)
+    return cols, rows, [row * cols + col for col, n in enumerate(counts) for row in range(n)]
+
+
+def tile_films(films: List[Optional[RenderedFilm]], columns: int, rows: int, background: int = 0) -> RenderedFilm:
+    """Lay out image boxes left-to-right, top-to-bottom on one film.
+
+    Each cell is as large as the largest image; images are centered in their
+    cell. Empty positions (None) stay background.
+    """
+    present = [f for f in films if f is not None]
+    if not present:
+        raise UnsupportedFilm("film box has no printed images")
+    if len(films) == 1:
+        return films[0]
+    cell_w = max(f.width for f in present)
+    cell_h = max(f.height for f in present)
+    width, height = cell_w * columns, cell_h * rows
+    canvas = bytearray([background]) * (width * height)
+    for idx, film in enumerate(films[: columns * rows]):
+        if film is None:
+            continue
+        x0 = (idx % columns) * cell_w + (cell_w - film.width) // 2
+        y0 = (idx // columns) * cell_h + (cell_h - film.height) // 2
+        for y in range(film.height):
+            start = (y0 + y) * width + x0
+            canvas[start:start + film.width] = film.pixels[y * film.width:(y + 1) * film.width]
+    return RenderedFilm(width, height, bytes(canvas))
+
+
+def film_to_pgm(film: RenderedFilm) -> bytes:
+    """Binary PGM (P5) of a rendered film, used as the print job's render checkpoint."""
+    return b"P5\n%d %d\n255\n" % (film.width, film.height) + film.pixels
+
+
+def film_from_pgm(data: bytes) -> RenderedFilm:
+    fields = data[:64].split(None, 4)
+    if len(fields) < 4 or fields[0] != b"P5" or fields[3] != b"255":
+        raise ValueError("not an 8-bit binary PGM")
+    width, height = int(fields[1]), int(fields[2])
+    header = b"P5\n%d %d\n255\n" % (width, height)
+    if not data.startswith(header) or len(data) != len(header) + width * height:
+        raise ValueError("truncated PGM")
+    return RenderedFilm(width, height, data[len(header):])
+
+
+def film_session_key(path: Path) -> Optional[str]:
+    """Study Instance UID of an HG film.
+
+    dcmprscp creates one study per Film Session, so films sharing it were
+    printed in the same session.
+    """
+    from pydicom import dcmread
+
+    ds = dcmread(str(path), stop_before_pixels=True, force=True, specific_tags=["StudyInstanceUID"])
+    return str(ds.get("StudyInstanceUID") or "").strip() or None
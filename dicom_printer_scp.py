@@ -0,0 +1,310 @@
+"""Built-in Basic Grayscale Print Management SCP (alternative to DCMTK dcmprscp).
+
+Implements Basic Film Session, Basic Film Box, Basic Grayscale Image Box and
+Printer on pynetdicom. Image boxes are kept in memory per association; when a
+film box (or the whole film session) is printed, its image boxes are handed to
+the virtual printer pipeline without writing HG/SP files or waiting for a
+directory scan.
+"""
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pydicom.dataset import Dataset
+from pydicom.sequence import Sequence
+from pydicom.uid import generate_uid
+from pynetdicom import AE, evt
+from pynetdicom.sop_class import Verification
+
+from dicom_printer_render import UnsupportedFilm, display_layout
+
+
+BASIC_GRAYSCALE_PRINT_META_UID = "1.2.840.10008.5.1.1.9"
+BASIC_FILM_SESSION_UID = "1.2.840.10008.5.1.1.1"
+BASIC_FILM_BOX_UID = "1.2.840.10008.5.1.1.2"
+BASIC_GRAYSCALE_IMAGE_BOX_UID = "1.2.840.10008.5.1.1.4"
+PRINTER_UID = "1.2.840.10008.5.1.1.16"
+PRINTER_INSTANCE_UID = "1.2.840.10008.5.1.1.17"
+EXPLICIT_VR_BIG_ENDIAN = "1.2.840.10008.1.2.2"
+
+# Pixel module attributes of a Basic Grayscale Image Sequence item.
+_PIXEL_KEYWORDS = (
+    "SamplesPerPixel", "PhotometricInterpretation", "Rows", "Columns", "BitsAllocated",
+    "BitsStored", "HighBit", "PixelRepresentation",
+)
+
+STATUS_SUCCESS = 0x0000
+STATUS_INVALID_ATTRIBUTE_VALUE = 0x0106
+STATUS_NO_SUCH_INSTANCE = 0x0112
+STATUS_NO_SUCH_SOP_CLASS = 0x0118
+STATUS_PROCESSING_FAILURE = 0x0110
+STATUS_INVALID_OBJECT = 0x0117
+# Warning: film box printed without any image box content (empty page).
+STATUS_EMPTY_PAGE = 0xB603
+
+
+class ImageBoxContent:
+    """Pixel data and presentation of one printed image box."""
+
+    __slots__ = ("position", "attrs", "pixels", "byte_order", "polarity")
+
+    def __init__(self, position: int, attrs: Dict[str, Any], pixels: bytes, byte_order: str, polarity: str):
+        self.position = position
+        self.attrs = attrs
+        self.pixels = pixels
+        self.byte_order = byte_order
+        self.polarity = polarity
+
+
+class _Association:
+    """Film session, film boxes and image boxes created on one association."""
+
+    def __init__(self):
+        self.session_uid: Optional[str] = None
+        self.session_attrs = Dataset()
+        self.film_boxes: Dict[str, Dict[str, Any]] = {}
+        self.image_boxes: Dict[str, Dict[str, Any]] = {}
+
+
+def _sop_class(event) -> str:
+    req = event.request
+    return str(getattr(req, "AffectedSOPClassUID", None) or getattr(req, "RequestedSOPClassUID", None) or "")
+
+
+def _sop_instance(event) -> str:
+    req = event.request
+    return str(getattr(req, "AffectedSOPInstanceUID", None) or getattr(req, "RequestedSOPInstanceUID", None) or "")
+
+
+def _byte_order(event) -> str:
+    """Byte order of the request's data set, from its presentation context."""
+    try:
+        transfer_syntax = str(event.context.transfer_syntax)
+    except Exception:
+        return "<"
+    return ">" if transfer_syntax == EXPLICIT_VR_BIG_ENDIAN else "<"
+
+
+class NativePrintSCP:
+    """Print SCP that submits each printed film box through submit(session_uid, name, display_format, boxes)."""
+
+    def __init__(self, aet: str, port: int, submit: Callable[[str, str, str, List[ImageBoxContent]], None], bind_address: str = ""):
+        self.aet = aet
+        self.port = port
+        self.bind_address = bind_address
+        self.submit = submit
+        self._server = None
+        self._lock = threading.Lock()
+        self._associations: Dict[int, _Association] = {}
+
+    def start(self):
+        ae = AE(ae_title=self.aet.encode("ascii", errors="ignore"))
+        for uid in (
+            BASIC_GRAYSCALE_PRINT_META_UID,
+            BASIC_FILM_SESSION_UID,
+            BASIC_FILM_BOX_UID,
+            BASIC_GRAYSCALE_IMAGE_BOX_UID,
+            PRINTER_UID,
+        ):
+            ae.add_supported_context(uid)
+        ae.add_supported_context(Verification)
+        handlers = [
+            (evt.EVT_N_CREATE, self._handle_n_create),
+            (evt.EVT_N_SET, self._handle_n_set),
+            (evt.EVT_N_GET, self._handle_n_get),
+            (evt.EVT_N_ACTION, self._handle_n_action),
+            (evt.EVT_N_DELETE, self._handle_n_delete),
+            (evt.EVT_RELEASED, self._handle_closed),
+            (evt.EVT_ABORTED, self._handle_closed),
+            (evt.EVT_C_ECHO, lambda event: 0x0000),
+        ]
+        self._server = ae.start_server((self.bind_address, self.port), block=False, evt_handlers=handlers)
+        logging.info("Native DICOM Print SCP listening: AET=%s port=%s", self.aet, self.port)
+
+    def stop(self):
+        if self._server is not None:
+            try:
+                self._server.shutdown()
+            except Exception:
+                pass
+            self._server = None
+
+    def _state(self, event) -> _Association:
+        with self._lock:
+            return self._associations.setdefault(id(event.assoc), _Association())
+
+    def _handle_closed(self, event):
+        with self._lock:
+            self._associations.pop(id(event.assoc), None)
+
+    # --- N-CREATE -------------------------------------------------------------
+
+    def _handle_n_create(self, event) -> Tuple[int, Optional[Dataset]]:
+        try:
+            attrs = event.attribute_list
+        except Exception:
+            attrs = Dataset()
+        state = self._state(event)
+        sop_class = _sop_class(event)
+        uid = _sop_instance(event) or generate_uid()
+
+        if sop_class == BASIC_FILM_SESSION_UID:
+            state.session_uid = uid
+            state.session_attrs = attrs
+            rsp = Dataset()
+            rsp.update(attrs)
+            rsp.SOPInstanceUID = uid
+            return STATUS_SUCCESS, rsp
+
+        if sop_class == BASIC_FILM_BOX_UID:
+            if state.session_uid is None:
+                return STATUS_INVALID_OBJECT, None
+            display_format = str(attrs.get("ImageDisplayFormat") or "STANDARD\\1,1")
+            try:
+                _, _, cells = display_layout(display_format)
+            except UnsupportedFilm as exc:
+                logging.warning("Native Print SCP rejected film box: %s", exc)
+                return STATUS_INVALID_ATTRIBUTE_VALUE, None
+            refs = Sequence()
+            box_uids = []
+            for position in range(1, len(cells) + 1):
+                box_uid = generate_uid()
+                state.image_boxes[box_uid] = {"film_box": uid, "position": position, "content": None}
+                box_uids.append(box_uid)
+                ref = Dataset()
+                ref.ReferencedSOPClassUID = BASIC_GRAYSCALE_IMAGE_BOX_UID
+                ref.ReferencedSOPInstanceUID = box_uid
+                refs.append(ref)
+            state.film_boxes[uid] = {
+                "attrs": attrs, "display_format": display_format, "image_boxes": box_uids, "printed": False,
+            }
+            rsp = Dataset()
+            rsp.update(attrs)
+            rsp.SOPInstanceUID = uid
+            rsp.ReferencedImageBoxSequence = refs
+            return STATUS_SUCCESS, rsp
+
+        return STATUS_NO_SUCH_SOP_CLASS, None
+
+    # --- N-SET ----------------------------------------------------------------
+
+    def _handle_n_set(self, event) -> Tuple[int, Optional[Dataset]]:
+        try:
+            mods = event.modification_list
+        except Exception:
+            return STATUS_PROCESSING_FAILURE, None
+        state = self._state(event)
+        sop_class = _sop_class(event)
+        uid = _sop_instance(event)
+
+        if sop_class == BASIC_GRAYSCALE_IMAGE_BOX_UID:
+            box = state.image_boxes.get(uid)
+            if box is None:
+                return STATUS_NO_SUCH_INSTANCE, None
+            items = mods.get("BasicGrayscaleImageSequence") or []
+            if items:
+                image = items[0]
+                if "PixelData" not in image:
+                    return STATUS_INVALID_OBJECT, None
+                attrs = {kw: image.get(kw) for kw in _PIXEL_KEYWORDS}
+                box["content"] = ImageBoxContent(
+                    int(mods.get("ImageBoxPosition") or box["position"]),
+                    attrs,
+                    bytes(image.PixelData),
+                    _byte_order(event),
+                    str(mods.get("Polarity") or "NORMAL").strip().upper(),
+                )
+            return STATUS_SUCCESS, Dataset()
+
+        if sop_class == BASIC_FILM_BOX_UID:
+            film_box = state.film_boxes.get(uid)
+            if film_box is None:
+                return STATUS_NO_SUCH_INSTANCE, None
+            film_box["attrs"].update(mods)
+            return STATUS_SUCCESS, Dataset()
+
+        if sop_class == BASIC_FILM_SESSION_UID:
+            if uid != state.session_uid:
+                return STATUS_NO_SUCH_INSTANCE, None
+            state.session_attrs.update(mods)
+            return STATUS_SUCCESS, Dataset()
+
+        return STATUS_NO_SUCH_SOP_CLASS, None
+
+    # --- N-GET (Printer) --------------------------------------------------------
+
+    def _handle_n_get(self, event) -> Tuple[int, Optional[Dataset]]:
+        if _sop_class(event) != PRINTER_UID:
+            return STATUS_NO_SUCH_SOP_CLASS, None
+        if _sop_instance(event) != PRINTER_INSTANCE_UID:
+            # The Printer SOP Class has a single well-known instance.
+            return STATUS_NO_SUCH_INSTANCE, None
+        rsp = Dataset()
+        rsp.PrinterStatus = "NORMAL"
+        rsp.PrinterStatusInfo = "NORMAL"
+        rsp.PrinterName = self.aet
+        rsp.Manufacturer = "FlowWorklist"
+        rsp.ManufacturerModelName = "Virtual Printer"
+        return STATUS_SUCCESS, rsp
+
+    # --- N-ACTION (print) -------------------------------------------------------
+
+    def _handle_n_action(self, event) -> Tuple[int, Optional[Dataset]]:
+        state = self._state(event)
+        sop_class = _sop_class(event)
+        uid = _sop_instance(event)
+        if sop_class == BASIC_FILM_BOX_UID:
+            if uid not in state.film_boxes:
+                return STATUS_NO_SUCH_INSTANCE, None
+            film_box_uids = [uid]
+        elif sop_class == BASIC_FILM_SESSION_UID:
+            if uid != state.session_uid:
+                return STATUS_NO_SUCH_INSTANCE, None
+            # Film boxes already printed on their own are not printed again.
+            film_box_uids = [u for u, film_box in state.film_boxes.items() if not film_box["printed"]]
+            if state.film_boxes and not film_box_uids:
+                return STATUS_SUCCESS, None
+        else:
+            return STATUS_NO_SUCH_SOP_CLASS, None
+
+        submitted = 0
+        for film_box_uid in film_box_uids:
+            film_box = state.film_boxes[film_box_uid]
+            boxes = [
+                state.image_boxes[box_uid]["content"]
+                for box_uid in film_box["image_boxes"]
+                if state.image_boxes.get(box_uid, {}).get("content") is not None
+            ]
+            if not boxes:
+                continue
+            try:
+                self.submit(state.session_uid, f"FILM_{film_box_uid}", film_box["display_format"], boxes)
+                film_box["printed"] = True
+                submitted += 1
+            except Exception as exc:
+                logging.exception("Native Print SCP could not queue film box %s: %s", film_box_uid, exc)
+                return STATUS_PROCESSING_FAILURE, None
+        if not submitted:
+            return STATUS_EMPTY_PAGE, None
+        return STATUS_SUCCESS, None
+
+    # --- N-DELETE ---------------------------------------------------------------
+
+    def _handle_n_delete(self, event) -> int:
+        state = self._state(event)
+        sop_class = _sop_class(event)
+        uid = _sop_instance(event)
+        if sop_class == BASIC_FILM_BOX_UID:
+            film_box = state.film_boxes.pop(uid, None)
+            if film_box is None:
+                return STATUS_NO_SUCH_INSTANCE
+            for box_uid in film_box["image_boxes"]:
+                state.image_boxes.pop(box_uid, None)
+            return STATUS_SUCCESS
+        if sop_class == BASIC_FILM_SESSION_UID:
+            if uid != state.session_uid:
+                return STATUS_NO_SUCH_INSTANCE
+            with self._lock:
+                self._associations[id(event.assoc)] = _Association()
+            return STATUS_SUCCESS
+        return STATUS_NO_SUCH_SOP_CLASS
@@ -1,9 +1,49 @@
+import bisect
+import json
 import logging
+import os
+import queue
 import subprocess
 import threading
 import time
+import zlib
+from collections import OrderedDict, deque
+from datetime import datetime
+from io import BytesIO
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional
+
+from dicom_printer_render import (
+    RenderedFilm,
+    UnsupportedFilm,
+    display_layout,
+    film_from_pgm,
+    film_session_key,
+    film_to_pgm,
+    invert,
+    render_film,
+    render_pixels,
+    tile_films,
+)
+from dicom_printer_store import (
+    JOB_PRINTED,
+    JOB_RENDERED,
+    JOB_SPOOLED,
+    JOBS_FILE_NAME,
+    PROCESSED_FILE_NAME,
+    PrintJobJournal,
+    ProcessedFileIndex,
+    decode_image_boxes,
+    encode_image_boxes,
+)
+
+try:
+    # Optional: native directory events (inotify on Linux, ReadDirectoryChangesW on Windows).
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except Exception:
+    FileSystemEventHandler = object
+    Observer = None
 
 
 def _to_bool(value, default=False):
@@ -14,6 +54,479 @@ def _to_bool(value, default=False):
     return str(value).strip().lower() in ("1", "true", "yes", "on")
 
 
+PIPELINE_STATUS_FILE = "pipeline_status.json"
+PIPELINE_STAGES = ("ingest", "render", "compose", "spool")
+
+
+# File types the retention sweeper may delete from the printer folders.
+SWEEP_SUFFIXES = (".dcm", ".pdf", ".png", ".job", ".tmp")
+
+
+def _is_hg_name(name: str) -> bool:
+    return name.upper().startswith("HG_") and name.lower().endswith(".dcm")
+
+
+def _is_sp_name(name: str) -> bool:
+    return name.upper().startswith("SP_") and name.lower().endswith(".dcm")
+
+
+def read_pipeline_status(root_dir: Path) -> Dict[str, Any]:
+    path = Path(root_dir) / "dicom-printer" / PIPELINE_STATUS_FILE
+    if not path.exists():
+        return {}
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def _lane(session: str) -> int:
+    return zlib.crc32(session.encode("utf-8"))
+
+
+class _PrintJob:
+    """One film moving through the render stage; session/seq fix its print order.
+
+    Films come either from an HG file (hg_path) or, with the native Print SCP,
+    from in-memory image boxes (boxes + display_format). job_id is its row in
+    the PrintJobJournal.
+    """
+
+    __slots__ = (
+        "hg_path", "name", "boxes", "display_format", "session", "seq", "job_id",
+        "center_time", "film", "png_path", "error", "enqueued_at",
+    )
+
+    def __init__(self, hg_path: Optional[Path], session: str, seq: int, name: str = "", boxes=None, display_format: str = ""):
+        self.hg_path = hg_path
+        self.name = name or (hg_path.name if hg_path is not None else "film")
+        self.boxes = boxes
+        self.display_format = display_format
+        self.session = session
+        self.seq = seq
+        self.job_id = None
+        self.center_time = None
+        self.film = None
+        self.png_path = None
+        self.error = None
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def label(self) -> str:
+        return self.name
+
+
+class _PrintBatch:
+    """Films of one session composed into a single PDF and print job."""
+
+    __slots__ = ("session", "films", "pdf_bytes", "pdf_path", "error", "enqueued_at")
+
+    def __init__(self, session: str):
+        self.session = session
+        self.films: List[_PrintJob] = []
+        self.pdf_bytes = None
+        self.pdf_path = None
+        self.error = None
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def label(self) -> str:
+        first = self.films[0].name if self.films else self.session
+        return first if len(self.films) <= 1 else f"{first} (+{len(self.films) - 1} films)"
+
+
+class _StageStats:
+    """Counters plus recent wait/service times (ms) of one pipeline stage."""
+
+    def __init__(self, window: int = 256):
+        self._lock = threading.Lock()
+        self._wait = deque(maxlen=window)
+        self._service = deque(maxlen=window)
+        self.processed = 0
+        self.failed = 0
+        self.in_flight = 0
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self, wait_s: float, service_s: float, ok: bool):
+        with self._lock:
+            self.in_flight -= 1
+            self.processed += 1
+            if not ok:
+                self.failed += 1
+            self._wait.append(wait_s * 1000.0)
+            self._service.append(service_s * 1000.0)
+
+    @staticmethod
+    def _summary(values) -> Dict[str, float]:
+        if not values:
+            return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+        ordered = sorted(values)
+        pick = lambda pct: ordered[min(len(ordered) - 1, int(pct * len(ordered)))]
+        return {"p50": round(pick(0.50), 1), "p95": round(pick(0.95), 1), "max": round(ordered[-1], 1)}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "processed": self.processed,
+                "failed": self.failed,
+                "wait_ms": self._summary(self._wait),
+                "service_ms": self._summary(self._service),
+            }
+
+
+class _PipelineStage:
+    """Worker pool fed by bounded queues.
+
+    With lanes > 1 each worker owns one queue and callers pick the lane, which
+    keeps jobs routed to the same lane in order (used by the spool stage).
+    """
+
+    def __init__(self, name: str, handler: Callable[[_PrintJob], None], workers: int, queue_size: int, lanes: int = 1):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in range(max(1, lanes))]
+        self.stats = _StageStats()
+        self.threads: List[threading.Thread] = []
+
+    def start(self, stop_event: threading.Event, on_done: Callable[[_PrintJob], None]):
+        for idx in range(self.workers):
+            q = self.queues[idx % len(self.queues)]
+            t = threading.Thread(
+                target=self._run,
+                args=(q, stop_event, on_done),
+                name=f"dicom-printer-{self.name}-{idx + 1}",
+                daemon=True,
+            )
+            t.start()
+            self.threads.append(t)
+
+    def put(self, job: _PrintJob, stop_event: threading.Event, lane: int = 0) -> bool:
+        """Blocks while the lane is full (backpressure); False once stopping."""
+        job.enqueued_at = time.monotonic()
+        q = self.queues[lane % len(self.queues)]
+        while not stop_event.is_set():
+            try:
+                q.put(job, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self, q: "queue.Queue[_PrintJob]", stop_event: threading.Event, on_done: Callable[[_PrintJob], None]):
+        while not stop_event.is_set():
+            try:
+                job = q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            started = time.monotonic()
+            self.stats.begin()
+            ok = True
+            if job.error is None:
+                try:
+                    self.handler(job)
+                except Exception as exc:
+                    ok = False
+                    job.error = f"{self.name}: {exc}"
+                    logging.exception("Virtual printer %s failed for %s: %s", self.name, job.label, exc)
+            self.stats.end(started - job.enqueued_at, time.monotonic() - started, ok)
+            try:
+                on_done(job)
+            except Exception as exc:
+                logging.exception("Virtual printer pipeline hand-off failed after %s: %s", self.name, exc)
+
+    def join(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        for t in self.threads:
+            t.join(timeout=max(0.0, deadline - time.monotonic()))
+        self.threads = []
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queued": sum(q.qsize() for q in self.queues),
+            "capacity": sum(q.maxsize for q in self.queues),
+            **self.stats.snapshot(),
+        }
+
+
+class _SessionSequencer:
+    """Assigns each session's film order on admission and releases rendered films in that order.
+
+    A session is forgotten (least recently used first, beyond max_sessions)
+    only once every film it admitted was released, so its next film starts at
+    seq 0 on both sides. When the next film of a session has not arrived for
+    hold_timeout seconds, it is skipped so the films behind it are not held
+    forever; if it shows up later it is released right away.
+    """
+
+    def __init__(self, max_sessions: int = 256, hold_timeout: float = 120.0):
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.max_sessions = max_sessions
+        self.hold_timeout = hold_timeout
+        self.skipped = 0
+
+    def admit(self, session: str) -> int:
+        with self._lock:
+            state = self._sessions.get(session)
+            if state is None:
+                state = self._sessions[session] = {"assigned": 0, "next": 0, "held": {}, "stalled_at": None}
+            self._sessions.move_to_end(session)
+            seq = state["assigned"]
+            state["assigned"] += 1
+            self._evict()
+            return seq
+
+    def release(self, job: _PrintJob) -> List[_PrintJob]:
+        with self._lock:
+            state = self._sessions.get(job.session)
+            if state is None or job.seq < state["next"]:
+                # Its place in the order was already given up (see expire).
+                return [job]
+            state["held"][job.seq] = job
+            ready = self._drain(state)
+            if ready or state["stalled_at"] is None:
+                state["stalled_at"] = time.monotonic() if state["held"] else None
+            self._evict()
+            return ready
+
+    def expire(self, now: float) -> List[_PrintJob]:
+        """Skip films missing for hold_timeout and release what was waiting behind them."""
+        ready = []
+        with self._lock:
+            for session, state in self._sessions.items():
+                stalled_at = state["stalled_at"]
+                if stalled_at is None or now - stalled_at < self.hold_timeout:
+                    continue
+                first = min(state["held"])
+                logging.warning(
+                    "Virtual printer skipped %s missing film(s) of session %s after %ss",
+                    first - state["next"], session, self.hold_timeout,
+                )
+                self.skipped += first - state["next"]
+                state["next"] = first
+                ready.extend(self._drain(state))
+                state["stalled_at"] = now if state["held"] else None
+            self._evict()
+        return ready
+
+    @staticmethod
+    def _drain(state: Dict[str, Any]) -> List[_PrintJob]:
+        held = state["held"]
+        ready = []
+        while state["next"] in held:
+            ready.append(held.pop(state["next"]))
+            state["next"] += 1
+        return ready
+
+    def _evict(self):
+        excess = len(self._sessions) - self.max_sessions
+        if excess <= 0:
+            return
+        drained = [s for s, st in self._sessions.items() if st["next"] >= st["assigned"] and not st["held"]]
+        for session in drained[:excess]:
+            del self._sessions[session]
+
+    def held(self) -> int:
+        with self._lock:
+            return sum(len(st["held"]) for st in self._sessions.values())
+
+
+class _FilmBatcher:
+    """Collects in-order films per session until max_films or max_wait_seconds is reached."""
+
+    def __init__(self, max_films: int, max_wait_seconds: float):
+        self.max_films = max(1, max_films)
+        self.max_wait_seconds = max(0.0, max_wait_seconds)
+        self._lock = threading.Lock()
+        self._open: "OrderedDict[str, _PrintBatch]" = OrderedDict()
+        self._opened_at: Dict[str, float] = {}
+
+    def add(self, job: _PrintJob) -> Optional[_PrintBatch]:
+        with self._lock:
+            batch = self._open.get(job.session)
+            if batch is None:
+                batch = self._open[job.session] = _PrintBatch(job.session)
+                self._opened_at[job.session] = time.monotonic()
+            batch.films.append(job)
+            if len(batch.films) >= self.max_films:
+                return self._close(job.session)
+            return None
+
+    def due(self, now: float) -> List[_PrintBatch]:
+        with self._lock:
+            expired = [s for s, opened in self._opened_at.items() if now - opened >= self.max_wait_seconds]
+            return [self._close(s) for s in expired]
+
+    def _close(self, session: str) -> _PrintBatch:
+        self._opened_at.pop(session, None)
+        return self._open.pop(session)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "open_batches": len(self._open),
+                "films_waiting": sum(len(b.films) for b in self._open.values()),
+                "max_films": self.max_films,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+
+class _StabilityTracker:
+    """Observed size/mtime of every incoming file, checked together once per tick.
+
+    A file is ready once it is non-empty and unchanged for quiet_seconds, or as
+    soon as a close-after-write event was seen for it. Files still changing stay
+    tracked without holding up the others; files that never settle are dropped
+    after timeout_seconds (the next directory scan offers them again).
+    """
+
+    def __init__(self, quiet_seconds: float, timeout_seconds: float):
+        self.quiet_seconds = max(0.0, quiet_seconds)
+        self.timeout_seconds = max(1.0, timeout_seconds)
+        self._lock = threading.Lock()
+        self._files: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._files
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._files)
+
+    def add(self, key: str, path: Path, st: os.stat_result) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if key in self._files:
+                return False
+            self._files[key] = {
+                "path": path,
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "added_at": now,
+                "changed_at": now,
+                "closed": False,
+            }
+            return True
+
+    def mark_closed(self, key: str):
+        with self._lock:
+            entry = self._files.get(key)
+            if entry is not None:
+                entry["closed"] = True
+
+    def discard(self, key: str):
+        with self._lock:
+            self._files.pop(key, None)
+
+    def check(self):
+        """One stat per tracked file: returns (ready, dropped) lists of (key, path, stat, waited)."""
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._files.items())
+        ready, dropped = [], []
+        for key, entry in entries:
+            try:
+                st = entry["path"].stat()
+            except OSError:
+                dropped.append((key, entry["path"], None, now - entry["added_at"]))
+                continue
+            if st.st_size != entry["size"] or st.st_mtime_ns != entry["mtime_ns"]:
+                entry["size"], entry["mtime_ns"], entry["changed_at"] = st.st_size, st.st_mtime_ns, now
+            if st.st_size > 0 and (entry["closed"] or now - entry["changed_at"] >= self.quiet_seconds):
+                ready.append((key, entry["path"], st, now - entry["added_at"]))
+            elif now - entry["added_at"] >= self.timeout_seconds:
+                dropped.append((key, entry["path"], st, now - entry["added_at"]))
+        return ready, dropped
+
+
+class _SpIndex:
+    """SP (stored print) files of the database folder sorted by mtime.
+
+    Finding the SP files printed around an HG film is a bisect over this list
+    instead of a glob and a stat per SP file.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sorted: List[tuple] = []
+        self._mtimes: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._mtimes)
+
+    def add(self, name: str, mtime: float):
+        with self._lock:
+            self._remove(name)
+            self._mtimes[name] = mtime
+            bisect.insort(self._sorted, (mtime, name))
+
+    def remove(self, name: str):
+        with self._lock:
+            self._remove(name)
+
+    def _remove(self, name: str):
+        mtime = self._mtimes.pop(name, None)
+        if mtime is None:
+            return
+        idx = bisect.bisect_left(self._sorted, (mtime, name))
+        if idx < len(self._sorted) and self._sorted[idx] == (mtime, name):
+            del self._sorted[idx]
+
+    def replace(self, entries: Dict[str, float]):
+        """Resynchronize with a full directory scan."""
+        with self._lock:
+            self._mtimes = dict(entries)
+            self._sorted = sorted((mtime, name) for name, mtime in entries.items())
+
+    def take_window(self, center: float, window: float) -> List[str]:
+        """Remove and return SP names with |mtime - center| <= window."""
+        with self._lock:
+            lo = bisect.bisect_left(self._sorted, (center - window, ""))
+            hi = lo
+            while hi < len(self._sorted) and self._sorted[hi][0] <= center + window:
+                hi += 1
+            names = [name for _, name in self._sorted[lo:hi]]
+            del self._sorted[lo:hi]
+            for name in names:
+                self._mtimes.pop(name, None)
+            return names
+
+
+class _HgEventHandler(FileSystemEventHandler):
+    """Feeds HG files created in (or moved into) the database directory to the runtime."""
+
+    def __init__(self, runtime: "DicomPrinterRuntime"):
+        super().__init__()
+        self.runtime = runtime
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.runtime._offer(Path(event.src_path))
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.runtime._sp_removed(Path(event.src_path))
+            self.runtime._offer(Path(event.dest_path))
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.runtime._sp_removed(Path(event.src_path))
+
+    def on_closed(self, event):
+        # Close-after-write (inotify IN_CLOSE_WRITE); not emitted on every platform.
+        if not event.is_directory:
+            self.runtime._file_closed(Path(event.src_path))
+
+
 class DicomPrinterRuntime:
     def __init__(self, root_dir: Path, config: dict):
         self.root_dir = Path(root_dir)
@@ -22,7 +535,26 @@ class DicomPrinterRuntime:
         self.worker_thread = None
         self.receiver_proc = None
         self.generated_cfg_path = self.root_dir / "dicom-printer" / "runtime_printer.cfg"
-        self._processed = set()
+        self.jobs_dir = self.root_dir / "dicom-printer" / "jobs"
+        self._index: Optional[ProcessedFileIndex] = None
+        self._jobs: Optional[PrintJobJournal] = None
+        self._tracker = _StabilityTracker(
+            self.config["worker"]["stable_seconds"], self.config["worker"]["stable_timeout_seconds"]
+        )
+        self._wake = threading.Event()
+        self._sp_index = _SpIndex()
+        self._sweeper_thread = None
+        self._sweep_stats: Dict[str, Any] = {"runs": 0, "deleted_files": 0, "freed_mb": 0.0, "usage_mb": None, "last_run": None}
+        self._observer = None
+        self._ingest_stats = _StageStats()
+        self._stages: Dict[str, _PipelineStage] = {}
+        self._sequencer = _SessionSequencer()
+        self._batcher: Optional[_FilmBatcher] = None
+        self._handoff_lock = threading.Lock()
+        self._batch_thread = None
+        self._native_scp = None
+        self._gap_session = 0
+        self._last_film_time = None
 
     def _normalize_config(self, cfg: dict) -> dict:
         base = self.root_dir / "dicom-printer"
@@ -38,6 +570,8 @@ class DicomPrinterRuntime:
                 "port": int(receiver.get("port", 4100) or 4100),
                 "dcmtk_bin": str(receiver.get("dcmtk_bin", r"C:\dcmtk\bin")).strip() or r"C:\dcmtk\bin",
                 "spool_dir": str(worker.get("spool_dir", str(base / "spool"))).strip() or str(base / "spool"),
+                "mode": "native" if str(receiver.get("mode", "")).strip().lower() == "native" else "dcmtk",
+                "bind_address": str(receiver.get("bind_address", "")).strip(),
             },
             "worker": {
                 "database_dir": str(worker.get("database_dir", str(base / "database"))).strip() or str(base / "database"),
@@ -49,14 +583,51 @@ class DicomPrinterRuntime:
                 "delete_after_success": _to_bool(worker.get("delete_after_success"), False),
                 "sp_time_window_seconds": int(worker.get("sp_time_window_seconds", 120) or 120),
                 "poll_interval_seconds": float(worker.get("poll_interval_seconds", 1.0) or 1.0),
+                "stable_seconds": float(worker.get("stable_seconds", 0.5) or 0.5),
+                "stable_timeout_seconds": float(worker.get("stable_timeout_seconds", 300) or 300),
+                "watch_mode": self._watch_mode(worker.get("watch_mode")),
+                "reconcile_interval_seconds": float(worker.get("reconcile_interval_seconds", 60) or 60),
+                "render_workers": max(1, int(worker.get("render_workers", 2) or 2)),
+                "compose_workers": max(1, int(worker.get("compose_workers", 2) or 2)),
+                "spool_workers": max(1, int(worker.get("spool_workers", 1) or 1)),
+                "stage_queue_size": max(1, int(worker.get("stage_queue_size", 16) or 16)),
+                "session_gap_seconds": float(worker.get("session_gap_seconds", 10) or 10),
+                "batch_max_films": max(1, int(worker.get("batch_max_films", 20) or 20)),
+                "batch_max_wait_seconds": float(worker.get("batch_max_wait_seconds", 5) or 5),
+                "renderer": self._renderer(worker.get("renderer")),
+                "processed_retention_days": float(worker.get("processed_retention_days", 30) or 30),
+                "processed_max_entries": int(worker.get("processed_max_entries", 100000) or 100000),
+                "retention_days": max(0.0, float(worker.get("retention_days", 0) or 0)),
+                "disk_quota_mb": max(0, int(worker.get("disk_quota_mb", 0) or 0)),
+                "sweep_interval_seconds": max(60.0, float(worker.get("sweep_interval_seconds", 600) or 600)),
+                "print_dpi": max(0, int(worker.get("print_dpi", 0) or 0)),
+                "pdf_compression": "jpeg" if str(worker.get("pdf_compression", "")).strip().lower() == "jpeg" else "lossless",
+                "jpeg_quality": min(100, max(10, int(worker.get("jpeg_quality", 90) or 90))),
+                "retry_max_attempts": max(1, int(worker.get("retry_max_attempts", 5) or 5)),
+                "retry_backoff_seconds": max(1.0, float(worker.get("retry_backoff_seconds", 10) or 10)),
+                "retry_backoff_max_seconds": max(1.0, float(worker.get("retry_backoff_max_seconds", 600) or 600)),
             },
         }
 
+    @staticmethod
+    def _watch_mode(raw) -> str:
+        mode = str(raw or "auto").strip().lower()
+        return mode if mode in ("auto", "events", "poll") else "auto"
+
+    @staticmethod
+    def _renderer(raw) -> str:
+        renderer = str(raw or "auto").strip().lower()
+        return renderer if renderer in ("auto", "python", "dcm2img") else "auto"
+
     def start(self):
         self._prepare_directories()
-        self._write_runtime_cfg()
-        self._start_receiver()
-        self._start_worker()
+        if self.config["receiver"]["mode"] == "native":
+            self._start_worker()
+            self._start_native_receiver()
+        else:
+            self._write_runtime_cfg()
+            self._start_receiver()
+            self._start_worker()
         logging.info(
             "Virtual DICOM printer enabled: receiver AET=%s port=%s",
             self.config["receiver"]["aet"],
@@ -64,10 +635,28 @@ class DicomPrinterRuntime:
         )
 
     def stop(self):
+        if self._native_scp is not None:
+            self._native_scp.stop()
+            self._native_scp = None
         self.stop_event.set()
+        self._stop_watcher()
         if self.worker_thread and self.worker_thread.is_alive():
             self.worker_thread.join(timeout=8)
         self.worker_thread = None
+        for stage in self._stages.values():
+            stage.join(timeout=8)
+        if self._batch_thread and self._batch_thread.is_alive():
+            self._batch_thread.join(timeout=2)
+        self._batch_thread = None
+        if self._sweeper_thread and self._sweeper_thread.is_alive():
+            self._sweeper_thread.join(timeout=5)
+        self._sweeper_thread = None
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        if self._jobs is not None:
+            self._jobs.close()
+            self._jobs = None
 
         if self.receiver_proc:
             try:
@@ -86,6 +675,7 @@ class DicomPrinterRuntime:
         Path(self.config["worker"]["database_dir"]).mkdir(parents=True, exist_ok=True)
         Path(self.config["worker"]["out_dir"]).mkdir(parents=True, exist_ok=True)
         self.generated_cfg_path.parent.mkdir(parents=True, exist_ok=True)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
 
     def _write_runtime_cfg(self):
         receiver = self.config["receiver"]
@@ -149,62 +739,484 @@ class DicomPrinterRuntime:
         if self.receiver_proc.poll() is not None:
             raise RuntimeError("dcmprscp exited immediately; check printer configuration/log output")
 
+    def _start_native_receiver(self):
+        from dicom_printer_scp import NativePrintSCP
+
+        receiver = self.config["receiver"]
+        self._native_scp = NativePrintSCP(
+            receiver["aet"], receiver["port"], self.submit_film_box, bind_address=receiver["bind_address"]
+        )
+        self._native_scp.start()
+
+    def submit_film_box(self, session_uid: str, name: str, display_format: str, boxes: List[Any]):
+        """Queue a film box received by the native Print SCP (blocks while the render queue is full).
+
+        The image boxes are journaled to disk before returning, so a printed
+        film box survives a crash once the SCP has answered the N-ACTION.
+        """
+        session = f"scp-{session_uid}"
+        job_id = self._jobs.receive(name, session)
+        self._write_atomic(self.jobs_dir / f"{job_id}.boxes", encode_image_boxes(display_format, boxes))
+        job = _PrintJob(None, session, self._sequencer.admit(session), name=name, boxes=boxes, display_format=display_format)
+        job.job_id = job_id
+        if not self._stages["render"].put(job, self.stop_event):
+            raise RuntimeError("virtual printer is stopping")
+
     def _start_worker(self):
+        self._open_index()
+        self._start_pipeline()
+        worker_cfg = self.config["worker"]
+        if worker_cfg["retention_days"] or worker_cfg["disk_quota_mb"]:
+            # Opt-in: without retention or quota nothing is ever deleted.
+            self._sweeper_thread = threading.Thread(target=self._sweeper_loop, name="dicom-printer-sweeper", daemon=True)
+            self._sweeper_thread.start()
         self.worker_thread = threading.Thread(target=self._worker_loop, name="dicom-printer-worker", daemon=True)
         self.worker_thread.start()
 
+    def _start_watcher(self, db_dir: Path) -> bool:
+        mode = self.config["worker"]["watch_mode"]
+        if mode == "poll":
+            return False
+        if Observer is None:
+            if mode == "events":
+                logging.warning("Virtual printer watch_mode=events needs the watchdog package; polling instead")
+            return False
+        try:
+            observer = Observer()
+            observer.schedule(_HgEventHandler(self), str(db_dir), recursive=False)
+            observer.start()
+        except Exception as exc:
+            logging.warning("Virtual printer directory events unavailable (%s); polling instead", exc)
+            return False
+        self._observer = observer
+        return True
+
+    def _stop_watcher(self):
+        observer, self._observer = self._observer, None
+        if observer is None:
+            return
+        try:
+            observer.stop()
+            observer.join(timeout=5)
+        except Exception:
+            pass
+
+    def _open_index(self):
+        worker_cfg = self.config["worker"]
+        self._index = ProcessedFileIndex(
+            self.root_dir / "dicom-printer" / PROCESSED_FILE_NAME,
+            worker_cfg["processed_retention_days"] * 86400,
+            worker_cfg["processed_max_entries"],
+        )
+        self._jobs = PrintJobJournal(
+            self.root_dir / "dicom-printer" / JOBS_FILE_NAME,
+            worker_cfg["retry_max_attempts"],
+            worker_cfg["retry_backoff_seconds"],
+            worker_cfg["retry_backoff_max_seconds"],
+            worker_cfg["processed_retention_days"] * 86400,
+        )
+        resumed = self._jobs.resume()
+        if resumed:
+            logging.info("Virtual printer resuming %s unfinished print jobs", resumed)
+        if not self._index.created:
+            return
+        # First start with an index: HG files older than an hour were handled by the
+        # previous (in-memory) worker; record them instead of printing them again.
+        cutoff = time.time() - 3600
+        seeded = []
+        try:
+            with os.scandir(worker_cfg["database_dir"]) as entries:
+                for entry in entries:
+                    if _is_hg_name(entry.name):
+                        st = entry.stat()
+                        if st.st_mtime < cutoff:
+                            seeded.append((entry.name, st.st_size, st.st_mtime_ns))
+        except FileNotFoundError:
+            pass
+        self._index.mark_many(seeded)
+        if seeded:
+            logging.info("Virtual printer processed index created; %s existing HG files marked as printed", len(seeded))
+
+    def _offer(self, path: Path, st: Optional[os.stat_result] = None):
+        """Track an HG file once; files already tracked or in the processed index are ignored."""
+        if _is_sp_name(path.name):
+            try:
+                self._sp_index.add(path.name, (st or path.stat()).st_mtime)
+            except OSError:
+                pass
+            return
+        if not _is_hg_name(path.name):
+            return
+        key = path.name.lower()
+        if key in self._tracker:
+            return
+        try:
+            st = st or path.stat()
+        except OSError:
+            return
+        index = self._index
+        if index is not None:
+            if st.st_mtime < time.time() - index.retention_seconds:
+                # Older than the index remembers: never print it again.
+                return
+            if index.seen(path.name, st.st_size, st.st_mtime_ns):
+                return
+        if self._tracker.add(key, path, st):
+            self._ingest_stats.begin()
+            self._wake.set()
+
+    def _sp_removed(self, path: Path):
+        if _is_sp_name(path.name):
+            self._sp_index.remove(path.name)
+
+    def _file_closed(self, path: Path):
+        if _is_hg_name(path.name):
+            self._tracker.mark_closed(path.name.lower())
+            self._wake.set()
+
+    def _reconcile(self, db_dir: Path):
+        """Offer every HG file and re-index SP files (startup, polling, and missed events)."""
+        found, sp_files = [], {}
+        try:
+            with os.scandir(db_dir) as entries:
+                for e in entries:
+                    if _is_hg_name(e.name):
+                        found.append((e.name, e.stat()))
+                    elif _is_sp_name(e.name):
+                        sp_files[e.name] = e.stat().st_mtime
+        except FileNotFoundError:
+            return
+        self._sp_index.replace(sp_files)
+        for name, st in sorted(found):
+            self._offer(db_dir / name, st)
+
+    def _start_pipeline(self):
+        worker_cfg = self.config["worker"]
+        size = worker_cfg["stage_queue_size"]
+        compose_workers = worker_cfg["compose_workers"]
+        spool_workers = worker_cfg["spool_workers"]
+        self._batcher = _FilmBatcher(worker_cfg["batch_max_films"], worker_cfg["batch_max_wait_seconds"])
+        # Compose and spool use one lane per worker so a session's batches stay in order.
+        self._stages = {
+            "render": _PipelineStage("render", self._render_job, worker_cfg["render_workers"], size),
+            "compose": _PipelineStage("compose", self._compose_batch, compose_workers, size, lanes=compose_workers),
+            "spool": _PipelineStage("spool", self._spool_batch, spool_workers, size, lanes=spool_workers),
+        }
+        self._stages["render"].start(self.stop_event, self._to_batcher)
+        self._stages["compose"].start(
+            self.stop_event,
+            lambda batch: self._stages["spool"].put(batch, self.stop_event, lane=_lane(batch.session)),
+        )
+        self._stages["spool"].start(self.stop_event, self._batch_done)
+        self._batch_thread = threading.Thread(target=self._batch_timer, name="dicom-printer-batcher", daemon=True)
+        self._batch_thread.start()
+
+    def _to_batcher(self, job: _PrintJob):
+        """Rendered films re-enter session order here, then join their session's batch."""
+        with self._handoff_lock:
+            self._batch_ready(self._sequencer.release(job))
+
+    def _batch_ready(self, films: List[_PrintJob]):
+        """In-order films join their session's batch; caller holds _handoff_lock."""
+        for ready in films:
+            if ready.error:
+                logging.error("Virtual printer failed processing %s: %s", ready.label, ready.error)
+                self._jobs_failed([ready], ready.error)
+                continue
+            batch = self._batcher.add(ready)
+            if batch is not None:
+                self._to_compose(batch)
+
+    def _batch_timer(self):
+        while not self.stop_event.wait(0.25):
+            try:
+                with self._handoff_lock:
+                    self._batch_ready(self._sequencer.expire(time.monotonic()))
+                    for batch in self._batcher.due(time.monotonic()):
+                        self._to_compose(batch)
+            except Exception as exc:
+                logging.exception("Virtual printer batch timer error: %s", exc)
+
+    def _to_compose(self, batch: _PrintBatch):
+        self._stages["compose"].put(batch, self.stop_event, lane=_lane(batch.session))
+
+    def _batch_done(self, batch: _PrintBatch):
+        if batch.error:
+            logging.error("Virtual printer failed processing %s: %s", batch.label, batch.error)
+            self._jobs_failed(batch.films, batch.error)
+
+    def _jobs_failed(self, jobs: List[_PrintJob], error: str):
+        """Schedule the jobs' retry; jobs out of attempts stay failed in the journal."""
+        exhausted = set(self._jobs.fail([job.job_id for job in jobs], error))
+        for job in jobs:
+            if job.job_id in exhausted:
+                logging.error(
+                    "Virtual printer gave up on %s after %s attempts", job.label, self.config["worker"]["retry_max_attempts"]
+                )
+                self._discard_checkpoints(job)
+
+    def _discard_checkpoints(self, job: _PrintJob):
+        self._safe_delete(self.jobs_dir / f"{job.job_id}.pgm")
+        self._safe_delete(self.jobs_dir / f"{job.job_id}.boxes")
+        if job.png_path is not None:
+            # dcm2img fallback output is only an intermediate.
+            self._safe_delete(job.png_path)
+            job.png_path = None
+
+    def _resume_due(self):
+        """Re-queue unfinished jobs whose retry time has come (after a restart: all of them).
+
+        Each job restarts after its last completed stage: spooled jobs are only
+        printed again, rendered jobs reload their film checkpoint. When that
+        output is gone the job falls back to the previous stage.
+        """
+        rows = self._jobs.due(time.time(), self.config["worker"]["stage_queue_size"])
+        spooled: Dict[str, _PrintBatch] = {}
+        for row in rows:
+            job = _PrintJob(Path(row["source"]) if row["source"] else None, row["session"], 0, name=row["name"])
+            job.job_id = row["id"]
+            job.center_time = row["center_time"]
+            pdf_path = row["pdf_path"]
+            if row["state"] == JOB_SPOOLED and pdf_path and Path(pdf_path).exists():
+                batch = spooled.get(pdf_path)
+                if batch is None:
+                    batch = spooled[pdf_path] = _PrintBatch(job.session)
+                    batch.pdf_path = Path(pdf_path)
+                batch.films.append(job)
+                continue
+            if row["state"] in (JOB_RENDERED, JOB_SPOOLED) and self._load_checkpoint(job, row["film_path"]):
+                job.seq = self._sequencer.admit(job.session)
+                self._to_batcher(job)
+                continue
+            if not self._load_source(job):
+                logging.error("Virtual printer cannot resume %s: its film is no longer available", job.label)
+                self._jobs.give_up([job.job_id], "source missing on resume")
+                self._discard_checkpoints(job)
+                continue
+            job.seq = self._sequencer.admit(job.session)
+            self._stages["render"].put(job, self.stop_event)
+        for batch in spooled.values():
+            self._stages["spool"].put(batch, self.stop_event, lane=_lane(batch.session))
+
+    def _load_checkpoint(self, job: _PrintJob, film_path: Optional[str]) -> bool:
+        if not film_path:
+            return False
+        path = Path(film_path)
+        try:
+            if path.suffix.lower() == ".png":
+                if not path.exists():
+                    return False
+                job.png_path = path
+            else:
+                job.film = film_from_pgm(path.read_bytes())
+            return True
+        except (OSError, ValueError) as exc:
+            logging.warning("Virtual printer render checkpoint of %s unusable (%s); rendering again", job.label, exc)
+            return False
+
+    def _load_source(self, job: _PrintJob) -> bool:
+        if job.hg_path is not None:
+            return job.hg_path.exists()
+        try:
+            job.display_format, job.boxes = decode_image_boxes((self.jobs_dir / f"{job.job_id}.boxes").read_bytes())
+            return True
+        except (OSError, ValueError, KeyError) as exc:
+            logging.warning("Virtual printer image box checkpoint of %s unusable: %s", job.label, exc)
+            return False
+
+    def _film_session(self, hg_path: Path) -> str:
+        """Group films by Film Session (HG study UID); without it, by arrival gap."""
+        try:
+            session = film_session_key(hg_path)
+        except Exception:
+            session = None
+        if session is None:
+            try:
+                film_time = hg_path.stat().st_mtime
+            except OSError:
+                film_time = time.time()
+            gap = self.config["worker"]["session_gap_seconds"]
+            if self._last_film_time is None or abs(film_time - self._last_film_time) > gap:
+                self._gap_session += 1
+            self._last_film_time = film_time
+            session = f"gap-{self._gap_session}"
+        return session
+
+    def stats(self) -> Dict[str, Any]:
+        stages = {
+            "ingest": {
+                "workers": 1,
+                "queued": 0,
+                "capacity": None,
+                **self._ingest_stats.snapshot(),
+            }
+        }
+        for name, stage in self._stages.items():
+            stages[name] = stage.snapshot()
+        batching = self._batcher.snapshot() if self._batcher is not None else None
+        return {
+            "stages": stages,
+            "held_for_order": self._sequencer.held(),
+            "skipped_for_order": self._sequencer.skipped,
+            "batching": batching,
+            "processed_index": self._index.stats() if self._index is not None else None,
+            "jobs": self._jobs.stats() if self._jobs is not None else None,
+            "sp_index": len(self._sp_index),
+            "sweeper": dict(self._sweep_stats),
+        }
+
+    def _publish_status(self):
+        try:
+            path = self.root_dir / "dicom-printer" / PIPELINE_STATUS_FILE
+            snapshot = {"pid": os.getpid(), "updated_at": datetime.now().isoformat(), **self.stats()}
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(snapshot, indent=2), encoding="utf-8")
+            tmp.replace(path)
+        except Exception as exc:
+            logging.warning("Virtual printer status snapshot failed: %s", exc)
+
     def _worker_loop(self):
+        """Ingest stage: detect HG files, track them until stable, and feed the render stage."""
         worker_cfg = self.config["worker"]
         db_dir = Path(worker_cfg["database_dir"])
         poll = max(0.25, float(worker_cfg["poll_interval_seconds"]))
-        logging.info("Virtual printer worker started. Watching: %s", db_dir)
+        tick = min(0.25, max(0.05, worker_cfg["stable_seconds"] / 2))
+        events = self._start_watcher(db_dir)
+        # With events the scan is only a safety net for missed notifications.
+        rescan = max(poll, float(worker_cfg["reconcile_interval_seconds"])) if events else poll
+        logging.info(
+            "Virtual printer worker started. Watching: %s (%s)",
+            db_dir,
+            "directory events" if events else f"polling every {poll}s",
+        )
+        next_scan = 0.0
+        next_status = 0.0
+        next_compact = time.monotonic() + 60
+        next_resume = 0.0
         while not self.stop_event.is_set():
             try:
-                for dcm_file in sorted(db_dir.glob("HG_*.dcm")):
-                    key = str(dcm_file.resolve()).lower()
-                    if key in self._processed:
-                        continue
-                    if not self._wait_stable(dcm_file):
-                        continue
-                    self._processed.add(key)
-                    self._process_hg(dcm_file)
+                now = time.monotonic()
+                if now >= next_status:
+                    self._publish_status()
+                    next_status = now + 5.0
+                if now >= next_compact:
+                    self._index.compact()
+                    self._jobs.compact()
+                    next_compact = now + 3600
+                if now >= next_resume:
+                    self._resume_due()
+                    next_resume = time.monotonic() + 1.0
+                if now >= next_scan:
+                    self._reconcile(db_dir)
+                    next_scan = time.monotonic() + rescan
+                if len(self._tracker):
+                    self._ingest_ready()
+                    self.stop_event.wait(tick)
+                else:
+                    self._wake.wait(max(0.05, min(1.0, next_scan - time.monotonic())))
+                self._wake.clear()
             except Exception as exc:
                 logging.exception("Virtual printer worker loop error: %s", exc)
-            self.stop_event.wait(poll)
+                self.stop_event.wait(poll)
+
+    def _ingest_ready(self):
+        ready, dropped = self._tracker.check()
+        for key, path, st, waited in dropped:
+            self._tracker.discard(key)
+            self._ingest_stats.end(waited, 0.0, False)
+            if st is not None:
+                logging.warning("Virtual printer gave up waiting for %s to finish writing", path.name)
+        for key, path, st, waited in ready:
+            session = self._film_session(path)
+            # Journaled before the processed index, so a crash in between cannot lose the film;
+            # a file already journaled (crash before the index write) resumes from the journal.
+            job_id = self._jobs.receive(
+                path.name, session, str(path), (path.name, st.st_size, st.st_mtime_ns), st.st_mtime
+            )
+            # Recorded before leaving the tracker so a concurrent offer cannot queue it twice.
+            self._index.mark(path.name, st.st_size, st.st_mtime_ns)
+            self._tracker.discard(key)
+            self._ingest_stats.end(waited, 0.0, True)
+            if job_id is None:
+                continue
+            job = _PrintJob(path, session, self._sequencer.admit(session))
+            job.job_id = job_id
+            job.center_time = st.st_mtime
+            self._stages["render"].put(job, self.stop_event)
 
-    def _wait_stable(self, path: Path, timeout=20):
-        deadline = time.time() + timeout
-        last_size = -1
-        while time.time() < deadline and not self.stop_event.is_set():
+    def _render_job(self, job: _PrintJob):
+        self._render(job)
+        # Checkpoint so a resumed job goes straight to composition.
+        if job.film is not None:
+            film_path = self.jobs_dir / f"{job.job_id}.pgm"
+            self._write_atomic(film_path, film_to_pgm(job.film))
+        else:
+            film_path = job.png_path
+        self._jobs.advance([job.job_id], JOB_RENDERED, film_path=str(film_path))
+
+    def _render(self, job: _PrintJob):
+        if job.boxes is not None:
+            job.film = self._render_boxes(job)
+            job.boxes = None
+            return
+        if job.center_time is None:
+            job.center_time = job.hg_path.stat().st_mtime
+        renderer = self.config["worker"]["renderer"]
+        if renderer != "dcm2img":
             try:
-                size = path.stat().st_size
-            except FileNotFoundError:
-                time.sleep(0.2)
+                job.film = render_film(job.hg_path)
+                return
+            except (UnsupportedFilm, ImportError) as exc:
+                if renderer == "python":
+                    raise
+                logging.info("Virtual printer using dcm2img for %s: %s", job.hg_path.name, exc)
+        job.png_path = self._dicom_to_png(job.hg_path)
+
+    def _render_boxes(self, job: _PrintJob) -> RenderedFilm:
+        """Native Print SCP film box: render each image box and lay them out on one film."""
+        cols, rows, cell_of = display_layout(job.display_format)
+        cells: List[Optional[RenderedFilm]] = [None] * (cols * rows)
+        for box in job.boxes:
+            if not 1 <= box.position <= len(cell_of):
                 continue
-            if size > 0 and size == last_size:
-                return True
-            last_size = size
-            time.sleep(0.3)
-        return False
+            film = render_pixels(box.attrs, box.pixels, box.byte_order)
+            if box.polarity == "REVERSE":
+                film = invert(film)
+            cells[cell_of[box.position - 1]] = film
+        return tile_films(cells, cols, rows)
 
-    def _process_hg(self, hg_path: Path):
-        png_path = None
-        pdf_path = None
+    def _compose_batch(self, batch: _PrintBatch):
+        pages = []
+        for job in batch.films:
+            pages.append(self._page_image(job.film if job.film is not None else job.png_path))
+            job.film = None
+        batch.pdf_bytes = self._compose_pdf(pages)
+
+    def _spool_batch(self, batch: _PrintBatch):
         worker_cfg = self.config["worker"]
-        try:
-            center_time = hg_path.stat().st_mtime
-            png_path = self._dicom_to_png(hg_path)
-            pdf_path = self._png_to_pdf(png_path)
-            self._print_pdf(pdf_path)
-            logging.info("Virtual printer sent to printer: %s", hg_path.name)
-
-            if worker_cfg["delete_after_success"]:
-                self._safe_delete(pdf_path)
-                self._safe_delete(png_path)
-                self._safe_delete(hg_path)
-                self._delete_related_sp(center_time, Path(worker_cfg["database_dir"]), int(worker_cfg["sp_time_window_seconds"]))
-        except Exception as exc:
-            logging.exception("Virtual printer failed processing %s: %s", hg_path.name, exc)
+        job_ids = [job.job_id for job in batch.films]
+        if batch.pdf_bytes is not None:
+            name = batch.films[0].name
+            stem = name[:-4] if name.lower().endswith(".dcm") else name
+            batch.pdf_path = self._write_spool(f"{stem}.pdf", batch.pdf_bytes)
+            batch.pdf_bytes = None
+            self._jobs.advance(job_ids, JOB_SPOOLED, pdf_path=str(batch.pdf_path))
+        self._print_pdf(batch.pdf_path)
+        # A crash before this line prints the spooled PDF again on resume.
+        self._jobs.advance(job_ids, JOB_PRINTED)
+        logging.info("Virtual printer sent to printer: %s", batch.label)
+        for job in batch.films:
+            self._discard_checkpoints(job)
+
+        if worker_cfg["delete_after_success"]:
+            self._safe_delete(batch.pdf_path)
+            db_dir = Path(worker_cfg["database_dir"])
+            window = int(worker_cfg["sp_time_window_seconds"])
+            for job in batch.films:
+                if job.hg_path is None:
+                    continue
+                self._safe_delete(job.hg_path)
+                self._delete_related_sp(job.center_time, db_dir, window)
 
     def _dicom_to_png(self, dcm_path: Path) -> Path:
         worker_cfg = self.config["worker"]
@@ -233,24 +1245,67 @@ class DicomPrinterRuntime:
         }
         return mapping.get(paper, A3)
 
-    def _png_to_pdf(self, png_path: Path) -> Path:
+    def _page_image(self, source):
+        """ImageReader for one film, downsampled to print_dpi and encoded per pdf_compression."""
+        from PIL import Image
         from reportlab.lib.utils import ImageReader
+
+        worker_cfg = self.config["worker"]
+        if isinstance(source, RenderedFilm):
+            img = source.to_image()
+        else:
+            with Image.open(str(source)) as opened:
+                img = opened.copy()
+
+        dpi = worker_cfg["print_dpi"]
+        if dpi:
+            w, h = self._page_size()
+            iw, ih = img.size
+            scale = min(w / iw, h / ih) * dpi / 72.0
+            if scale < 1.0:
+                img = img.resize((max(1, round(iw * scale)), max(1, round(ih * scale))), Image.LANCZOS)
+
+        if worker_cfg["pdf_compression"] == "jpeg":
+            if img.mode not in ("L", "RGB"):
+                img = img.convert("L" if img.mode in ("1", "I", "I;16", "LA") else "RGB")
+            buf = BytesIO()
+            img.save(buf, "JPEG", quality=worker_cfg["jpeg_quality"])
+            buf.seek(0)
+            # reportlab embeds JPEG data as-is (DCTDecode).
+            return ImageReader(buf)
+        return ImageReader(img)
+
+    def _compose_pdf(self, pages: List[Any]) -> bytes:
+        """One page per image, centered and scaled to the paper size; built in memory."""
         from reportlab.pdfgen import canvas
 
-        pdf_path = png_path.with_suffix(".pdf")
-        img = ImageReader(str(png_path))
-        iw, ih = img.getSize()
         w, h = self._page_size()
-
-        c = canvas.Canvas(str(pdf_path), pagesize=(w, h))
-        scale = min(w / iw, h / ih)
-        nw, nh = iw * scale, ih * scale
-        x = (w - nw) / 2
-        y = (h - nh) / 2
-        c.drawImage(img, x, y, width=nw, height=nh, preserveAspectRatio=True, mask="auto")
-        c.showPage()
+        buf = BytesIO()
+        c = canvas.Canvas(buf, pagesize=(w, h), pageCompression=1)
+        for img in pages:
+            iw, ih = img.getSize()
+            scale = min(w / iw, h / ih)
+            nw, nh = iw * scale, ih * scale
+            x = (w - nw) / 2
+            y = (h - nh) / 2
+            c.drawImage(img, x, y, width=nw, height=nh, preserveAspectRatio=True, mask="auto")
+            c.showPage()
         c.save()
-        return pdf_path
+        return buf.getvalue()
+
+    def _write_spool(self, name: str, data: bytes) -> Path:
+        """Write the spool PDF once; the rename keeps half-written files away from the printer."""
+        return self._write_atomic(Path(self.config["worker"]["out_dir"]) / name, data)
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes) -> Path:
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+        return path
 
     def _print_pdf(self, pdf_path: Path):
         worker_cfg = self.config["worker"]
@@ -276,16 +1331,94 @@ class DicomPrinterRuntime:
 
     def _delete_related_sp(self, center_time: float, db_dir: Path, window_seconds: int):
         deleted = 0
-        for sp in db_dir.glob("SP_*.dcm"):
+        for name in self._sp_index.take_window(center_time, window_seconds):
             try:
-                if abs(sp.stat().st_mtime - center_time) <= window_seconds:
-                    sp.unlink(missing_ok=True)
-                    deleted += 1
+                (db_dir / name).unlink(missing_ok=True)
+                deleted += 1
             except Exception:
                 pass
         if deleted:
             logging.info("Virtual printer deleted related SP files: %s", deleted)
 
+    def _sweeper_loop(self):
+        interval = self.config["worker"]["sweep_interval_seconds"]
+        # First pass shortly after start, then every sweep_interval_seconds.
+        wait = min(60.0, interval)
+        while not self.stop_event.wait(wait):
+            try:
+                self._sweep()
+            except Exception as exc:
+                logging.exception("Virtual printer retention sweep failed: %s", exc)
+            wait = interval
+
+    def _sweep(self):
+        """Delete printer files past retention_days, then oldest files while over disk_quota_mb.
+
+        HG files are only deleted once printed (in the processed index) or older
+        than the index retention; files touched in the last hour are never evicted
+        for quota.
+        """
+        worker_cfg = self.config["worker"]
+        db_dir = Path(worker_cfg["database_dir"])
+        folders = []
+        for folder in (db_dir, Path(self.config["receiver"]["spool_dir"]), Path(worker_cfg["out_dir"])):
+            if folder not in folders:
+                folders.append(folder)
+        now = time.time()
+        index = self._index
+        # Sources, checkpoints and PDFs of unfinished jobs are kept until the job ends.
+        active = self._jobs.active_paths() if self._jobs is not None else set()
+        files = []
+        for folder in folders:
+            try:
+                with os.scandir(folder) as entries:
+                    for e in entries:
+                        if not e.is_file() or not e.name.lower().endswith(SWEEP_SUFFIXES):
+                            continue
+                        if folder == db_dir and not (_is_hg_name(e.name) or _is_sp_name(e.name)):
+                            continue
+                        if str(Path(e.path)) in active:
+                            continue
+                        st = e.stat()
+                        if _is_hg_name(e.name) and folder == db_dir:
+                            printed = index is not None and (
+                                index.seen(e.name, st.st_size, st.st_mtime_ns)
+                                or st.st_mtime < now - index.retention_seconds
+                            )
+                            if not printed or e.name.lower() in self._tracker:
+                                continue
+                        files.append((st.st_mtime, st.st_size, Path(e.path)))
+            except FileNotFoundError:
+                continue
+        files.sort()
+        usage = sum(size for _, size, _ in files)
+        retention = worker_cfg["retention_days"] * 86400
+        quota = worker_cfg["disk_quota_mb"] * 1024 * 1024
+        deleted = freed = 0
+        for mtime, size, path in files:
+            expired = retention and mtime < now - retention
+            over_quota = quota and usage - freed > quota and mtime < now - 3600
+            if not (expired or over_quota):
+                if not quota or usage - freed <= quota:
+                    break
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            if _is_sp_name(path.name):
+                self._sp_index.remove(path.name)
+            deleted += 1
+            freed += size
+        stats = self._sweep_stats
+        stats["runs"] += 1
+        stats["deleted_files"] += deleted
+        stats["freed_mb"] = round(stats["freed_mb"] + freed / 1048576.0, 2)
+        stats["usage_mb"] = round((usage - freed) / 1048576.0, 2)
+        stats["last_run"] = datetime.now().isoformat(timespec="seconds")
+        if deleted:
+            logging.info("Virtual printer sweeper deleted %s files (%.1f MB)", deleted, freed / 1048576.0)
+
     def _safe_delete(self, path: Optional[Path]):
         if not path:
             return
@@ -0,0 +1,402 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+
+PROCESSED_FILE_NAME = "processed.sqlite3"
+JOBS_FILE_NAME = "print_jobs.sqlite3"
+
+JOB_RECEIVED = "received"
+JOB_RENDERED = "rendered"
+JOB_SPOOLED = "spooled"
+JOB_PRINTED = "printed"
+JOB_FAILED = "failed"
+JOB_STATES = (JOB_RECEIVED, JOB_RENDERED, JOB_SPOOLED, JOB_PRINTED, JOB_FAILED)
+_ACTIVE_STATES = (JOB_RECEIVED, JOB_RENDERED, JOB_SPOOLED)
+_ACTIVE_SQL = "(%s)" % ", ".join("'%s'" % state for state in _ACTIVE_STATES)
+
+_BOXES_MAGIC = b"FWBOXES1"
+
+
+class ProcessedFileIndex:
+    """HG files already taken by the print worker, keyed by (name, size, mtime_ns).
+
+    Replaces the in-memory set so restarts do not print leftover files again and
+    memory stays flat: SQLite holds the index, a small LRU memo answers repeated
+    lookups from directory rescans. Entries older than retention_seconds, and the
+    oldest beyond max_entries, are dropped by compact(); files that old are never
+    offered again (see DicomPrinterRuntime._offer).
+    """
+
+    def __init__(self, db_path: Path, retention_seconds: float, max_entries: int, memo_size: int = 4096):
+        self.db_path = Path(db_path)
+        self.retention_seconds = max(3600.0, float(retention_seconds))
+        self.max_entries = max(1000, int(max_entries))
+        self.memo_size = max(0, int(memo_size))
+        self._lock = threading.Lock()
+        self._memo: "OrderedDict[Tuple[str, int, int], None]" = OrderedDict()
+        self.created = not self.db_path.exists()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), timeout=5, check_same_thread=False)
+        # Must be set before the first table exists to take effect.
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS printer_processed ("
+            "name TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, processed_at REAL NOT NULL, "
+            "PRIMARY KEY (name, size, mtime_ns))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_printer_processed_at ON printer_processed(processed_at)")
+        self._conn.commit()
+        self._entries = int(self._conn.execute("SELECT COUNT(*) FROM printer_processed").fetchone()[0])
+        self._compacted = 0
+
+    def _remember(self, key: Tuple[str, int, int]):
+        if not self.memo_size:
+            return
+        self._memo[key] = None
+        self._memo.move_to_end(key)
+        while len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+
+    def seen(self, name: str, size: int, mtime_ns: int) -> bool:
+        key = (name.lower(), int(size), int(mtime_ns))
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return True
+            try:
+                row = self._conn.execute(
+                    "SELECT 1 FROM printer_processed WHERE name = ? AND size = ? AND mtime_ns = ?", key
+                ).fetchone()
+            except Exception as exc:
+                logging.warning("Virtual printer processed index read failed for %s: %s", name, exc)
+                return False
+            if row is not None:
+                self._remember(key)
+            return row is not None
+
+    def mark(self, name: str, size: int, mtime_ns: int) -> None:
+        self.mark_many([(name, size, mtime_ns)])
+
+    def mark_many(self, files: Iterable[Tuple[str, int, int]]) -> None:
+        now = time.time()
+        rows = [(name.lower(), int(size), int(mtime_ns), now) for name, size, mtime_ns in files]
+        if not rows:
+            return
+        with self._lock:
+            try:
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO printer_processed (name, size, mtime_ns, processed_at) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.commit()
+                self._entries += self._conn.total_changes - before
+            except Exception as exc:
+                logging.warning("Virtual printer processed index write failed: %s", exc)
+                return
+            for name, size, mtime_ns, _ in rows:
+                self._remember((name, size, mtime_ns))
+
+    def compact(self) -> int:
+        """Drop expired and excess entries and return freed pages to the file system."""
+        with self._lock:
+            try:
+                before = self._conn.total_changes
+                self._conn.execute(
+                    "DELETE FROM printer_processed WHERE processed_at < ?", (time.time() - self.retention_seconds,)
+                )
+                self._conn.execute(
+                    "DELETE FROM printer_processed WHERE rowid IN ("
+                    "SELECT rowid FROM printer_processed ORDER BY processed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self._conn.commit()
+                deleted = self._conn.total_changes - before
+                if deleted:
+                    self._conn.execute("PRAGMA incremental_vacuum")
+                    self._conn.commit()
+                self._entries = int(self._conn.execute("SELECT COUNT(*) FROM printer_processed").fetchone()[0])
+                self._compacted += deleted
+                return deleted
+            except Exception as exc:
+                logging.warning("Virtual printer processed index compaction failed: %s", exc)
+                return 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": self._entries,
+                "memo": len(self._memo),
+                "compacted": self._compacted,
+                "retention_days": round(self.retention_seconds / 86400.0, 2),
+                "max_entries": self.max_entries,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+
+
+class StoredImageBox:
+    """Image box read back from a job's box checkpoint (the fields the renderer uses)."""
+
+    __slots__ = ("position", "attrs", "pixels", "byte_order", "polarity")
+
+    def __init__(self, position: int, attrs: Dict[str, Any], pixels: bytes, byte_order: str, polarity: str):
+        self.position = position
+        self.attrs = attrs
+        self.pixels = pixels
+        self.byte_order = byte_order
+        self.polarity = polarity
+
+
+def encode_image_boxes(display_format: str, boxes: Iterable[Any]) -> bytes:
+    """Box checkpoint: magic line, one JSON header line, then each box's raw pixel bytes."""
+    boxes = list(boxes)
+    header = {
+        "display_format": display_format,
+        "boxes": [
+            {
+                "position": int(box.position),
+                "attrs": {key: (None if value is None else int(value) if isinstance(value, int) else str(value))
+                          for key, value in dict(box.attrs).items()},
+                "byte_order": ">" if box.byte_order == ">" else "<",
+                "polarity": str(box.polarity),
+                "length": len(box.pixels),
+            }
+            for box in boxes
+        ],
+    }
+    head = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    return b"\n".join((_BOXES_MAGIC, head, b"".join(bytes(box.pixels) for box in boxes)))
+
+
+def decode_image_boxes(data: bytes) -> Tuple[str, List[StoredImageBox]]:
+    magic, head, pixels = data.split(b"\n", 2)
+    if magic != _BOXES_MAGIC:
+        raise ValueError("not an image box checkpoint")
+    header = json.loads(head.decode("utf-8"))
+    boxes, offset = [], 0
+    for item in header["boxes"]:
+        length = int(item["length"])
+        if offset + length > len(pixels):
+            raise ValueError("truncated image box checkpoint")
+        boxes.append(StoredImageBox(
+            int(item["position"]),
+            dict(item["attrs"]),
+            pixels[offset:offset + length],
+            ">" if item.get("byte_order") == ">" else "<",
+            str(item.get("polarity") or "NORMAL"),
+        ))
+        offset += length
+    if offset != len(pixels):
+        raise ValueError("truncated image box checkpoint")
+    return str(header.get("display_format") or ""), boxes
+
+
+class PrintJobJournal:
+    """Persisted state of every film: received -> rendered -> spooled -> printed, or failed.
+
+    A job is written as received before its HG file is recorded in the
+    ProcessedFileIndex, and moves forward only after the stage's output (film
+    checkpoint, spool PDF, print) exists, so after a crash every unfinished job
+    resumes from its last completed stage. next_attempt_at is NULL while a job
+    is in the pipeline and holds the retry time otherwise; failures back off
+    exponentially until max_attempts, then the job is failed for good.
+    """
+
+    _COLUMNS = "id, name, session, state, source, center_time, film_path, pdf_path, attempts, error"
+
+    def __init__(
+        self,
+        db_path: Path,
+        max_attempts: int,
+        backoff_seconds: float,
+        backoff_max_seconds: float,
+        retention_seconds: float,
+    ):
+        self.db_path = Path(db_path)
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_seconds = max(1.0, float(backoff_seconds))
+        self.backoff_max_seconds = max(self.backoff_seconds, float(backoff_max_seconds))
+        self.retention_seconds = max(3600.0, float(retention_seconds))
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), timeout=5, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS printer_jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, session TEXT NOT NULL, "
+            "state TEXT NOT NULL, source TEXT, source_key TEXT UNIQUE, center_time REAL, "
+            "film_path TEXT, pdf_path TEXT, attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL, "
+            "error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_printer_jobs_state ON printer_jobs(state, next_attempt_at)")
+        self._conn.commit()
+
+    def receive(
+        self,
+        name: str,
+        session: str,
+        source: Optional[str] = None,
+        source_key: Optional[Tuple[str, int, int]] = None,
+        center_time: Optional[float] = None,
+    ) -> Optional[int]:
+        """Journal a new job in flight; None when source_key was already journaled."""
+        key = None if source_key is None else "%s|%d|%d" % (source_key[0].lower(), source_key[1], source_key[2])
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO printer_jobs (name, session, state, source, source_key, center_time, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, session, JOB_RECEIVED, source, key, center_time, now, now),
+            )
+            self._conn.commit()
+            return cur.lastrowid if cur.rowcount else None
+
+    def advance(self, job_ids: Iterable[int], state: str, **fields: Optional[str]) -> None:
+        """Record a completed stage (state plus film_path/pdf_path); the retry budget starts over."""
+        ids = [int(i) for i in job_ids]
+        if not ids:
+            return
+        sets = ["state = ?", "attempts = 0", "error = NULL", "updated_at = ?"]
+        params: List[Any] = [state, time.time()]
+        for column in ("film_path", "pdf_path"):
+            if column in fields:
+                sets.append(f"{column} = ?")
+                params.append(fields[column])
+        with self._lock:
+            self._conn.executemany(
+                f"UPDATE printer_jobs SET {', '.join(sets)} WHERE id = ?", [(*params, i) for i in ids]
+            )
+            self._conn.commit()
+
+    def fail(self, job_ids: Iterable[int], error: str) -> List[int]:
+        """Schedule a retry with backoff; returns the ids that ran out of attempts (now failed)."""
+        ids = [int(i) for i in job_ids]
+        exhausted = []
+        now = time.time()
+        with self._lock:
+            for job_id in ids:
+                row = self._conn.execute("SELECT attempts FROM printer_jobs WHERE id = ?", (job_id,)).fetchone()
+                if row is None:
+                    continue
+                attempts = int(row["attempts"]) + 1
+                if attempts >= self.max_attempts:
+                    exhausted.append(job_id)
+                    self._conn.execute(
+                        "UPDATE printer_jobs SET state = ?, attempts = ?, next_attempt_at = NULL, error = ?, updated_at = ? WHERE id = ?",
+                        (JOB_FAILED, attempts, error, now, job_id),
+                    )
+                else:
+                    delay = min(self.backoff_max_seconds, self.backoff_seconds * (2 ** (attempts - 1)))
+                    self._conn.execute(
+                        "UPDATE printer_jobs SET attempts = ?, next_attempt_at = ?, error = ?, updated_at = ? WHERE id = ?",
+                        (attempts, now + delay, error, now, job_id),
+                    )
+            self._conn.commit()
+        return exhausted
+
+    def give_up(self, job_ids: Iterable[int], error: str) -> None:
+        """Fail jobs without retrying (their source is gone)."""
+        ids = [int(i) for i in job_ids]
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE printer_jobs SET state = ?, next_attempt_at = NULL, error = ?, updated_at = ? WHERE id = ?",
+                [(JOB_FAILED, error, now, i) for i in ids],
+            )
+            self._conn.commit()
+
+    def resume(self) -> int:
+        """On startup: unfinished jobs that were in the pipeline become due now."""
+        with self._lock:
+            cur = self._conn.execute(
+                f"UPDATE printer_jobs SET next_attempt_at = ? WHERE next_attempt_at IS NULL AND state IN {_ACTIVE_SQL}",
+                (time.time(),),
+            )
+            self._conn.commit()
+            return cur.rowcount
+
+    def due(self, now: float, limit: int) -> List[Dict[str, Any]]:
+        """Claim jobs whose retry time has come, oldest first.
+
+        Spooled jobs sharing a PDF are always claimed together so the PDF is
+        printed once.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {self._COLUMNS} FROM printer_jobs WHERE next_attempt_at IS NOT NULL AND next_attempt_at <= ? "
+                "ORDER BY id LIMIT ?",
+                (now, max(1, int(limit))),
+            ).fetchall()
+            claimed = {row["id"]: dict(row) for row in rows}
+            pdfs = {row["pdf_path"] for row in rows if row["state"] == JOB_SPOOLED and row["pdf_path"]}
+            for pdf_path in pdfs:
+                for row in self._conn.execute(
+                    f"SELECT {self._COLUMNS} FROM printer_jobs WHERE pdf_path = ? AND state = ? AND next_attempt_at IS NOT NULL",
+                    (pdf_path, JOB_SPOOLED),
+                ):
+                    claimed.setdefault(row["id"], dict(row))
+            if claimed:
+                self._conn.executemany(
+                    "UPDATE printer_jobs SET next_attempt_at = NULL WHERE id = ?", [(i,) for i in claimed]
+                )
+                self._conn.commit()
+            return [claimed[i] for i in sorted(claimed)]
+
+    def active_paths(self) -> Set[str]:
+        """Source, film and PDF paths still needed by unfinished jobs."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT source, film_path, pdf_path FROM printer_jobs WHERE state IN {_ACTIVE_SQL}"
+            ).fetchall()
+        return {str(Path(p)) for row in rows for p in row if p}
+
+    def compact(self) -> int:
+        """Drop printed and failed jobs older than the retention window."""
+        with self._lock:
+            try:
+                cur = self._conn.execute(
+                    "DELETE FROM printer_jobs WHERE state IN (?, ?) AND updated_at < ?",
+                    (JOB_PRINTED, JOB_FAILED, time.time() - self.retention_seconds),
+                )
+                self._conn.commit()
+                if cur.rowcount:
+                    self._conn.execute("PRAGMA incremental_vacuum")
+                    self._conn.commit()
+                return cur.rowcount
+            except Exception as exc:
+                logging.warning("Virtual printer job journal compaction failed: %s", exc)
+                return 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict.fromkeys(JOB_STATES, 0)
+            for state, count in self._conn.execute("SELECT state, COUNT(*) FROM printer_jobs GROUP BY state"):
+                counts[state] = count
+            counts["retrying"] = int(
+                self._conn.execute(
+                    f"SELECT COUNT(*) FROM printer_jobs WHERE attempts > 0 AND state IN {_ACTIVE_SQL}"
+                ).fetchone()[0]
+            )
+            return counts
+
+    def close(self) -> None:
+        with self._lock:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
@@ -9,6 +9,9 @@ import psutil
 import hashlib
 from pathlib import Path
 
+from dicom_printer_service import read_pipeline_status
+from mpps_store import read_status_snapshot
+
 ROOT = Path(__file__).parent
 # Default paths (will be overridden after instance dir is computed)
 APP_PID = ROOT / "app.pid"
@@ -578,6 +581,7 @@ def _normalize_printer_cfg(config_path: str | None = None) -> dict:
             "port": int(receiver.get("port", 4100) or 4100),
             "dcmtk_bin": str(receiver.get("dcmtk_bin", r"C:\dcmtk\bin")).strip() or r"C:\dcmtk\bin",
             "spool_dir": str(worker.get("spool_dir", str(base / "spool"))).strip() or str(base / "spool"),
+            "mode": "native" if str(receiver.get("mode", "")).strip().lower() == "native" else "dcmtk",
         },
         "worker": {
             "database_dir": str(worker.get("database_dir", str(base / "database"))).strip() or str(base / "database"),
@@ -640,6 +644,9 @@ def start_printer_service(config_path: str | None = None):
     if not printer_cfg.get("enabled"):
         msg = "Virtual printer is disabled in config.json"
         return {"ok": False, "msg": msg, "error_type": "disabled"}
+    if printer_cfg["receiver"]["mode"] == "native":
+        msg = "Native Print SCP runs inside the MWL service; restart the service to apply printer changes"
+        return {"ok": False, "msg": msg, "error_type": "native_mode"}
 
     existing = find_printer_receiver_pids()
     if existing:
@@ -1170,6 +1177,14 @@ def status():
                     except Exception:
                         pass
     
+    if mpps_status["running"]:
+        # Runtime counters published by the MPPS process (context store, ...).
+        snapshot = read_status_snapshot(ROOT)
+        if snapshot.get("pid") == mpps_status["pid"]:
+            for key, value in snapshot.items():
+                if key != "pid":
+                    mpps_status.setdefault(key, value)
+
     app_status["instance_id"] = iid
     service_status["instance_id"] = iid
     mpps_status["instance_id"] = iid
@@ -1199,6 +1214,10 @@ def status():
                 printer_status["timestamp"] = state.get("started_at")
         except Exception:
             pass
+    # Render pipeline counters published by the print worker inside the MWL process.
+    pipeline = read_pipeline_status(ROOT)
+    if pipeline.get("pid") and _is_process_alive(pipeline["pid"], "mwl_service.py"):
+        printer_status["pipeline"] = {k: v for k, v in pipeline.items() if k != "pid"}
     result = {"app": app_status, "service": service_status, "mpps": mpps_status, "printer": printer_status}
     _STATUS_CACHE.update(timestamp=time.monotonic(), value=result)
     return result
@@ -1,11 +1,17 @@
-﻿import json
+﻿import bisect
+import json
 import logging
 import os
 import re
+import threading
+import time
 import urllib.error
+import urllib.parse
 import urllib.request
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import Any, Callable, Dict, List, Tuple
 
 
 def _to_bool(value: Any, default: bool = False) -> bool:
@@ -39,6 +45,7 @@ def default_action_config() -> Dict[str, Any]:
         "modality_filter_mode": "ANY",  # ANY|CT|CR|CUSTOM
         "trigger_modalities": [],       # used when modality_filter_mode=CUSTOM
         "include_raw_dataset": True,
+        "depends_on": [],               # action ids that must finish first
         "api": {
             "url": "",
             "method": "POST",
@@ -49,6 +56,9 @@ def default_action_config() -> Dict[str, Any]:
         "sql": {
             "on_n_create": "",
             "on_n_set": "",
+            "batch_enabled": False,     # group bursts into one executemany transaction
+            "batch_window_ms": 250,
+            "batch_max_size": 50,
         },
     }
 
@@ -88,6 +98,13 @@ def normalize_action_config(action_cfg: Dict[str, Any]) -> Dict[str, Any]:
         base["trigger_modalities"] = [s.strip().upper() for s in trig_modalities.split(",") if s.strip()]
 
     base["include_raw_dataset"] = _to_bool(incoming.get("include_raw_dataset"), True)
+
+    depends_on = incoming.get("depends_on")
+    if isinstance(depends_on, str):
+        depends_on = depends_on.split(",")
+    if isinstance(depends_on, list):
+        base["depends_on"] = [_safe_action_id(str(x)) for x in depends_on if str(x).strip()]
+
     base["api"]["url"] = str(api_cfg.get("url", "")).strip()
     base["api"]["method"] = str(api_cfg.get("method", "POST")).strip().upper() or "POST"
     base["api"]["headers_json"] = str(api_cfg.get("headers_json", "{}"))
@@ -95,6 +112,9 @@ def normalize_action_config(action_cfg: Dict[str, Any]) -> Dict[str, Any]:
     base["api"]["payload_template_json"] = str(api_cfg.get("payload_template_json", "{}"))
     base["sql"]["on_n_create"] = str(sql_cfg.get("on_n_create", "")).strip()
     base["sql"]["on_n_set"] = str(sql_cfg.get("on_n_set", "")).strip()
+    base["sql"]["batch_enabled"] = _to_bool(sql_cfg.get("batch_enabled"), False)
+    base["sql"]["batch_window_ms"] = max(10, int(sql_cfg.get("batch_window_ms", 250) or 250))
+    base["sql"]["batch_max_size"] = max(1, int(sql_cfg.get("batch_max_size", 50) or 50))
 
     return base
 
@@ -144,6 +164,7 @@ def list_action_files(root_dir: Path) -> List[Dict[str, Any]]:
                 norm["id"] = p.stem
             if not norm.get("name"):
                 norm["name"] = p.stem
+            compile_action_templates(norm)
             out.append(norm)
         except Exception:
             continue
@@ -174,6 +195,45 @@ def default_mpps_config(root_dir: Path) -> Dict[str, Any]:
             "accept_any_calling_aet": True,
             "calling_aet": "",
         },
+        "execution": {
+            "max_workers": 4,
+            "event_deadline_seconds": 30,
+        },
+        "circuit_breaker": {
+            "enabled": True,
+            "failure_threshold": 5,
+            "open_seconds": 30,
+            "max_concurrent_per_endpoint": 4,
+        },
+        "context_store": {
+            "persist": True,
+            "max_entries": 10000,
+            "ttl_hours": 24,
+            "final_ttl_hours": 1,       # keep COMPLETED/DISCONTINUED steps for N-GET
+        },
+        "debug": {
+            "sample_rate": 1.0,         # fraction of events captured while debug_output is on
+            "calling_aets": [],         # only capture events from these AE titles
+            "action_ids": [],           # only capture events that ran these actions
+            "max_record_kb": 64,
+            "max_file_mb": 50,
+            "backup_count": 3,
+            "queue_size": 1000,
+        },
+        "worklist_feedback": {
+            "mode": "off",              # off|drop|flag: how mwl_service treats performed steps
+            "retention_hours": 48,
+        },
+        "dedup": {
+            "enabled": True,
+            "window_seconds": 600,
+            "max_entries": 10000,
+        },
+        "journal": {
+            "enabled": False,
+            "max_file_mb": 64,
+            "max_files": 20,
+        },
         "test_payload_json": test_payload_example,
     }
 
@@ -195,6 +255,92 @@ def merge_mpps_config(cfg: Dict[str, Any], root_dir: Path) -> Dict[str, Any]:
     )
     base["listener"]["calling_aet"] = str(listener.get("calling_aet", "")).strip()
 
+    execution = incoming.get("execution", {}) if isinstance(incoming.get("execution"), dict) else {}
+    base["execution"]["max_workers"] = max(
+        1, int(execution.get("max_workers", base["execution"]["max_workers"]) or base["execution"]["max_workers"])
+    )
+    base["execution"]["event_deadline_seconds"] = max(
+        1.0,
+        float(
+            execution.get("event_deadline_seconds", base["execution"]["event_deadline_seconds"])
+            or base["execution"]["event_deadline_seconds"]
+        ),
+    )
+
+    breaker = incoming.get("circuit_breaker", {}) if isinstance(incoming.get("circuit_breaker"), dict) else {}
+    base_breaker = base["circuit_breaker"]
+    base_breaker["enabled"] = _to_bool(breaker.get("enabled"), base_breaker["enabled"])
+    base_breaker["failure_threshold"] = max(
+        1, int(breaker.get("failure_threshold", base_breaker["failure_threshold"]) or base_breaker["failure_threshold"])
+    )
+    base_breaker["open_seconds"] = max(
+        1.0, float(breaker.get("open_seconds", base_breaker["open_seconds"]) or base_breaker["open_seconds"])
+    )
+    base_breaker["max_concurrent_per_endpoint"] = max(
+        0, int(breaker.get("max_concurrent_per_endpoint", base_breaker["max_concurrent_per_endpoint"]) or 0)
+    )
+
+    context_store = incoming.get("context_store", {}) if isinstance(incoming.get("context_store"), dict) else {}
+    base["context_store"]["persist"] = _to_bool(context_store.get("persist"), base["context_store"]["persist"])
+    base["context_store"]["max_entries"] = max(
+        1, int(context_store.get("max_entries", base["context_store"]["max_entries"]) or base["context_store"]["max_entries"])
+    )
+    base["context_store"]["ttl_hours"] = max(
+        0.1, float(context_store.get("ttl_hours", base["context_store"]["ttl_hours"]) or base["context_store"]["ttl_hours"])
+    )
+    base["context_store"]["final_ttl_hours"] = max(
+        0.01,
+        float(
+            context_store.get("final_ttl_hours", base["context_store"]["final_ttl_hours"])
+            or base["context_store"]["final_ttl_hours"]
+        ),
+    )
+
+    debug = incoming.get("debug", {}) if isinstance(incoming.get("debug"), dict) else {}
+    base_debug = base["debug"]
+    base_debug["sample_rate"] = min(
+        1.0, max(0.0, float(debug.get("sample_rate", base_debug["sample_rate"]) or 0.0))
+    )
+    for key in ("calling_aets", "action_ids"):
+        raw = debug.get(key, base_debug[key])
+        if isinstance(raw, str):
+            raw = raw.split(",")
+        if isinstance(raw, list):
+            base_debug[key] = [str(x).strip() for x in raw if str(x).strip()]
+    base_debug["calling_aets"] = [x.upper() for x in base_debug["calling_aets"]]
+    base_debug["action_ids"] = [_safe_action_id(x) for x in base_debug["action_ids"]]
+    for key in ("max_record_kb", "max_file_mb", "backup_count", "queue_size"):
+        base_debug[key] = max(1, int(debug.get(key, base_debug[key]) or base_debug[key]))
+
+    feedback = incoming.get("worklist_feedback", {}) if isinstance(incoming.get("worklist_feedback"), dict) else {}
+    feedback_mode = str(feedback.get("mode", base["worklist_feedback"]["mode"])).strip().lower()
+    base["worklist_feedback"]["mode"] = feedback_mode if feedback_mode in ("off", "drop", "flag") else "off"
+    base["worklist_feedback"]["retention_hours"] = max(
+        1.0,
+        float(
+            feedback.get("retention_hours", base["worklist_feedback"]["retention_hours"])
+            or base["worklist_feedback"]["retention_hours"]
+        ),
+    )
+
+    dedup = incoming.get("dedup", {}) if isinstance(incoming.get("dedup"), dict) else {}
+    base["dedup"]["enabled"] = _to_bool(dedup.get("enabled"), base["dedup"]["enabled"])
+    base["dedup"]["window_seconds"] = max(
+        1.0, float(dedup.get("window_seconds", base["dedup"]["window_seconds"]) or base["dedup"]["window_seconds"])
+    )
+    base["dedup"]["max_entries"] = max(
+        1, int(dedup.get("max_entries", base["dedup"]["max_entries"]) or base["dedup"]["max_entries"])
+    )
+
+    journal = incoming.get("journal", {}) if isinstance(incoming.get("journal"), dict) else {}
+    base["journal"]["enabled"] = _to_bool(journal.get("enabled"), base["journal"]["enabled"])
+    base["journal"]["max_file_mb"] = max(
+        1, int(journal.get("max_file_mb", base["journal"]["max_file_mb"]) or base["journal"]["max_file_mb"])
+    )
+    base["journal"]["max_files"] = max(
+        1, int(journal.get("max_files", base["journal"]["max_files"]) or base["journal"]["max_files"])
+    )
+
     # Keep compatibility with old location: mpps.actions.test_payload_json
     legacy_actions = incoming.get("actions") if isinstance(incoming.get("actions"), dict) else {}
     base["test_payload_json"] = str(incoming.get("test_payload_json", legacy_actions.get("test_payload_json", base["test_payload_json"])))
@@ -299,7 +445,63 @@ def _get_value_case_insensitive(values: Dict[str, Any], key: str) -> Any:
     return None
 
 
+class _PayloadIndex(dict):
+    """Flattened payload plus lookup tables for placeholder resolution.
+
+    Built once per event so each placeholder is resolved with dict lookups
+    instead of scanning every flattened key.
+    """
+
+    def __init__(self, flat: Dict[str, Any]):
+        super().__init__(flat)
+        self._by_lower: Dict[str, Any] = {}
+        self._by_suffix: Dict[str, Any] = {}
+        self._by_dot_suffix: Dict[str, Any] = {}
+        for k, v in self.items():
+            lk = str(k).lower()
+            self._by_lower.setdefault(lk, v)
+            if not _has_non_empty(v):
+                continue
+            for i, ch in enumerate(lk):
+                if ch == ".":
+                    self._by_dot_suffix.setdefault(lk[i + 1:], v)
+                    self._by_suffix.setdefault(lk[i + 1:], v)
+                elif ch == "]":
+                    self._by_suffix.setdefault(lk[i + 1:], v)
+
+    def lookup(self, key: str) -> Any:
+        if key in self:
+            return self[key]
+        return self._by_lower.get(str(key).lower())
+
+    def first_non_empty(self, key: str) -> Any:
+        """Non-empty value for key: exact, case-insensitive, then as a nested last segment."""
+        value = self.lookup(key)
+        if _has_non_empty(value):
+            return value
+        return self._by_dot_suffix.get(str(key).lower())
+
+    def resolve(self, key: str) -> Any:
+        direct = self.lookup(key)
+        if _has_non_empty(direct):
+            return direct
+        lk = str(key).lower()
+        if lk in self._by_suffix:
+            return self._by_suffix[lk]
+        for fb in _PLACEHOLDER_FALLBACKS.get(key, []):
+            candidate = self.lookup(fb)
+            if _has_non_empty(candidate):
+                return candidate
+            fb_l = str(fb).lower()
+            if fb_l in self._by_dot_suffix:
+                return self._by_dot_suffix[fb_l]
+        return direct
+
+
 def _resolve_placeholder_value(values: Dict[str, Any], key: str) -> Any:
+    if isinstance(values, _PayloadIndex):
+        return values.resolve(key)
+
     # 1) Direct (or case-insensitive) key
     direct = _get_value_case_insensitive(values, key)
     if _has_non_empty(direct):
@@ -328,37 +530,142 @@ def _resolve_placeholder_value(values: Dict[str, Any], key: str) -> Any:
     return direct
 
 
+_SEG_TEXT = 0
+_SEG_VALUE = 1  # {{Key}}
+_SEG_SQL_LITERAL = 2  # :Key (SQL mode only)
+
+
+class _CompiledTemplate:
+    """Template pre-split into literal text and placeholder segments."""
+
+    __slots__ = ("segments", "keys")
+
+    def __init__(self, template: str, sql_mode: bool = False):
+        segments: List[Tuple[int, str]] = []
+        pos = 0
+        text = template or ""
+        for match in _TPL_PATTERN.finditer(text):
+            self._add_text(segments, text[pos:match.start()], sql_mode)
+            segments.append((_SEG_VALUE, match.group(1)))
+            pos = match.end()
+        self._add_text(segments, text[pos:], sql_mode)
+        self.segments = segments
+        self.keys = tuple(dict.fromkeys(key for kind, key in segments if kind != _SEG_TEXT))
+
+    @staticmethod
+    def _add_text(segments: List[Tuple[int, str]], text: str, sql_mode: bool) -> None:
+        if not text:
+            return
+        if not sql_mode:
+            segments.append((_SEG_TEXT, text))
+            return
+        # SQL convenience syntax: :PatientID, :PerformedProcedureStepStatus, etc.
+        pos = 0
+        for match in _COLON_TPL_PATTERN.finditer(text):
+            if match.start() > pos:
+                segments.append((_SEG_TEXT, text[pos:match.start()]))
+            segments.append((_SEG_SQL_LITERAL, match.group(1)))
+            pos = match.end()
+        if pos < len(text):
+            segments.append((_SEG_TEXT, text[pos:]))
+
+    def render(self, values: Dict[str, Any], sql_mode: bool = False) -> str:
+        resolved = {key: _resolve_placeholder_value(values, key) for key in self.keys}
+        parts: List[str] = []
+        for kind, item in self.segments:
+            if kind == _SEG_TEXT:
+                parts.append(item)
+            elif kind == _SEG_VALUE:
+                raw = resolved[item]
+                text = "" if raw is None else str(raw)
+                parts.append(text.replace("'", "''") if sql_mode else text)
+            else:
+                parts.append(_sql_literal(resolved[item]))
+        return "".join(parts)
+
+    def render_bound(self, values: Dict[str, Any], paramstyle: str) -> Tuple[str, Any]:
+        """Render SQL with :Key tokens turned into driver bind variables.
+
+        {{Key}} segments are still rendered as escaped text; the statement text is
+        constant across events only when the template uses :Key tokens exclusively.
+        """
+        pyformat = paramstyle == "pyformat"
+        bind_names: Dict[str, str] = {}
+        params: Dict[str, Any] = {}
+        parts: List[str] = []
+        for kind, item in self.segments:
+            if kind == _SEG_TEXT:
+                parts.append(item.replace("%", "%%") if pyformat else item)
+            elif kind == _SEG_VALUE:
+                raw = _resolve_placeholder_value(values, item)
+                text = ("" if raw is None else str(raw)).replace("'", "''")
+                parts.append(text.replace("%", "%%") if pyformat else text)
+            else:
+                name = bind_names.get(item)
+                if name is None:
+                    name = f"p{len(bind_names) + 1}"
+                    bind_names[item] = name
+                    params[name] = _sql_bind_value(_resolve_placeholder_value(values, item))
+                parts.append(f"%({name})s" if pyformat else f":{name}")
+        return "".join(parts), params
+
+
+@lru_cache(maxsize=512)
+def _compile_template(template: str, sql_mode: bool = False) -> _CompiledTemplate:
+    return _CompiledTemplate(template, sql_mode=sql_mode)
+
+
+def _sql_literal(raw: Any) -> str:
+    if raw is None:
+        return "NULL"
+    if isinstance(raw, bool):
+        return "1" if raw else "0"
+    if isinstance(raw, (int, float)):
+        return str(raw)
+    text = str(raw).replace("'", "''")
+    return f"'{text}'"
+
+
+def _sql_bind_value(raw: Any) -> Any:
+    if isinstance(raw, bool):
+        return 1 if raw else 0
+    if raw is None or isinstance(raw, (int, float)):
+        return raw
+    return str(raw)
+
+
+# DB-API paramstyle per driver name returned by _db_connect.
+_DRIVER_PARAMSTYLES = {
+    "oracledb": "named",
+    "cx_Oracle": "named",
+    "psycopg2": "pyformat",
+    "PyMySQL": "pyformat",
+    "sqlite3": "named",
+}
+
+
+def _render_sql_bound(template: str, values: Dict[str, Any], driver_name: str) -> Tuple[str, Dict[str, Any]]:
+    if not isinstance(values, _PayloadIndex):
+        values = _PayloadIndex(values or {})
+    paramstyle = _DRIVER_PARAMSTYLES.get(driver_name, "named")
+    return _compile_template(template or "", True).render_bound(values, paramstyle)
+
+
 def _render_template(template: str, values: Dict[str, Any], sql_mode: bool = False) -> str:
-    def repl(match: re.Match) -> str:
-        key = match.group(1)
-        raw = _resolve_placeholder_value(values, key)
-        if raw is None:
-            raw = ""
-        text = str(raw)
-        if sql_mode:
-            return text.replace("'", "''")
-        return text
-
-    rendered = _TPL_PATTERN.sub(repl, template or "")
-    # SQL convenience syntax: :PatientID, :PerformedProcedureStepStatus, etc.
-    # Applied only in SQL mode to avoid affecting API URLs and JSON payloads.
-    if sql_mode:
-        def sql_literal(raw: Any) -> str:
-            if raw is None:
-                return "NULL"
-            if isinstance(raw, bool):
-                return "1" if raw else "0"
-            if isinstance(raw, (int, float)):
-                return str(raw)
-            text = str(raw).replace("'", "''")
-            return f"'{text}'"
-
-        def colon_repl(match: re.Match) -> str:
-            key = match.group(1)
-            return sql_literal(_resolve_placeholder_value(values, key))
-
-        rendered = _COLON_TPL_PATTERN.sub(colon_repl, rendered)
-    return rendered
+    # Colon placeholders are applied only in SQL mode to avoid affecting API URLs and JSON payloads.
+    if not isinstance(values, _PayloadIndex):
+        values = _PayloadIndex(values or {})
+    return _compile_template(template or "", sql_mode).render(values, sql_mode=sql_mode)
+
+
+def compile_action_templates(action_cfg: Dict[str, Any]) -> None:
+    """Pre-compile every template of a normalized action so events only render."""
+    api_cfg = action_cfg.get("api") or {}
+    sql_cfg = action_cfg.get("sql") or {}
+    _compile_template(str(api_cfg.get("headers_json", "{}")), False)
+    _compile_template(str(api_cfg.get("payload_template_json", "{}")), False)
+    _compile_template(str(sql_cfg.get("on_n_create", "")), True)
+    _compile_template(str(sql_cfg.get("on_n_set", "")), True)
 
 
 def _extract_sql_placeholders(sql_text: str) -> List[str]:
@@ -371,50 +678,184 @@ def _extract_sql_placeholders(sql_text: str) -> List[str]:
     return ordered
 
 
-def _should_trigger(action_cfg: Dict[str, Any], event_type: str, flat_payload: Dict[str, Any]) -> Tuple[bool, str]:
-    mode = str(action_cfg.get("mode", "none")).strip().lower()
-    if mode == "none":
-        return False, "Action mode is none"
-    if not _to_bool(action_cfg.get("enabled"), True):
-        return False, "Action disabled"
-
-    allowed_events = [str(x).strip().upper() for x in (action_cfg.get("trigger_events") or [])]
-    ev = str(event_type or "").upper()
-    if allowed_events and ev not in allowed_events:
-        return False, f"Event {ev} not in trigger_events"
-
-    statuses = [str(x).strip().upper() for x in (action_cfg.get("trigger_statuses") or [])]
-    if statuses:
-        step_status = str(flat_payload.get("PerformedProcedureStepStatus", "")).strip().upper()
-        if not step_status:
-            return False, "No PerformedProcedureStepStatus in payload"
-        if step_status not in statuses:
-            return False, f"Status {step_status} not in trigger_statuses"
-
-    modality_mode = str(action_cfg.get("modality_filter_mode", "ANY")).strip().upper() or "ANY"
-    if modality_mode != "ANY":
-        modality = str(_resolve_placeholder_value(flat_payload, "Modality") or "").strip().upper()
-        if not modality:
-            return False, "No Modality in payload"
-
-        if modality_mode == "CT":
-            allowed_modalities = ["CT"]
-        elif modality_mode == "CR":
-            allowed_modalities = ["CR"]
-        elif modality_mode == "CUSTOM":
-            allowed_modalities = [str(x).strip().upper() for x in (action_cfg.get("trigger_modalities") or []) if str(x).strip()]
-            if not allowed_modalities:
-                return False, "modality_filter_mode=CUSTOM but trigger_modalities is empty"
+_ANY = "*"
+
+
+class _TriggerSpec:
+    """Trigger filters of one action, parsed once when the action is loaded."""
+
+    __slots__ = ("mode", "enabled", "events", "statuses", "modality_mode", "modalities")
+
+    def __init__(self, action_cfg: Dict[str, Any]):
+        self.mode = str(action_cfg.get("mode", "none")).strip().lower()
+        self.enabled = _to_bool(action_cfg.get("enabled"), True)
+        self.events = frozenset(str(x).strip().upper() for x in (action_cfg.get("trigger_events") or []))
+        self.statuses = frozenset(str(x).strip().upper() for x in (action_cfg.get("trigger_statuses") or []))
+        self.modality_mode = str(action_cfg.get("modality_filter_mode", "ANY")).strip().upper() or "ANY"
+        if self.modality_mode in ("CT", "CR"):
+            self.modalities = frozenset([self.modality_mode])
+        elif self.modality_mode == "CUSTOM":
+            self.modalities = frozenset(
+                str(x).strip().upper() for x in (action_cfg.get("trigger_modalities") or []) if str(x).strip()
+            )
         else:
-            allowed_modalities = []
+            self.modalities = frozenset()
+
+    def can_fire(self) -> bool:
+        if self.modality_mode == "CUSTOM" and not self.modalities:
+            return False
+        return self.check_static()[0]
+
+    def check_static(self) -> Tuple[bool, str]:
+        if self.mode == "none":
+            return False, "Action mode is none"
+        if not self.enabled:
+            return False, "Action disabled"
+        return True, ""
+
+    def dispatch_keys(self) -> List[Tuple[str, str, str]]:
+        events = sorted(self.events) or [_ANY]
+        statuses = sorted(self.statuses) or [_ANY]
+        if self.modality_mode == "ANY":
+            modalities = [_ANY]
+        else:
+            modalities = sorted(self.modalities)
+        return [(e, st, m) for e in events for st in statuses for m in modalities]
+
+    def check(self, event_type: str, step_status: str, modality: str) -> Tuple[bool, str]:
+        ok, reason = self.check_static()
+        if not ok:
+            return ok, reason
+
+        ev = str(event_type or "").upper()
+        if self.events and ev not in self.events:
+            return False, f"Event {ev} not in trigger_events"
+
+        if self.statuses:
+            if not step_status:
+                return False, "No PerformedProcedureStepStatus in payload"
+            if step_status not in self.statuses:
+                return False, f"Status {step_status} not in trigger_statuses"
+
+        if self.modality_mode != "ANY":
+            if not modality:
+                return False, "No Modality in payload"
+            if self.modality_mode == "CUSTOM" and not self.modalities:
+                return False, "modality_filter_mode=CUSTOM but trigger_modalities is empty"
+            if self.modalities and modality not in self.modalities:
+                allowed = ", ".join(sorted(self.modalities))
+                return False, f"Modality {modality} not allowed ({allowed})"
+
+        return True, "Triggered"
+
+
+def _trigger_keys(flat_payload: Dict[str, Any]) -> Tuple[str, str]:
+    step_status = str(flat_payload.get("PerformedProcedureStepStatus", "")).strip().upper()
+    modality = str(_resolve_placeholder_value(flat_payload, "Modality") or "").strip().upper()
+    return step_status, modality
+
+
+def _should_trigger(action_cfg: Dict[str, Any], event_type: str, flat_payload: Dict[str, Any]) -> Tuple[bool, str]:
+    step_status, modality = _trigger_keys(flat_payload)
+    return _TriggerSpec(action_cfg).check(event_type, step_status, modality)
+
+
+class _ActionRegistry:
+    """Loaded actions plus a dispatch table keyed by (event, status, modality).
+
+    Each action is indexed under every combination it accepts, with "*" standing
+    for "no filter", so an event only looks at actions that can fire for it.
+    """
+
+    def __init__(self, actions: List[Dict[str, Any]]):
+        self.actions = actions
+        self.specs = [_TriggerSpec(a) for a in actions]
+        self.ids = {str(a.get("id") or "") for a in actions}
+        self._table: Dict[Tuple[bool, str, str, str], List[int]] = {}
+        self._lookup_cache: Dict[Tuple[bool, str, str, str], List[int]] = {}
+        self._lock = threading.Lock()
+        for idx, (action, spec) in enumerate(zip(actions, self.specs)):
+            if not spec.can_fire():
+                continue
+            raw = bool(action.get("include_raw_dataset"))
+            for key in spec.dispatch_keys():
+                self._table.setdefault((raw, *key), []).append(idx)
+        self.raw_variants = sorted({raw for raw, _, _, _ in self._table})
+
+    def candidates(self, include_raw: bool, event_type: str, step_status: str, modality: str) -> List[int]:
+        key = (include_raw, event_type, step_status, modality)
+        cached = self._lookup_cache.get(key)
+        if cached is not None:
+            return cached
+        found: set = set()
+        for ev in (event_type, _ANY):
+            for st in (step_status, _ANY):
+                for mod in (modality, _ANY):
+                    found.update(self._table.get((include_raw, ev, st, mod), ()))
+        result = sorted(found)
+        with self._lock:
+            if len(self._lookup_cache) < 1024:
+                self._lookup_cache[key] = result
+        return result
+
+
+_REGISTRY_LOCK = threading.Lock()
+_REGISTRY_CACHE: Dict[str, Tuple[Any, _ActionRegistry]] = {}
+
+
+def _actions_signature(root_dir: Path, legacy_actions: Dict[str, Any] | None) -> Any:
+    files = []
+    for p in actions_dir(root_dir).glob("*.json"):
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        files.append((p.name, st.st_mtime_ns, st.st_size))
+    legacy_key = json.dumps(legacy_actions, sort_keys=True, default=str) if legacy_actions else ""
+    return tuple(sorted(files)), legacy_key
+
+
+def load_action_registry(root_dir: Path, legacy_actions: Dict[str, Any] | None = None) -> _ActionRegistry:
+    """Return the action registry, reloading action files only when they change."""
+    root = Path(root_dir)
+    signature = _actions_signature(root, legacy_actions)
+    cache_key = str(root.resolve())
+    with _REGISTRY_LOCK:
+        cached = _REGISTRY_CACHE.get(cache_key)
+        if cached and cached[0] == signature:
+            return cached[1]
 
-        if allowed_modalities and modality not in allowed_modalities:
-            return False, f"Modality {modality} not allowed ({', '.join(allowed_modalities)})"
+        action_defs = list_action_files(root)
+        # Backward compatibility: old single action block in config.json
+        if legacy_actions:
+            legacy = normalize_action_config(legacy_actions)
+            if not legacy.get("id"):
+                legacy["id"] = "legacy"
+            if not legacy.get("name"):
+                legacy["name"] = "Legacy Action"
+            compile_action_templates(legacy)
+            action_defs.append(legacy)
+        registry = _ActionRegistry(action_defs)
+        _REGISTRY_CACHE[cache_key] = (signature, registry)
+        return registry
 
-    return True, "Triggered"
+
+_DB_CONNECTOR: Callable[[Dict[str, Any]], Tuple[str, Any]] | None = None
+
+
+def set_db_connector(factory: Callable[[Dict[str, Any]], Tuple[str, Any]] | None) -> None:
+    """Replace the HIS connection factory (db_cfg -> (driver_name, connection)).
+
+    For tools such as mpps_bench.py that point the SQL legs at a local
+    stand-in database; None restores the configured drivers.
+    """
+    global _DB_CONNECTOR
+    _DB_CONNECTOR = factory
 
 
 def _db_connect(db_cfg: Dict[str, Any]):
+    if _DB_CONNECTOR is not None:
+        return _DB_CONNECTOR(db_cfg)
     db_type = (db_cfg.get("type") or "oracle").lower()
     dsn = str(db_cfg.get("dsn") or "").strip()
     user = str(db_cfg.get("user") or "").strip()
@@ -514,26 +955,655 @@ def _db_connect(db_cfg: Dict[str, Any]):
     raise RuntimeError(f"Unsupported DB type for MPPS action: {db_type}")
 
 
-def _execute_single_action(
+def _run_api_leg(
+    action_cfg: Dict[str, Any],
+    flat_payload: Dict[str, Any],
+    view: "MPPSEventView",
+    include_raw: bool,
+    debug_output: bool,
+) -> Dict[str, Any]:
+    api_cfg = action_cfg.get("api") or {}
+    api_url = str(api_cfg.get("url") or "").strip()
+    if not api_url:
+        return {"type": "api", "ok": True, "skipped": True, "reason": "API URL is empty"}
+
+    method = str(api_cfg.get("method", "POST")).strip().upper() or "POST"
+    timeout_seconds = int(api_cfg.get("timeout_seconds", 10) or 10)
+    headers_raw = str(api_cfg.get("headers_json", "{}"))
+    tpl_raw = str(api_cfg.get("payload_template_json", "{}"))
+    try:
+        headers = json.loads(_render_template(headers_raw, flat_payload))
+        if not isinstance(headers, dict):
+            headers = {}
+    except Exception:
+        headers = {}
+
+    try:
+        rendered_payload_text = _render_template(tpl_raw, flat_payload)
+        body_obj = json.loads(rendered_payload_text) if rendered_payload_text.strip() else {}
+    except Exception:
+        body_obj = view.composed(include_raw)
+
+    breaker = _breaker_for(f"api:{urllib.parse.urlsplit(api_url).netloc or api_url}")
+    blocked = breaker.enter(timeout_seconds)
+    if blocked:
+        return {"type": "api", "ok": False, "url": api_url, "short_circuited": True, "error": blocked}
+    item: Dict[str, Any] = {}
+    try:
+        item = _send_api_request(api_url, method, headers, body_obj, timeout_seconds, debug_output)
+        return item
+    finally:
+        # 4xx means the endpoint answered; only transport errors and 5xx count against it.
+        status_code = item.get("status_code")
+        breaker.exit(ok=status_code is not None and int(status_code) < 500)
+
+
+def _send_api_request(
+    api_url: str,
+    method: str,
+    headers: Dict[str, Any],
+    body_obj: Any,
+    timeout_seconds: int,
+    debug_output: bool,
+) -> Dict[str, Any]:
+    try:
+        body = json.dumps(body_obj, ensure_ascii=False).encode("utf-8")
+        req = urllib.request.Request(api_url, data=body, method=method)
+        req.add_header("Content-Type", "application/json")
+        for k, v in headers.items():
+            req.add_header(str(k), str(v))
+        with urllib.request.urlopen(req, timeout=timeout_seconds) as resp:
+            status_code = int(getattr(resp, "status", 200))
+            resp_text = resp.read().decode("utf-8", errors="replace")
+        item_ok = 200 <= status_code < 300
+        return {
+            "type": "api",
+            "ok": item_ok,
+            "url": api_url,
+            "status_code": status_code,
+            "response": resp_text[:1000],
+            **({"request_body": body_obj, "request_headers": headers} if debug_output else {}),
+        }
+    except urllib.error.HTTPError as e:
+        return {
+            "type": "api",
+            "ok": False,
+            "url": api_url,
+            "status_code": int(getattr(e, "code", 500)),
+            "error": str(e),
+        }
+    except Exception as e:
+        return {"type": "api", "ok": False, "url": api_url, "error": str(e)}
+
+
+def _run_sql_leg(
     action_cfg: Dict[str, Any],
     db_cfg: Dict[str, Any],
     event_type: str,
-    payload: Dict[str, Any],
-    dataset_obj: Any = None,
+    flat_payload: Dict[str, Any],
+    debug_output: bool,
+) -> Dict[str, Any]:
+    sql_cfg = action_cfg.get("sql") or {}
+    sql_tpl = str(sql_cfg.get("on_n_create", "") if event_type == "N-CREATE" else sql_cfg.get("on_n_set", ""))
+    if not sql_tpl.strip():
+        return {"type": "sql", "ok": True, "skipped": True, "reason": "SQL template is empty"}
+
+    if sql_cfg.get("batch_enabled"):
+        batcher = _sql_batcher(action_cfg, db_cfg)
+        outcome = batcher.submit(sql_tpl, flat_payload, str(flat_payload.get("sop_instance_uid") or ""))
+        # Not written yet: execute_mpps_actions hands the outcome to the caller as pending_sql.
+        return {"type": "sql", "ok": True, "queued": True, "batch": True, "pending": outcome}
+
+    placeholder_debug = None
+    if debug_output:
+        placeholder_debug = {}
+        for key in _extract_sql_placeholders(sql_tpl):
+            value = _resolve_placeholder_value(flat_payload, key)
+            placeholder_debug[key] = "" if value is None else str(value)
+    sql_text = sql_tpl
+    bind_params: Dict[str, Any] = {}
+    conn = None
+    cursor = None
+    breaker = _breaker_for(_db_target(db_cfg))
+    blocked = breaker.enter(_BREAKER_SETTINGS["acquire_timeout_seconds"])
+    if blocked:
+        return {"type": "sql", "ok": False, "short_circuited": True, "error": blocked}
+    ok = False
+    try:
+        driver_name, conn = _db_connect(db_cfg or {})
+        sql_text, bind_params = _render_sql_bound(sql_tpl, flat_payload, driver_name)
+        cursor = conn.cursor()
+        cursor.execute(sql_text, bind_params)
+        try:
+            rows = cursor.rowcount
+        except Exception:
+            rows = None
+        conn.commit()
+        ok = True
+        return {
+            "type": "sql",
+            "ok": True,
+            "driver": driver_name,
+            "rowcount": rows,
+            **({"executed_sql": sql_text, "bind_params": bind_params} if debug_output else {}),
+            **({"resolved_placeholders": placeholder_debug} if debug_output else {}),
+        }
+    except Exception as e:
+        return {
+            "type": "sql",
+            "ok": False,
+            "error": str(e),
+            **({"executed_sql": sql_text, "bind_params": bind_params} if debug_output else {}),
+            **({"resolved_placeholders": placeholder_debug} if debug_output else {}),
+        }
+    finally:
+        try:
+            if cursor:
+                cursor.close()
+        except Exception:
+            pass
+        try:
+            if conn:
+                conn.close()
+        except Exception:
+            pass
+        # The slot is held for the whole statement so max_concurrent_per_endpoint caps database work.
+        breaker.exit(ok=ok)
+
+
+_BREAKER_SETTINGS: Dict[str, Any] = {
+    "enabled": True,
+    "failure_threshold": 5,
+    "open_seconds": 30.0,
+    "max_concurrent_per_endpoint": 4,
+    "acquire_timeout_seconds": 10.0,
+}
+
+
+class _CircuitBreaker:
+    """Closed/open/half-open breaker plus a concurrency cap for one action target.
+
+    After failure_threshold consecutive failures the breaker opens and legs for the
+    target fail immediately; after open_seconds a single probe is let through
+    (half-open) and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, target: str):
+        self.target = target
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.short_circuits = 0
+        self.in_flight = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._limit = 0
+        self._slots: threading.BoundedSemaphore | None = None
+
+    def enter(self, acquire_timeout: float) -> str:
+        """Reserve a call slot; returns an error message when the call must not run."""
+        settings = _BREAKER_SETTINGS
+        with self._lock:
+            if settings["enabled"] and self.state == "open":
+                if time.monotonic() - self.opened_at < settings["open_seconds"]:
+                    self.short_circuits += 1
+                    return f"Circuit open for {self.target}"
+                self.state = "half_open"
+            probe = False
+            if settings["enabled"] and self.state == "half_open":
+                if self._probe_in_flight:
+                    self.short_circuits += 1
+                    return f"Circuit half-open for {self.target}; probe in progress"
+                self._probe_in_flight = probe = True
+            entered_state = self.state
+            limit = int(settings["max_concurrent_per_endpoint"])
+            if limit != self._limit:
+                self._limit = limit
+                self._slots = threading.BoundedSemaphore(limit) if limit > 0 else None
+            slots = self._slots
+        if slots is not None and not slots.acquire(timeout=max(0.0, acquire_timeout)):
+            with self._lock:
+                if probe:
+                    self._probe_in_flight = False
+                self.short_circuits += 1
+            return f"Concurrency limit reached for {self.target}"
+        with self._lock:
+            self.in_flight += 1
+        # enter() and exit() run on the same thread; remember what this call holds.
+        setattr(_BREAKER_LOCAL, self.target, (slots, probe, entered_state))
+        return ""
+
+    def exit(self, ok: bool) -> None:
+        slots, probe, entered_state = getattr(_BREAKER_LOCAL, self.target, (None, False, "closed"))
+        setattr(_BREAKER_LOCAL, self.target, (None, False, "closed"))
+        if slots is not None:
+            try:
+                slots.release()
+            except ValueError:
+                pass
+        settings = _BREAKER_SETTINGS
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            if probe:
+                # Only the call that took the half-open probe slot gives it back.
+                self._probe_in_flight = False
+            elif entered_state != "closed" or self.state != "closed":
+                # Started before the breaker opened, or ended while it is open/half-open:
+                # only the probe decides whether the target recovered.
+                return
+            if ok:
+                self.consecutive_failures = 0
+                self.state = "closed"
+                return
+            self.consecutive_failures += 1
+            if settings["enabled"] and (
+                self.state == "half_open" or self.consecutive_failures >= int(settings["failure_threshold"])
+            ):
+                if self.state != "open":
+                    self.trips += 1
+                    logging.warning("MPPS circuit opened for %s after %s failure(s)", self.target, self.consecutive_failures)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "trips": self.trips,
+                "short_circuits": self.short_circuits,
+                "in_flight": self.in_flight,
+            }
+
+
+_BREAKER_LOCAL = threading.local()
+_BREAKERS_LOCK = threading.Lock()
+_BREAKERS: Dict[str, _CircuitBreaker] = {}
+
+
+def _breaker_for(target: str) -> _CircuitBreaker:
+    with _BREAKERS_LOCK:
+        breaker = _BREAKERS.get(target)
+        if breaker is None:
+            breaker = _CircuitBreaker(target)
+            _BREAKERS[target] = breaker
+        return breaker
+
+
+def _db_target(db_cfg: Dict[str, Any]) -> str:
+    cfg = db_cfg or {}
+    return f"sql:{str(cfg.get('type') or 'oracle').lower()}:{str(cfg.get('dsn') or '').strip()}"
+
+
+def circuit_breaker_stats() -> Dict[str, Any]:
+    with _BREAKERS_LOCK:
+        breakers = list(_BREAKERS.values())
+    return {b.target: b.stats() for b in breakers}
+
+
+_LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class _LatencyHistogram:
+    """Fixed-bucket latency histogram; quantiles are bucket upper bounds."""
+
+    __slots__ = ("counts", "count", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.counts = [0] * (len(_LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(_LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def quantile(self, q: float) -> float | None:
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= target and n:
+                if idx < len(_LATENCY_BUCKETS_MS):
+                    return min(float(_LATENCY_BUCKETS_MS[idx]), round(self.max_ms, 1))
+                break
+        return round(self.max_ms, 1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"le_{b}" for b in _LATENCY_BUCKETS_MS] + ["inf"]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 1) if self.count else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "max_ms": round(self.max_ms, 1),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class _ActionMetrics:
+    """Per-action outcome counters and queue/execution latency, plus per-leg latency."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._actions: Dict[str, Dict[str, Any]] = {}
+
+    def _entry(self, action_id: str) -> Dict[str, Any]:
+        entry = self._actions.get(action_id)
+        if entry is None:
+            entry = {
+                "succeeded": 0,
+                "failed": 0,
+                "skipped": 0,
+                "unfinished": 0,
+                "queue": _LatencyHistogram(),
+                "exec": _LatencyHistogram(),
+                "legs": {},
+            }
+            self._actions[action_id] = entry
+        return entry
+
+    def skipped(self, action_ids: List[str]) -> None:
+        with self._lock:
+            for action_id in action_ids:
+                self._entry(action_id)["skipped"] += 1
+
+    def unfinished(self, action_id: str) -> None:
+        with self._lock:
+            self._entry(action_id)["unfinished"] += 1
+
+    def action(self, action_id: str, ok: bool, queue_ms: float, exec_ms: float) -> None:
+        with self._lock:
+            entry = self._entry(action_id)
+            entry["succeeded" if ok else "failed"] += 1
+            entry["queue"].observe(queue_ms)
+            entry["exec"].observe(exec_ms)
+
+    def leg(self, action_id: str, leg: str, result: Dict[str, Any], exec_ms: float) -> None:
+        with self._lock:
+            legs = self._entry(action_id)["legs"]
+            stats = legs.get(leg)
+            if stats is None:
+                stats = legs[leg] = {"succeeded": 0, "failed": 0, "short_circuited": 0, "exec": _LatencyHistogram()}
+            if result.get("short_circuited"):
+                stats["short_circuited"] += 1
+            stats["succeeded" if result.get("ok") else "failed"] += 1
+            stats["exec"].observe(exec_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                action_id: {
+                    "succeeded": entry["succeeded"],
+                    "failed": entry["failed"],
+                    "skipped": entry["skipped"],
+                    "unfinished": entry["unfinished"],
+                    "queue": entry["queue"].snapshot(),
+                    "exec": entry["exec"].snapshot(),
+                    "legs": {
+                        leg: {
+                            "succeeded": stats["succeeded"],
+                            "failed": stats["failed"],
+                            "short_circuited": stats["short_circuited"],
+                            "exec": stats["exec"].snapshot(),
+                        }
+                        for leg, stats in entry["legs"].items()
+                    },
+                }
+                for action_id, entry in self._actions.items()
+            }
+
+
+_ACTION_METRICS = _ActionMetrics()
+
+
+def action_metrics() -> Dict[str, Any]:
+    """Outcome counters and latency histograms per action id and leg (api/sql)."""
+    return _ACTION_METRICS.snapshot()
+
+
+def _timed_leg(action_id: str, leg: str, fn, *args) -> Dict[str, Any]:
+    started = time.perf_counter()
+    result = fn(*args)
+    _ACTION_METRICS.leg(action_id, leg, result, (time.perf_counter() - started) * 1000)
+    return result
+
+
+class _SqlBatcher:
+    """Collects SQL legs of one action and writes them in a single transaction.
+
+    Items are flushed when batch_max_size is reached or batch_window_ms after the
+    first queued item. Each flush renders the bound statements, runs executemany
+    per distinct statement text and commits once; if that fails it rolls back and
+    retries row by row so every event gets its own outcome. submit() returns a
+    Future that resolves to that outcome (None on success, else the error), so
+    the event is only reported as handled once its row is committed.
+    """
+
+    def __init__(self, action_id: str, db_cfg: Dict[str, Any]):
+        self.action_id = action_id
+        self.db_cfg = dict(db_cfg or {})
+        self.window_seconds = 0.25
+        self.max_size = 50
+        self._cond = threading.Condition()
+        self._items: List[Tuple[str, Dict[str, Any], str, Future]] = []
+        self._first_at = 0.0
+        self.batches = 0
+        self.events = 0
+        self.failures = 0
+        self.commits = 0
+        self._thread = threading.Thread(target=self._loop, name=f"mpps-sql-batch-{action_id}", daemon=True)
+        self._thread.start()
+
+    def configure(self, window_ms: int, max_size: int) -> None:
+        with self._cond:
+            self.window_seconds = max(0.01, window_ms / 1000.0)
+            self.max_size = max(1, int(max_size))
+
+    def submit(self, sql_tpl: str, flat_payload: Dict[str, Any], label: str) -> Future:
+        outcome: Future = Future()
+        with self._cond:
+            if not self._items:
+                self._first_at = time.monotonic()
+            self._items.append((sql_tpl, flat_payload, label, outcome))
+            self._cond.notify()
+        return outcome
+
+    def flush(self) -> None:
+        with self._cond:
+            items, self._items = self._items, []
+        if items:
+            self._write(items)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "queued": len(self._items),
+                "batches": self.batches,
+                "events": self.events,
+                "failures": self.failures,
+                "commits": self.commits,
+            }
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._items:
+                    self._cond.wait()
+                while len(self._items) < self.max_size:
+                    remaining = self._first_at + self.window_seconds - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                items = self._items[:self.max_size]
+                self._items = self._items[self.max_size:]
+                self._first_at = time.monotonic()
+            try:
+                self._write(items)
+            except Exception as exc:
+                logging.exception("MPPS SQL batch writer error (%s): %s", self.action_id, exc)
+                for *_, outcome in items:
+                    if not outcome.done():
+                        outcome.set_result(f"SQL batch writer error: {exc}")
+
+    def _write(self, items: List[Tuple[str, Dict[str, Any], str, Future]]) -> None:
+        outcomes: List[str | None] = [None] * len(items)
+        commits = 0
+        conn = None
+        cursor = None
+        breaker = _breaker_for(_db_target(self.db_cfg))
+        entered = False
+        try:
+            blocked = breaker.enter(_BREAKER_SETTINGS["acquire_timeout_seconds"])
+            if blocked:
+                raise RuntimeError(blocked)
+            entered = True
+            driver_name, conn = _db_connect(self.db_cfg)
+            cursor = conn.cursor()
+            groups: Dict[str, List[Tuple[int, Dict[str, Any]]]] = {}
+            for pos, (sql_tpl, flat_payload, _, _) in enumerate(items):
+                sql_text, params = _render_sql_bound(sql_tpl, flat_payload, driver_name)
+                groups.setdefault(sql_text, []).append((pos, params))
+            try:
+                for sql_text, rows in groups.items():
+                    cursor.executemany(sql_text, [params for _, params in rows])
+                conn.commit()
+                commits += 1
+            except Exception as batch_err:
+                logging.warning("MPPS SQL batch failed (%s), retrying per event: %s", self.action_id, batch_err)
+                conn.rollback()
+                for sql_text, rows in groups.items():
+                    for pos, params in rows:
+                        try:
+                            cursor.execute(sql_text, params)
+                            conn.commit()
+                            commits += 1
+                        except Exception as row_err:
+                            outcomes[pos] = str(row_err)
+                            try:
+                                conn.rollback()
+                            except Exception:
+                                pass
+        except Exception as e:
+            outcomes = [str(e)] * len(items)
+        finally:
+            try:
+                if cursor:
+                    cursor.close()
+            except Exception:
+                pass
+            try:
+                if conn:
+                    conn.close()
+            except Exception:
+                pass
+            if entered:
+                # Held until the batch is closed; a batch where only some rows failed still reached the database.
+                breaker.exit(ok=commits > 0 or all(error is None for error in outcomes))
+
+        with self._cond:
+            self.batches += 1
+            self.events += len(items)
+            self.commits += commits
+            self.failures += sum(1 for error in outcomes if error is not None)
+        for (_, _, label, outcome), error in zip(items, outcomes):
+            if error is None:
+                logging.info("MPPS action success: %s | sql (batched) | %s", self.action_id, label)
+            else:
+                logging.error("MPPS action failed: %s | sql (batched) | %s | %s", self.action_id, label, error)
+            outcome.set_result(error)
+
+
+_SQL_BATCHERS_LOCK = threading.Lock()
+_SQL_BATCHERS: Dict[Tuple[str, str], _SqlBatcher] = {}
+
+
+def _sql_batcher(action_cfg: Dict[str, Any], db_cfg: Dict[str, Any]) -> _SqlBatcher:
+    action_id = str(action_cfg.get("id") or "")
+    key = (action_id, json.dumps(db_cfg or {}, sort_keys=True, default=str))
+    sql_cfg = action_cfg.get("sql") or {}
+    with _SQL_BATCHERS_LOCK:
+        batcher = _SQL_BATCHERS.get(key)
+        if batcher is None:
+            batcher = _SqlBatcher(action_id, db_cfg)
+            _SQL_BATCHERS[key] = batcher
+    batcher.configure(int(sql_cfg.get("batch_window_ms") or 250), int(sql_cfg.get("batch_max_size") or 50))
+    return batcher
+
+
+def flush_sql_batches() -> None:
+    """Write every queued batched SQL leg now (used on shutdown)."""
+    with _SQL_BATCHERS_LOCK:
+        batchers = list(_SQL_BATCHERS.values())
+    for batcher in batchers:
+        batcher.flush()
+
+
+def sql_batch_stats() -> Dict[str, Any]:
+    with _SQL_BATCHERS_LOCK:
+        batchers = list(_SQL_BATCHERS.values())
+    return {b.action_id: b.stats() for b in batchers}
+
+
+_EXECUTOR_LOCK = threading.Lock()
+_ACTION_EXECUTOR: ThreadPoolExecutor | None = None
+_LEG_EXECUTOR: ThreadPoolExecutor | None = None
+_EXECUTOR_WORKERS = 0
+
+
+def executor_stats() -> Dict[str, Any]:
+    """Pool size and the number of actions/legs waiting for a worker."""
+    with _EXECUTOR_LOCK:
+        pools = (_ACTION_EXECUTOR, _LEG_EXECUTOR)
+        workers = _EXECUTOR_WORKERS
+    return {
+        "max_workers": workers,
+        "queued_actions": pools[0]._work_queue.qsize() if pools[0] is not None else 0,
+        "queued_legs": pools[1]._work_queue.qsize() if pools[1] is not None else 0,
+    }
+
+
+def _executors(max_workers: int) -> Tuple[ThreadPoolExecutor, ThreadPoolExecutor]:
+    """Shared pools: one for actions, one for the api leg of `both` actions.
+
+    Legs get their own pool so an action waiting on its leg can never starve it.
+    """
+    global _ACTION_EXECUTOR, _LEG_EXECUTOR, _EXECUTOR_WORKERS
+    with _EXECUTOR_LOCK:
+        if _ACTION_EXECUTOR is None or _LEG_EXECUTOR is None or _EXECUTOR_WORKERS != max_workers:
+            old = (_ACTION_EXECUTOR, _LEG_EXECUTOR)
+            _ACTION_EXECUTOR = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mpps-action")
+            _LEG_EXECUTOR = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mpps-leg")
+            _EXECUTOR_WORKERS = max_workers
+            for pool in old:
+                if pool is not None:
+                    pool.shutdown(wait=False)
+        return _ACTION_EXECUTOR, _LEG_EXECUTOR
+
+
+def _execute_single_action(
+    action_cfg: Dict[str, Any],
+    db_cfg: Dict[str, Any],
+    view: "MPPSEventView",
     debug_output: bool = False,
+    leg_executor: ThreadPoolExecutor | None = None,
+    trigger_spec: _TriggerSpec | None = None,
 ) -> Dict[str, Any]:
-    action_cfg = normalize_action_config(action_cfg)
+    # action_cfg comes normalized (and its templates compiled) from the registry.
     mode = str(action_cfg.get("mode", "none")).lower()
-    event_type = str(event_type or "").upper()
-    payload = payload if isinstance(payload, dict) else {}
-    raw_dataset = _dataset_to_dict(dataset_obj) if dataset_obj is not None else {}
-    composed_payload: Dict[str, Any] = dict(payload)
-    if action_cfg.get("include_raw_dataset"):
-        composed_payload["dataset"] = raw_dataset
-    composed_payload["_event_type"] = event_type
-    flat_payload = _flatten(composed_payload)
-
-    trigger, reason = _should_trigger(action_cfg, event_type, flat_payload)
+    action_id = str(action_cfg.get("id") or "")
+    event_type = view.event_type
+    include_raw = bool(action_cfg.get("include_raw_dataset"))
+    flat_payload = view.flat(include_raw)
+
+    spec = trigger_spec or _TriggerSpec(action_cfg)
+    trigger, reason = spec.check(event_type, *_trigger_keys(flat_payload))
     if not trigger:
         return {
             "action_id": action_cfg.get("id"),
@@ -545,119 +1615,33 @@ def _execute_single_action(
         }
 
     results: List[Dict[str, Any]] = []
-    overall_ok = True
-
+    api_future: Future | None = None
+    api_result: Dict[str, Any] | None = None
     if mode in ("api", "both"):
-        api_cfg = action_cfg.get("api") or {}
-        api_url = str(api_cfg.get("url") or "").strip()
-        if api_url:
-            method = str(api_cfg.get("method", "POST")).strip().upper() or "POST"
-            timeout_seconds = int(api_cfg.get("timeout_seconds", 10) or 10)
-            headers_raw = str(api_cfg.get("headers_json", "{}"))
-            tpl_raw = str(api_cfg.get("payload_template_json", "{}"))
-            try:
-                headers = json.loads(_render_template(headers_raw, flat_payload))
-                if not isinstance(headers, dict):
-                    headers = {}
-            except Exception:
-                headers = {}
-
-            try:
-                rendered_payload_text = _render_template(tpl_raw, flat_payload)
-                body_obj = json.loads(rendered_payload_text) if rendered_payload_text.strip() else {}
-            except Exception:
-                body_obj = composed_payload
-
-            try:
-                body = json.dumps(body_obj, ensure_ascii=False).encode("utf-8")
-                req = urllib.request.Request(api_url, data=body, method=method)
-                req.add_header("Content-Type", "application/json")
-                for k, v in headers.items():
-                    req.add_header(str(k), str(v))
-                with urllib.request.urlopen(req, timeout=timeout_seconds) as resp:
-                    status_code = int(getattr(resp, "status", 200))
-                    resp_text = resp.read().decode("utf-8", errors="replace")
-                item_ok = 200 <= status_code < 300
-                overall_ok = overall_ok and item_ok
-                results.append(
-                    {
-                        "type": "api",
-                        "ok": item_ok,
-                        "url": api_url,
-                        "status_code": status_code,
-                        "response": resp_text[:1000],
-                        **({"request_body": body_obj, "request_headers": headers} if debug_output else {}),
-                    }
-                )
-            except urllib.error.HTTPError as e:
-                overall_ok = False
-                results.append(
-                    {
-                        "type": "api",
-                        "ok": False,
-                        "url": api_url,
-                        "status_code": int(getattr(e, "code", 500)),
-                        "error": str(e),
-                    }
-                )
-            except Exception as e:
-                overall_ok = False
-                results.append({"type": "api", "ok": False, "url": api_url, "error": str(e)})
+        if mode == "both" and leg_executor is not None:
+            # Run the api leg alongside the sql leg; results keep api-then-sql order.
+            api_future = leg_executor.submit(
+                _timed_leg, action_id, "api", _run_api_leg, action_cfg, flat_payload, view, include_raw, debug_output
+            )
         else:
-            results.append({"type": "api", "ok": True, "skipped": True, "reason": "API URL is empty"})
+            api_result = _timed_leg(
+                action_id, "api", _run_api_leg, action_cfg, flat_payload, view, include_raw, debug_output
+            )
 
+    sql_result = None
     if mode in ("sql", "both"):
-        sql_cfg = action_cfg.get("sql") or {}
-        sql_tpl = str(sql_cfg.get("on_n_create", "") if event_type == "N-CREATE" else sql_cfg.get("on_n_set", ""))
-        if sql_tpl.strip():
-            placeholder_debug = None
-            if debug_output:
-                placeholder_debug = {}
-                for key in _extract_sql_placeholders(sql_tpl):
-                    value = _resolve_placeholder_value(flat_payload, key)
-                    placeholder_debug[key] = "" if value is None else str(value)
-            sql_text = _render_template(sql_tpl, flat_payload, sql_mode=True)
-            conn = None
-            cursor = None
-            try:
-                driver_name, conn = _db_connect(db_cfg or {})
-                cursor = conn.cursor()
-                cursor.execute(sql_text)
-                try:
-                    rows = cursor.rowcount
-                except Exception:
-                    rows = None
-                conn.commit()
-                results.append({
-                    "type": "sql",
-                    "ok": True,
-                    "driver": driver_name,
-                    "rowcount": rows,
-                    **({"executed_sql": sql_text} if debug_output else {}),
-                    **({"resolved_placeholders": placeholder_debug} if debug_output else {}),
-                })
-            except Exception as e:
-                overall_ok = False
-                results.append({
-                    "type": "sql",
-                    "ok": False,
-                    "error": str(e),
-                    **({"executed_sql": sql_text} if debug_output else {}),
-                    **({"resolved_placeholders": placeholder_debug} if debug_output else {}),
-                })
-            finally:
-                try:
-                    if cursor:
-                        cursor.close()
-                except Exception:
-                    pass
-                try:
-                    if conn:
-                        conn.close()
-                except Exception:
-                    pass
-        else:
-            results.append({"type": "sql", "ok": True, "skipped": True, "reason": "SQL template is empty"})
+        sql_result = _timed_leg(action_id, "sql", _run_sql_leg, action_cfg, db_cfg, event_type, flat_payload, debug_output)
+
+    if api_future is not None:
+        try:
+            api_result = api_future.result()
+        except Exception as e:
+            api_result = {"type": "api", "ok": False, "error": str(e)}
+    if api_result is not None:
+        results.append(api_result)
+    if sql_result is not None:
+        results.append(sql_result)
+    overall_ok = all(item.get("ok") for item in results)
 
     for item in results:
         if item.get("ok"):
@@ -675,6 +1659,180 @@ def _execute_single_action(
     }
 
 
+def _unfinished_action_result(action_cfg: Dict[str, Any], reason: str) -> Dict[str, Any]:
+    return {
+        "action_id": action_cfg.get("id"),
+        "action_name": action_cfg.get("name"),
+        "ok": False,
+        "skipped": False,
+        "reason": reason,
+        "results": [],
+    }
+
+
+class _ActionOutcomes:
+    """Which actions of one event already have their outcome recorded (first caller wins).
+
+    Lets an action that outlives the event deadline skip its metrics, since the
+    deadline already counted it as unfinished.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._settled: set = set()
+
+    def settle(self, idx: int) -> bool:
+        with self._lock:
+            if idx in self._settled:
+                return False
+            self._settled.add(idx)
+            return True
+
+    def settled(self, idx: int) -> bool:
+        with self._lock:
+            return idx in self._settled
+
+
+def _run_actions_concurrently(
+    action_defs: List[Dict[str, Any]],
+    run_one,
+    action_executor: ThreadPoolExecutor,
+    deadline_seconds: float,
+    known_ids: set | None = None,
+) -> List[Dict[str, Any]]:
+    """Run run_one(index, queued_at, outcomes) for each action on the pool, honoring depends_on.
+
+    Results are returned in input order. run_one records an action's metrics
+    only if outcomes.settle(index) succeeds; after the deadline the action is
+    settled here as unfinished instead.
+
+    Dependencies on ids in known_ids that are not part of this run (e.g. not
+    triggered by the event) are treated as already satisfied.
+    """
+    ids = [str(a.get("id") or "") for a in action_defs]
+    running_ids = set(ids)
+    known = running_ids | set(known_ids or ())
+    deps: List[set] = []
+    for idx, action in enumerate(action_defs):
+        wanted = {str(d) for d in (action.get("depends_on") or []) if str(d) in running_ids and str(d) != ids[idx]}
+        missing = [str(d) for d in (action.get("depends_on") or []) if str(d) not in known]
+        if missing:
+            logging.warning("MPPS action %s depends_on unknown action(s): %s", ids[idx], ", ".join(missing))
+        deps.append(wanted)
+
+    results: List[Dict[str, Any] | None] = [None] * len(action_defs)
+    done_ids: set = set()
+    pending = set(range(len(action_defs)))
+    running: Dict[Future, int] = {}
+    outcomes = _ActionOutcomes()
+    deadline = time.monotonic() + deadline_seconds
+
+    while pending or running:
+        for idx in sorted(pending):
+            # An id shared by several actions only counts as done when all of them are.
+            if all(d in done_ids for d in deps[idx]):
+                pending.discard(idx)
+                running[action_executor.submit(run_one, idx, time.perf_counter(), outcomes)] = idx
+        if not running:
+            for idx in pending:
+                results[idx] = _unfinished_action_result(action_defs[idx], "Dependency cycle in depends_on")
+                _ACTION_METRICS.unfinished(ids[idx])
+            break
+        remaining = deadline - time.monotonic()
+        finished, _ = wait(list(running), timeout=max(0.0, remaining), return_when=FIRST_COMPLETED)
+        if not finished:
+            for fut, idx in running.items():
+                fut.cancel()
+                if outcomes.settle(idx):
+                    reason = "Event deadline exceeded; the action may still finish in the background"
+                    if fut.cancelled():
+                        reason = "Event deadline exceeded before the action started"
+                    results[idx] = _unfinished_action_result(action_defs[idx], reason)
+                    _ACTION_METRICS.unfinished(ids[idx])
+                else:
+                    # Finished right at the deadline and already recorded its outcome.
+                    results[idx] = fut.result()
+            for idx in pending:
+                outcomes.settle(idx)
+                results[idx] = _unfinished_action_result(action_defs[idx], "Event deadline exceeded before the action started")
+                _ACTION_METRICS.unfinished(ids[idx])
+            logging.error("MPPS actions exceeded event deadline of %ss", deadline_seconds)
+            break
+        for fut in finished:
+            idx = running.pop(fut)
+            try:
+                results[idx] = fut.result()
+            except Exception as e:
+                outcomes.settle(idx)
+                results[idx] = _unfinished_action_result(action_defs[idx], f"Action crashed: {e}")
+                _ACTION_METRICS.unfinished(ids[idx])
+            finished_id = ids[idx]
+            if all(results[j] is not None for j, aid in enumerate(ids) if aid == finished_id):
+                done_ids.add(finished_id)
+
+    return [r for r in results if r is not None]
+
+
+class MPPSEventView:
+    """Per-event payload/dataset view shared by triggers, actions and logging.
+
+    The DICOM dataset is converted to a dict at most once, and only when something
+    reads it; the flattened, indexed payload is built once per include_raw_dataset
+    variant. Safe to share across the action threads of one event.
+    """
+
+    def __init__(self, event_type: str, payload: Dict[str, Any], dataset_obj: Any = None):
+        self.event_type = str(event_type or "").upper()
+        self.payload = payload if isinstance(payload, dict) else {}
+        self.dataset_obj = dataset_obj
+        self._lock = threading.Lock()
+        self._raw: List[Dict[str, Any]] = []
+        self._composed: Dict[bool, Dict[str, Any]] = {}
+        self._flat: Dict[bool, _PayloadIndex] = {}
+
+    def with_payload(self, payload: Dict[str, Any]) -> "MPPSEventView":
+        """Same event and dataset (conversion shared) with a different payload."""
+        other = MPPSEventView(self.event_type, payload, self.dataset_obj)
+        other._raw = self._raw
+        return other
+
+    @property
+    def raw_dataset(self) -> Dict[str, Any]:
+        if not self._raw:
+            with self._lock:
+                if not self._raw:
+                    self._raw.append(_dataset_to_dict(self.dataset_obj) if self.dataset_obj is not None else {})
+        return self._raw[0]
+
+    def composed(self, include_raw: bool) -> Dict[str, Any]:
+        composed = self._composed.get(include_raw)
+        if composed is None:
+            composed = dict(self.payload)
+            if include_raw:
+                composed["dataset"] = self.raw_dataset
+            composed["_event_type"] = self.event_type
+            with self._lock:
+                composed = self._composed.setdefault(include_raw, composed)
+        return composed
+
+    def flat(self, include_raw: bool) -> _PayloadIndex:
+        flat = self._flat.get(include_raw)
+        if flat is None:
+            flat = _PayloadIndex(_flatten(self.composed(include_raw)))
+            with self._lock:
+                flat = self._flat.setdefault(include_raw, flat)
+        return flat
+
+    def pick_first(self, keys: List[str]) -> str:
+        """First non-empty value among keys, looking in the payload and the dataset."""
+        flat = self.flat(True)
+        for key in keys:
+            value = flat.first_non_empty(key)
+            if _has_non_empty(value):
+                return str(value).strip()
+        return ""
+
+
 def execute_mpps_actions(
     mpps_cfg: Dict[str, Any],
     db_cfg: Dict[str, Any],
@@ -682,41 +1840,117 @@ def execute_mpps_actions(
     payload: Dict[str, Any],
     dataset_obj: Any = None,
     root_dir: Path | None = None,
+    event_view: MPPSEventView | None = None,
+    debug_output: bool | None = None,
 ) -> Dict[str, Any]:
+    """Run the actions triggered by an event.
+
+    debug_output overrides mpps.debug_output, e.g. for events the listener
+    did not sample for debug capture.
+
+    Batched SQL legs are only queued when this returns: their Futures are in
+    pending_sql and resolve to None once committed (else to the error), so the
+    caller must not treat the event as fully handled before they do.
+    """
     root = Path(root_dir or ".")
     normalized_mpps = merge_mpps_config(mpps_cfg, root)
-    debug_output = bool(normalized_mpps.get("debug_output"))
+    if debug_output is None:
+        debug_output = bool(normalized_mpps.get("debug_output"))
+    execution = normalized_mpps.get("execution") or {}
+    view = event_view or MPPSEventView(event_type, payload, dataset_obj)
+    event_type = view.event_type
+    _BREAKER_SETTINGS.update(normalized_mpps.get("circuit_breaker") or {})
 
-    all_action_results: List[Dict[str, Any]] = []
     overall_ok = True
 
-    action_defs = list_action_files(root)
-
-    # Backward compatibility: old single action block in config.json
     legacy_actions = (mpps_cfg or {}).get("actions") if isinstance((mpps_cfg or {}).get("actions"), dict) else None
-    if legacy_actions:
-        legacy = normalize_action_config(legacy_actions)
-        if not legacy.get("id"):
-            legacy["id"] = "legacy"
-        if not legacy.get("name"):
-            legacy["name"] = "Legacy Action"
-        action_defs.append(legacy)
+    registry = load_action_registry(root, legacy_actions)
+    action_defs = registry.actions
 
     if not action_defs:
         return {"ok": True, "skipped": True, "reason": "No MPPS actions configured", "actions": []}
 
-    for action in action_defs:
-        res = _execute_single_action(action, db_cfg, event_type, payload, dataset_obj, debug_output=debug_output)
-        all_action_results.append(res)
+    # Only actions indexed under this event's (event, status, modality) are evaluated.
+    candidates: set = set()
+    for include_raw in registry.raw_variants:
+        candidates.update(registry.candidates(include_raw, event_type, *_trigger_keys(view.flat(include_raw))))
+    selected_idx = sorted(candidates)
+    selected = [action_defs[idx] for idx in selected_idx]
+    _ACTION_METRICS.skipped(
+        [str(a.get("id") or "") for idx, a in enumerate(action_defs) if idx not in candidates]
+    )
+
+    action_executor, leg_executor = _executors(int(execution.get("max_workers") or 4))
+
+    def run_one(pos: int, queued_at: float, outcomes: _ActionOutcomes) -> Dict[str, Any]:
+        idx = selected_idx[pos]
+        if outcomes.settled(pos):
+            # The event deadline passed while this action waited for a worker.
+            return _unfinished_action_result(action_defs[idx], "Event deadline exceeded before the action started")
+        started = time.perf_counter()
+        result = _execute_single_action(
+            action_defs[idx],
+            db_cfg,
+            view,
+            debug_output=debug_output,
+            leg_executor=leg_executor,
+            trigger_spec=registry.specs[idx],
+        )
+        action_id = str(action_defs[idx].get("id") or "")
+        if not outcomes.settle(pos):
+            logging.warning(
+                "MPPS action %s finished after the event deadline (ok=%s)", action_id, bool(result.get("ok"))
+            )
+        elif result.get("skipped"):
+            _ACTION_METRICS.skipped([action_id])
+        else:
+            _ACTION_METRICS.action(
+                action_id,
+                bool(result.get("ok")),
+                (started - queued_at) * 1000,
+                (time.perf_counter() - started) * 1000,
+            )
+        return result
+
+    selected_results = _run_actions_concurrently(
+        selected, run_one, action_executor, float(execution.get("event_deadline_seconds") or 30), registry.ids
+    )
+    pending_sql: List[Future] = []
+    for res in selected_results:
         if not res.get("ok", True):
             overall_ok = False
+        for item in res.get("results") or []:
+            if "pending" in item:
+                pending_sql.append(item.pop("pending"))
+
+    if debug_output:
+        # Explain every action that the dispatch table ruled out, in configured order.
+        by_idx = dict(zip(selected_idx, selected_results))
+        all_action_results = []
+        for idx, action in enumerate(action_defs):
+            if idx in by_idx:
+                all_action_results.append(by_idx[idx])
+                continue
+            flat = view.flat(bool(action.get("include_raw_dataset")))
+            _, reason = registry.specs[idx].check(event_type, *_trigger_keys(flat))
+            all_action_results.append({
+                "action_id": action.get("id"),
+                "action_name": action.get("name"),
+                "ok": True,
+                "skipped": True,
+                "reason": reason,
+                "results": [],
+            })
+    else:
+        all_action_results = selected_results
 
     return {
         "ok": overall_ok,
         "skipped": False,
         "reason": "Executed",
         "actions": all_action_results,
+        "skipped_actions": len(action_defs) - len(selected),
         "mpps_enabled": normalized_mpps.get("enabled"),
         "debug_output": debug_output,
+        "pending_sql": pending_sql,
     }
-
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""Load generator for the MPPS listener.
+
+Starts MPPSService in-process against local stand-ins (an HTTP server for API
+actions and a SQLite file for SQL actions) inside a temporary root, then drives
+``--scus`` concurrent SCUs through N-CREATE -> N-SET IN PROGRESS -> N-SET
+COMPLETED lifecycles. Reports DIMSE response latency percentiles, action
+throughput, action/batch queue depths, and growth of the procedure-step store
+and process memory. Use ``--soak`` for a long run at a steady rate.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import shutil
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List
+
+if os.environ.get('FLOWWORKLIST_DISABLE_NUMPY', '1') == '1':
+    sys.modules.setdefault('numpy', None)
+
+from pydicom.dataset import Dataset
+from pydicom.uid import generate_uid
+from pynetdicom import AE
+
+import mpps_service
+from mpps_actions import executor_stats, flush_sql_batches, save_action_file, set_db_connector, sql_batch_stats
+
+try:
+    import psutil
+except Exception:
+    psutil = None
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def _rss_mb() -> float | None:
+    if psutil is None:
+        return None
+    return round(psutil.Process().memory_info().rss / (1024 * 1024), 1)
+
+
+class _HisStub(BaseHTTPRequestHandler):
+    delay_seconds = 0.0
+    hits = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.delay_seconds:
+            time.sleep(self.delay_seconds)
+        with self.lock:
+            type(self).hits += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b'{"ok":true}')
+
+    def log_message(self, *args):
+        pass
+
+
+def _create_dataset(step: int, worker: int) -> Dataset:
+    ds = Dataset()
+    ds.PatientName = f"BENCH^{worker}^{step}"
+    ds.PatientID = f"B{worker:03d}{step:06d}"
+    ds.AccessionNumber = f"ACC{worker:03d}{step:06d}"
+    ds.StudyInstanceUID = generate_uid()
+    ds.Modality = "CT"
+    ds.PerformedStationAETitle = f"BENCH{worker:03d}"
+    ds.PerformedProcedureStepID = f"PPS{step}"
+    ds.PerformedProcedureStepStartDate = datetime.now().strftime("%Y%m%d")
+    ds.PerformedProcedureStepStartTime = datetime.now().strftime("%H%M%S")
+    ds.PerformedProcedureStepStatus = "IN PROGRESS"
+    ssa = Dataset()
+    ssa.AccessionNumber = ds.AccessionNumber
+    ssa.StudyInstanceUID = ds.StudyInstanceUID
+    ssa.RequestedProcedureID = f"RP{step}"
+    ssa.ScheduledProcedureStepID = f"SPS{step}"
+    ds.ScheduledStepAttributesSequence = [ssa]
+    return ds
+
+
+def _set_dataset(status: str) -> Dataset:
+    ds = Dataset()
+    ds.PerformedProcedureStepStatus = status
+    if status == "COMPLETED":
+        ds.PerformedProcedureStepEndDate = datetime.now().strftime("%Y%m%d")
+        ds.PerformedProcedureStepEndTime = datetime.now().strftime("%H%M%S")
+    return ds
+
+
+class _Bench:
+    def __init__(self, args, port: int):
+        self.args = args
+        self.port = port
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {"N-CREATE": [], "N-SET IN PROGRESS": [], "N-SET COMPLETED": []}
+        self.failures: Dict[str, int] = {}
+        self.lifecycles = 0
+        self.samples: List[Dict[str, Any]] = []
+
+    def _record(self, op: str, status, elapsed: float):
+        code = getattr(status, "Status", None)
+        with self.lock:
+            if code == 0x0000:
+                self.latencies[op].append(elapsed)
+            else:
+                reason = f"{op} status {hex(code) if code is not None else 'none'}"
+                self.failures[reason] = self.failures.get(reason, 0) + 1
+
+    def _scu(self, worker: int, deadline: float | None):
+        ae = AE(ae_title=f"BENCH{worker:03d}".encode("ascii"))
+        ae.add_requested_context(mpps_service.MPPSService.MPPS_SOP_CLASS_UID)
+        assoc = ae.associate("127.0.0.1", self.port, ae_title=b"FLOWMPPS")
+        if not assoc.is_established:
+            with self.lock:
+                self.failures["association rejected/aborted"] = self.failures.get("association rejected/aborted", 0) + 1
+            return
+        cls = mpps_service.MPPSService.MPPS_SOP_CLASS_UID
+        step = 0
+        try:
+            while (step < self.args.lifecycles) if deadline is None else (time.monotonic() < deadline):
+                uid = generate_uid()
+                steps = (
+                    ("N-CREATE", lambda: assoc.send_n_create(_create_dataset(step, worker), cls, uid)),
+                    ("N-SET IN PROGRESS", lambda: assoc.send_n_set(_set_dataset("IN PROGRESS"), cls, uid)),
+                    ("N-SET COMPLETED", lambda: assoc.send_n_set(_set_dataset("COMPLETED"), cls, uid)),
+                )
+                for op, send in steps:
+                    started = time.perf_counter()
+                    status, _ = send()
+                    self._record(op, status, time.perf_counter() - started)
+                    if self.args.think_ms:
+                        time.sleep(self.args.think_ms / 1000.0)
+                with self.lock:
+                    self.lifecycles += 1
+                step += 1
+        finally:
+            if assoc.is_established:
+                assoc.release()
+
+    def _sample(self, service, started: float):
+        execs = executor_stats()
+        batches = sql_batch_stats()
+        self.samples.append({
+            "t": round(time.perf_counter() - started, 1),
+            "queued_actions": execs["queued_actions"],
+            "queued_legs": execs["queued_legs"],
+            "queued_sql_batch": sum(b.get("queued", 0) for b in batches.values()),
+            "step_store_size": service._steps.stats()["size"],
+            "rss_mb": _rss_mb(),
+            "api_hits": _HisStub.hits,
+        })
+
+    def run(self, service) -> float:
+        deadline = time.monotonic() + self.args.soak if self.args.soak else None
+        threads = [threading.Thread(target=self._scu, args=(w, deadline), daemon=True) for w in range(self.args.scus)]
+        started = time.perf_counter()
+        self._sample(service, started)
+        for t in threads:
+            t.start()
+        while any(t.is_alive() for t in threads):
+            time.sleep(self.args.sample_seconds)
+            self._sample(service, started)
+        flush_sql_batches()
+        wall = time.perf_counter() - started
+        self._sample(service, started)
+        return wall
+
+
+def _write_actions(root: Path, args, api_url: str):
+    if args.api:
+        save_action_file(root, {
+            "id": "bench-api",
+            "mode": "api",
+            "include_raw_dataset": args.include_raw,
+            "api": {
+                "url": api_url,
+                "payload_template_json": '{"sop": "{{sop_instance_uid}}", "status": "{{PerformedProcedureStepStatus}}", '
+                                         '"accession": "{{AccessionNumber}}"}',
+            },
+        })
+    if args.sql:
+        sql = (
+            "INSERT INTO mpps_event (sop_uid, event_type, status, accession) "
+            "VALUES (:sop_instance_uid, '{event}', :PerformedProcedureStepStatus, :AccessionNumber)"
+        )
+        save_action_file(root, {
+            "id": "bench-sql",
+            "mode": "sql",
+            "include_raw_dataset": False,
+            "sql": {
+                "on_n_create": sql.format(event="N-CREATE"),
+                "on_n_set": sql.format(event="N-SET"),
+                "batch_enabled": args.sql_batch,
+            },
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="mpps_bench", description="Load-test the MPPS listener in-process")
+    parser.add_argument("--scus", type=int, default=8, help="Concurrent SCUs (one association each)")
+    parser.add_argument("--lifecycles", type=int, default=50, help="Lifecycles per SCU (ignored with --soak)")
+    parser.add_argument("--soak", type=float, default=0, help="Run for this many seconds instead")
+    parser.add_argument("--think-ms", type=float, default=0, help="Pause between DIMSE requests of one SCU")
+    parser.add_argument("--api-delay-ms", type=float, default=20, help="Simulated HIS API latency")
+    parser.add_argument("--no-api", dest="api", action="store_false", help="Do not configure the API action")
+    parser.add_argument("--no-sql", dest="sql", action="store_false", help="Do not configure the SQL action")
+    parser.add_argument("--sql-batch", action="store_true", help="Enable batching on the SQL action")
+    parser.add_argument("--include-raw", action="store_true", help="Send the raw dataset with the API action")
+    parser.add_argument("--max-workers", type=int, default=4, help="mpps.execution.max_workers")
+    parser.add_argument("--persist", action="store_true", help="Persist the step store to SQLite")
+    parser.add_argument("--sample-seconds", type=float, default=1.0, help="Queue/memory sampling interval")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary root for inspection")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON, including samples")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    root = Path(tempfile.mkdtemp(prefix="mpps-bench-"))
+    mpps_service.BASE_DIR = root
+
+    _HisStub.delay_seconds = args.api_delay_ms / 1000.0
+    http = ThreadingHTTPServer(("127.0.0.1", 0), _HisStub)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+
+    db_path = root / "his.sqlite3"
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE mpps_event (sop_uid TEXT, event_type TEXT, status TEXT, accession TEXT)")
+    _write_actions(root, args, f"http://127.0.0.1:{http.server_address[1]}/mpps")
+    # The HIS stand-in: every SQL leg writes to the local SQLite file instead of a real driver.
+    set_db_connector(lambda db_cfg: ("sqlite3", sqlite3.connect(str(db_path), timeout=30)))
+
+    port = _free_port()
+    service = mpps_service.MPPSService({
+        "mpps": {
+            "enabled": True,
+            "listener": {"host": "127.0.0.1", "port": port, "aet": "FLOWMPPS"},
+            "execution": {"max_workers": args.max_workers},
+            "context_store": {"persist": args.persist},
+        },
+        "database": {"type": "sqlite", "dsn": str(db_path)},
+    })
+    server_thread = threading.Thread(target=service.run, daemon=True)
+    server_thread.start()
+    while service.server is None:
+        time.sleep(0.05)
+
+    bench = _Bench(args, port)
+    try:
+        wall = bench.run(service)
+    finally:
+        service.stop()
+        server_thread.join(timeout=10)
+        http.shutdown()
+
+    with sqlite3.connect(db_path) as conn:
+        sql_rows = conn.execute("SELECT COUNT(*) FROM mpps_event").fetchone()[0]
+    all_latencies = [v for values in bench.latencies.values() for v in values]
+    first, last = bench.samples[0], bench.samples[-1]
+    report: Dict[str, Any] = {
+        "scus": args.scus,
+        "lifecycles": bench.lifecycles,
+        "dimse_ok": len(all_latencies),
+        "failures": bench.failures,
+        "wall_seconds": round(wall, 3),
+        "dimse_per_second": round(len(all_latencies) / wall, 2) if wall > 0 else None,
+        "api_actions": _HisStub.hits,
+        "sql_rows": sql_rows,
+        "actions_per_second": round((_HisStub.hits + sql_rows) / wall, 2) if wall > 0 else None,
+        "latency_ms": {},
+        "max_queued_actions": max(s["queued_actions"] for s in bench.samples),
+        "max_queued_legs": max(s["queued_legs"] for s in bench.samples),
+        "max_queued_sql_batch": max(s["queued_sql_batch"] for s in bench.samples),
+        "step_store_size": {"start": first["step_store_size"], "end": last["step_store_size"]},
+        "rss_mb": {"start": first["rss_mb"], "end": last["rss_mb"]},
+    }
+    for name, values in (("all", all_latencies), *bench.latencies.items()):
+        if values:
+            report["latency_ms"][name] = {
+                "count": len(values),
+                "p50": round(_percentile(values, 50) * 1000, 2),
+                "p90": round(_percentile(values, 90) * 1000, 2),
+                "p99": round(_percentile(values, 99) * 1000, 2),
+                "max": round(max(values) * 1000, 2),
+            }
+
+    if args.keep:
+        report["root"] = str(root)
+    else:
+        shutil.rmtree(root, ignore_errors=True)
+
+    if args.json:
+        report["samples"] = bench.samples
+        print(json.dumps(report, indent=2))
+        return 0
+    print(f"SCUs: {report['scus']}  lifecycles: {report['lifecycles']}  wall: {report['wall_seconds']}s")
+    print(f"DIMSE ok: {report['dimse_ok']} ({report['dimse_per_second']}/s)  failures: {sum(bench.failures.values())}")
+    print(f"Actions: api={report['api_actions']} sql_rows={report['sql_rows']} ({report['actions_per_second']}/s)")
+    for name, stats in report["latency_ms"].items():
+        print(
+            f"{name:>18}: n={stats['count']} p50={stats['p50']}ms p90={stats['p90']}ms "
+            f"p99={stats['p99']}ms max={stats['max']}ms"
+        )
+    print(
+        f"Max queued: actions={report['max_queued_actions']} legs={report['max_queued_legs']} "
+        f"sql_batch={report['max_queued_sql_batch']}"
+    )
+    print(
+        f"Step store: {first['step_store_size']} -> {last['step_store_size']} entries  "
+        f"RSS: {first['rss_mb']} -> {last['rss_mb']} MB"
+    )
+    for reason, count in bench.failures.items():
+        print(f"  failed {count}x: {reason}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
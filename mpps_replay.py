@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""Replay an MPPS journal against an MPPS SCP and report latency/throughput.
+
+Records written by the MPPS listener with ``mpps.journal.enabled`` are re-sent
+as N-CREATE/N-SET in their original order. ``--speed`` scales the original
+inter-arrival gaps (1 = real time, 10 = ten times faster, max = no pacing).
+Events of the same procedure step always go through the same association so
+N-CREATE precedes its N-SETs; ``--concurrency`` sets how many associations run
+in parallel. Since the listener runs its actions before answering, the DIMSE
+response time is the end-to-end action latency seen by the modality.
+"""
+import argparse
+import json
+import math
+import os
+import queue
+import sys
+import threading
+import time
+import zlib
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Dict, List
+
+if os.environ.get('FLOWWORKLIST_DISABLE_NUMPY', '1') == '1':
+    sys.modules.setdefault('numpy', None)
+
+from pydicom.uid import UID, generate_uid
+from pynetdicom import AE
+from pynetdicom.dsutils import decode
+
+from mpps_store import JOURNAL_SUFFIX, iter_journal, journal_dir
+
+
+BASE_DIR = Path(__file__).parent
+MPPS_SOP_CLASS_UID = UID("1.2.840.10008.3.1.2.3.3")
+
+
+def _load_records(paths: List[Path], limit: int) -> List[Dict[str, Any]]:
+    records = []
+    for path in paths:
+        for header, body in iter_journal(path):
+            if header.get("event") not in ("N-CREATE", "N-SET") or not header.get("sop_instance_uid"):
+                continue
+            records.append({**header, "body": body})
+    records.sort(key=lambda r: float(r.get("ts") or 0))
+    return records[:limit] if limit > 0 else records
+
+
+def _decode_body(record: Dict[str, Any]):
+    ts = UID(record.get("transfer_syntax") or "1.2.840.10008.1.2")
+    return decode(
+        BytesIO(record["body"]),
+        ts.is_implicit_VR,
+        ts.is_little_endian,
+        ts.is_deflated,
+    )
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+class _Replayer:
+    def __init__(self, args):
+        self.args = args
+        self.queues = [queue.Queue() for _ in range(max(1, args.concurrency))]
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {"N-CREATE": [], "N-SET": []}
+        self.failures: Dict[str, int] = {}
+        self.uid_map: Dict[str, str] = {}
+
+    def _target_uid(self, uid: str) -> str:
+        if not self.args.fresh_uids:
+            return uid
+        with self.lock:
+            if uid not in self.uid_map:
+                self.uid_map[uid] = generate_uid()
+            return self.uid_map[uid]
+
+    def _fail(self, reason: str):
+        with self.lock:
+            self.failures[reason] = self.failures.get(reason, 0) + 1
+
+    def _worker(self, q: "queue.Queue"):
+        ae = AE(ae_title=self.args.aet.encode("ascii", errors="ignore"))
+        ae.add_requested_context(MPPS_SOP_CLASS_UID)
+        assoc = None
+        while True:
+            record = q.get()
+            if record is None:
+                break
+            if assoc is None or not assoc.is_established:
+                assoc = ae.associate(self.args.host, self.args.port, ae_title=self.args.called_aet)
+                if not assoc.is_established:
+                    self._fail("association rejected/aborted")
+                    assoc = None
+                    continue
+            try:
+                ds = _decode_body(record)
+            except Exception:
+                self._fail("undecodable dataset")
+                continue
+            event = record["event"]
+            uid = self._target_uid(record["sop_instance_uid"])
+            started = time.perf_counter()
+            try:
+                if event == "N-CREATE":
+                    status, _ = assoc.send_n_create(ds, MPPS_SOP_CLASS_UID, uid)
+                else:
+                    status, _ = assoc.send_n_set(ds, MPPS_SOP_CLASS_UID, uid)
+            except Exception as exc:
+                self._fail(f"{event} error: {exc.__class__.__name__}")
+                continue
+            elapsed = time.perf_counter() - started
+            code = getattr(status, "Status", None)
+            if code != 0x0000:
+                self._fail(f"{event} status {hex(code) if code is not None else 'none'}")
+                continue
+            with self.lock:
+                self.latencies[event].append(elapsed)
+        if assoc is not None and assoc.is_established:
+            assoc.release()
+
+    def run(self, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        threads = [threading.Thread(target=self._worker, args=(q,), daemon=True) for q in self.queues]
+        for t in threads:
+            t.start()
+        speed = self.args.speed
+        first_ts = float(records[0].get("ts") or 0) if records else 0.0
+        started = time.perf_counter()
+        for record in records:
+            if speed > 0:
+                due = started + (float(record.get("ts") or 0) - first_ts) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            slot = zlib.crc32(record["sop_instance_uid"].encode("utf-8")) % len(self.queues)
+            self.queues[slot].put(record)
+        for q in self.queues:
+            q.put(None)
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - started
+        return self._report(len(records), wall)
+
+    def _report(self, total: int, wall: float) -> Dict[str, Any]:
+        all_latencies = self.latencies["N-CREATE"] + self.latencies["N-SET"]
+        report: Dict[str, Any] = {
+            "events": total,
+            "ok": len(all_latencies),
+            "failed": sum(self.failures.values()),
+            "failures": self.failures,
+            "wall_seconds": round(wall, 3),
+            "throughput_per_second": round(len(all_latencies) / wall, 2) if wall > 0 else None,
+            "latency_ms": {},
+        }
+        for name, values in (("all", all_latencies), *self.latencies.items()):
+            if not values:
+                continue
+            report["latency_ms"][name] = {
+                "count": len(values),
+                "p50": round(_percentile(values, 50) * 1000, 2),
+                "p90": round(_percentile(values, 90) * 1000, 2),
+                "p99": round(_percentile(values, 99) * 1000, 2),
+                "max": round(max(values) * 1000, 2),
+            }
+        return report
+
+
+def _parse_speed(raw: str) -> float:
+    if str(raw).strip().lower() in ("max", "0"):
+        return 0.0
+    value = float(str(raw).lower().rstrip("x"))
+    if value <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or 'max'")
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="mpps_replay", description="Replay an MPPS journal against an MPPS SCP")
+    parser.add_argument("journal", nargs="*", help="Journal files or directories (default: mpps-data/journal)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4101)
+    parser.add_argument("--aet", default="MPPSREPLAY", help="Calling AE title")
+    parser.add_argument("--called-aet", default="FLOWMPPS", help="Called AE title")
+    parser.add_argument("--speed", type=_parse_speed, default=1.0, help="1, 10, ... or max")
+    parser.add_argument("--concurrency", type=int, default=4, help="Parallel associations")
+    parser.add_argument("--limit", type=int, default=0, help="Replay at most N events")
+    parser.add_argument("--fresh-uids", action="store_true", help="Map SOP Instance UIDs to new ones for this run")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    sources = [Path(p) for p in args.journal] or [journal_dir(BASE_DIR)]
+    paths: List[Path] = []
+    for src in sources:
+        paths.extend(sorted(src.glob(f"*{JOURNAL_SUFFIX}")) if src.is_dir() else [src])
+    records = _load_records(paths, args.limit)
+    if not records:
+        print("No MPPS journal records found.")
+        return 1
+
+    report = _Replayer(args).run(records)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    print(f"Events: {report['events']}  ok: {report['ok']}  failed: {report['failed']}")
+    print(f"Wall time: {report['wall_seconds']}s  throughput: {report['throughput_per_second']} events/s")
+    for name, stats in report["latency_ms"].items():
+        print(
+            f"{name:>8}: n={stats['count']} p50={stats['p50']}ms p90={stats['p90']}ms "
+            f"p99={stats['p99']}ms max={stats['max']}ms"
+        )
+    for reason, count in report["failures"].items():
+        print(f"  failed {count}x: {reason}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 import atexit
+import hashlib
 import json
 import logging
 import os
+import queue
+import random
 import sys
 import threading
 import time
@@ -16,15 +19,39 @@ from typing import Any, Dict
 if os.environ.get('FLOWWORKLIST_DISABLE_NUMPY', '1') == '1':
     sys.modules.setdefault('numpy', None)
 
+from pydicom.datadict import dictionary_VR
+from pydicom.dataset import Dataset
+from pydicom.tag import Tag
 from pydicom.uid import UID
 from pynetdicom import AE, evt
 
-from mpps_actions import execute_mpps_actions, merge_mpps_config
+from mpps_actions import (
+    MPPSEventView,
+    action_metrics,
+    circuit_breaker_stats,
+    execute_mpps_actions,
+    executor_stats,
+    flush_sql_batches,
+    merge_mpps_config,
+    sql_batch_stats,
+)
+from mpps_store import (
+    PERFORMED_FILE_NAME,
+    STORE_FILE_NAME,
+    EventDeduplicator,
+    MPPSJournal,
+    PerformedStepIndex,
+    ProcedureStepStore,
+    data_dir,
+    journal_dir,
+    write_status_snapshot,
+)
 
 
 BASE_DIR = Path(__file__).parent
 LOCK_FILE = BASE_DIR / "mpps_server.lock"
 CONFIG_FILE = BASE_DIR / "config.json"
+STATUS_INTERVAL_SECONDS = 5.0
 
 
 def _configure_logging():
@@ -125,22 +152,45 @@ def _event_payload(event, dataset_obj) -> Dict[str, Any]:
     return payload
 
 
-def _flatten_any(obj: Any, prefix: str = "", out: Dict[str, Any] | None = None) -> Dict[str, Any]:
-    if out is None:
-        out = {}
-    if isinstance(obj, dict):
-        for k, v in obj.items():
-            p = f"{prefix}.{k}" if prefix else str(k)
-            _flatten_any(v, p, out)
-        return out
-    if isinstance(obj, list):
-        for i, v in enumerate(obj):
-            p = f"{prefix}[{i}]"
-            _flatten_any(v, p, out)
-        return out
-    out[prefix] = obj
-    if "." in prefix:
-        out[prefix.split(".")[-1]] = obj
+def _raw_attribute_bytes(event, event_type: str) -> bytes | None:
+    """The N-CREATE attribute list / N-SET modification list as encoded on the wire."""
+    req = getattr(event, "request", None)
+    raw = getattr(req, "AttributeList" if event_type == "N-CREATE" else "ModificationList", None)
+    if raw is None:
+        return b""
+    try:
+        return raw.getvalue()
+    except Exception:
+        return None
+
+
+def _dataset_to_json(ds: Any) -> Dict[str, Any]:
+    if ds is None:
+        return {}
+    try:
+        return ds.to_json_dict()
+    except Exception as exc:
+        logging.warning("MPPS could not serialize dataset for the step store: %s", exc)
+        return {}
+
+
+def _project_attributes(ds: Dataset, identifiers: Any) -> Dataset:
+    """Keep only the requested attributes; unknown ones are returned zero-length."""
+    if not isinstance(identifiers, (list, tuple)):
+        identifiers = [identifiers]
+    out = Dataset()
+    for raw in identifiers:
+        try:
+            tag = Tag(raw)
+        except Exception:
+            continue
+        if tag in ds:
+            out[tag] = ds[tag]
+            continue
+        try:
+            out.add_new(tag, dictionary_VR(tag), None)
+        except Exception:
+            continue
     return out
 
 
@@ -152,56 +202,111 @@ def _is_non_empty(value: Any) -> bool:
     return True
 
 
-def _pick_first(flat: Dict[str, Any], keys: list[str]) -> str:
-    for k in keys:
-        v = flat.get(k)
-        if _is_non_empty(v):
-            return str(v).strip()
-        lk = k.lower()
-        for fk, fv in flat.items():
-            fks = str(fk)
-            if fks.lower() == lk or fks.lower().endswith("." + lk):
-                if _is_non_empty(fv):
-                    return str(fv).strip()
-    return ""
-
-
-def _dataset_to_debug_dict(ds: Any) -> Dict[str, Any]:
-    out: Dict[str, Any] = {}
-    if ds is None:
-        return out
-
-    def _is_scalar_like(v: Any) -> bool:
-        # pydicom PersonName behaves like iterable, but should be treated as a single value.
-        if isinstance(v, (str, bytes, dict)):
-            return True
-        return getattr(v, "__class__", type(v)).__name__ in ("PersonName",)
-
-    try:
-        for elem in ds:
-            key = elem.keyword if getattr(elem, "keyword", None) else str(getattr(elem, "tag", "UNKNOWN"))
-            value = elem.value
-            if value is None:
-                out[key] = None
-            elif hasattr(value, "__class__") and value.__class__.__name__ == "Sequence":
-                seq_items = []
-                for item in value:
-                    if hasattr(item, "__iter__"):
-                        seq_items.append(_dataset_to_debug_dict(item))
-                    else:
-                        seq_items.append(str(item))
-                out[key] = seq_items
-            elif hasattr(value, "__iter__") and not _is_scalar_like(value):
-                out[key] = [str(v) for v in value]
+class _DebugWriter:
+    """Writes sampled MPPS debug records to logs/mpps_debug.log on a background thread.
+
+    The DIMSE thread only decides whether an event is sampled and enqueues
+    references; JSON serialization, including the dataset conversion, happens
+    on the writer thread. Oversized records are truncated and, when the queue
+    is full, records are dropped rather than delaying the modality.
+    """
+
+    def __init__(self, log_path: Path, cfg: Dict[str, Any]):
+        self.sample_rate = float(cfg.get("sample_rate", 1.0))
+        self.calling_aets = {str(a).upper() for a in cfg.get("calling_aets") or []}
+        self.action_ids = set(cfg.get("action_ids") or [])
+        self.max_record_chars = int(cfg.get("max_record_kb") or 64) * 1024
+        self._queue: "queue.Queue" = queue.Queue(maxsize=int(cfg.get("queue_size") or 1000))
+        self._lock = threading.Lock()
+        self.sampled = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.written = 0
+
+        log_path.parent.mkdir(exist_ok=True)
+        self._handler = RotatingFileHandler(
+            log_path,
+            maxBytes=int(cfg.get("max_file_mb") or 50) * 1024 * 1024,
+            backupCount=int(cfg.get("backup_count") or 3),
+            encoding="utf-8",
+        )
+        self._handler.setFormatter(logging.Formatter("%(asctime)s - %(message)s"))
+        self._logger = logging.getLogger("mpps.debug")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.handlers = [self._handler]
+        self._thread = threading.Thread(target=self._loop, name="mpps-debug", daemon=True)
+        self._thread.start()
+
+    def should_capture(self, payload: Dict[str, Any]) -> bool:
+        capture = (
+            not self.calling_aets or str(payload.get("calling_ae") or "").upper() in self.calling_aets
+        ) and (self.sample_rate >= 1.0 or random.random() < self.sample_rate)
+        with self._lock:
+            if capture:
+                self.sampled += 1
             else:
-                out[key] = str(value)
-    except Exception:
-        return out
-    return out
+                self.sampled_out += 1
+        return capture
+
+    def submit(self, event_type: str, view: MPPSEventView, result: Dict[str, Any]):
+        try:
+            self._queue.put_nowait((event_type, view, result))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self._write(*item)
+            except Exception as exc:
+                logging.warning("MPPS debug record failed: %s", exc)
+
+    def _write(self, event_type: str, view: MPPSEventView, result: Dict[str, Any]):
+        actions = result.get("actions") or []
+        if self.action_ids:
+            actions = [a for a in actions if a.get("action_id") in self.action_ids and not a.get("skipped")]
+            if not actions:
+                return
+        record = {
+            "event": event_type,
+            "payload": view.payload,
+            "dataset": view.raw_dataset,
+            "action_result": {**result, "actions": actions},
+        }
+        text = json.dumps(record, ensure_ascii=False, default=str)
+        if len(text) > self.max_record_chars:
+            text = f"{text[:self.max_record_chars]}... [truncated {len(text) - self.max_record_chars} chars]"
+        self._logger.info("MPPS DEBUG %s", text)
+        with self._lock:
+            self.written += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sampled": self.sampled,
+                "sampled_out": self.sampled_out,
+                "written": self.written,
+                "dropped": self.dropped,
+                "queued": self._queue.qsize(),
+            }
+
+    def close(self):
+        try:
+            self._queue.put(None, timeout=1)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=5)
+        self._handler.close()
 
 
 class MPPSService:
     MPPS_SOP_CLASS_UID = UID("1.2.840.10008.3.1.2.3.3")
+    MPPS_RETRIEVE_SOP_CLASS_UID = UID("1.2.840.10008.3.1.2.3.4")
 
     def __init__(self, cfg: Dict[str, Any]):
         self.cfg = cfg
@@ -209,13 +314,117 @@ class MPPSService:
         self.db_cfg = cfg.get("database", {}) if isinstance(cfg.get("database"), dict) else {}
         self.stop_event = threading.Event()
         self.server = None
-        self._context_by_sop_uid: Dict[str, Dict[str, str]] = {}
+        store_cfg = self.mpps_cfg.get("context_store") or {}
+        self._steps = ProcedureStepStore(
+            data_dir(BASE_DIR) / STORE_FILE_NAME if store_cfg.get("persist", True) else None,
+            max_entries=int(store_cfg.get("max_entries") or 10000),
+            ttl_seconds=float(store_cfg.get("ttl_hours") or 24) * 3600,
+            final_ttl_seconds=float(store_cfg.get("final_ttl_hours") or 1) * 3600,
+        )
+        feedback_cfg = self.mpps_cfg.get("worklist_feedback") or {}
+        self._performed = None
+        if feedback_cfg.get("mode", "off") != "off":
+            self._performed = PerformedStepIndex(
+                data_dir(BASE_DIR) / PERFORMED_FILE_NAME,
+                retention_seconds=float(feedback_cfg.get("retention_hours") or 48) * 3600,
+            )
+        self._debug = None
+        if self.mpps_cfg.get("debug_output"):
+            self._debug = _DebugWriter(BASE_DIR / "logs" / "mpps_debug.log", self.mpps_cfg.get("debug") or {})
+        dedup_cfg = self.mpps_cfg.get("dedup") or {}
+        self._dedup = None
+        if dedup_cfg.get("enabled", True):
+            self._dedup = EventDeduplicator(
+                window_seconds=float(dedup_cfg.get("window_seconds") or 600),
+                max_entries=int(dedup_cfg.get("max_entries") or 10000),
+            )
+        journal_cfg = self.mpps_cfg.get("journal") or {}
+        self._journal = None
+        if journal_cfg.get("enabled"):
+            self._journal = MPPSJournal(
+                journal_dir(BASE_DIR),
+                max_file_bytes=int(journal_cfg.get("max_file_mb") or 64) * 1024 * 1024,
+                max_files=int(journal_cfg.get("max_files") or 20),
+            )
+
+    def _journal_event(self, event, event_type: str, payload: Dict[str, Any], raw: bytes | None):
+        """Record the dataset as received on the wire, for mpps_replay.py."""
+        if self._journal is None or raw is None:
+            return
+        try:
+            transfer_syntax = str(event.context.transfer_syntax)
+        except Exception as exc:
+            logging.warning("MPPS journal skipped %s: %s", event_type, exc)
+            return
+        self._journal.append(
+            {
+                "ts": time.time(),
+                "event": event_type,
+                "sop_instance_uid": payload.get("sop_instance_uid") or "",
+                "calling_ae": payload.get("calling_ae") or "",
+                "called_ae": payload.get("called_ae") or "",
+                "transfer_syntax": transfer_syntax,
+            },
+            raw,
+        )
+
+    def _dedup_key(self, event_type: str, payload: Dict[str, Any], raw: bytes | None) -> str | None:
+        sop_uid = str(payload.get("sop_instance_uid") or "").strip()
+        if self._dedup is None or raw is None or not sop_uid:
+            return None
+        status = str(payload.get("PerformedProcedureStepStatus") or "").strip().upper()
+        return f"{event_type}|{sop_uid}|{status}|{hashlib.sha1(raw).hexdigest()}"
+
+    def _dispatch(self, event_type: str, event, dataset_obj, process):
+        """Journal, drop duplicates, then run process(payload, dataset_obj)."""
+        payload = _event_payload(event, dataset_obj)
+        raw = _raw_attribute_bytes(event, event_type)
+        self._journal_event(event, event_type, payload, raw)
+        key = self._dedup_key(event_type, payload, raw)
+        if key is not None and not self._dedup.begin(key):
+            logging.info(
+                "MPPS %s for %s repeats an event already handled; acknowledged without running actions",
+                event_type,
+                payload.get("sop_instance_uid"),
+            )
+            return 0x0000, None
+        ok = False
+        pending = []
+        try:
+            result = process(payload, dataset_obj)
+            ok = bool(result.get("ok", True))
+            pending = result.pop("pending_sql", None) or []
+        finally:
+            if key is not None:
+                if ok and pending:
+                    self._finish_when_committed(key, pending)
+                else:
+                    self._dedup.finish(key, ok)
+        return 0x0000, None
+
+    def _finish_when_committed(self, key: str, pending):
+        """Record the event as handled only once its batched SQL legs committed."""
+        lock = threading.Lock()
+        state = {"left": len(pending), "ok": True}
 
-    def _extract_context(self, payload: Dict[str, Any], dataset_obj: Any) -> Dict[str, str]:
-        raw_ds = _dataset_to_debug_dict(dataset_obj)
-        flat = _flatten_any({"payload": payload, "dataset": raw_ds})
+        def done(outcome):
+            try:
+                failed = outcome.result() is not None
+            except Exception:
+                failed = True
+            with lock:
+                state["left"] -= 1
+                state["ok"] = state["ok"] and not failed
+                last = state["left"] == 0
+            if last:
+                self._dedup.finish(key, state["ok"])
+
+        for outcome in pending:
+            outcome.add_done_callback(done)
+
+    def _extract_context(self, view: MPPSEventView) -> Dict[str, str]:
         return {
-            "AccessionNumber": _pick_first(flat, [
+            "AccessionNumber": view.pick_first([
                 "AccessionNumber",
                 "RequestedProcedureID",
                 "ScheduledProcedureStepID",
@@ -224,11 +433,18 @@ class MPPSService:
                 "PlacerOrderNumberImagingServiceRequest",
                 "FillerOrderNumberImagingServiceRequest",
             ]),
-            "PatientID": _pick_first(flat, ["PatientID"]),
-            "StudyInstanceUID": _pick_first(flat, ["StudyInstanceUID"]),
-            "Modality": _pick_first(flat, ["Modality"]),
+            "PatientID": view.pick_first(["PatientID"]),
+            "StudyInstanceUID": view.pick_first(["StudyInstanceUID"]),
+            "Modality": view.pick_first(["Modality"]),
         }
 
+    def _record_performed(self, sop_uid: str, record: Dict[str, Any]):
+        """Publish the step status for mwl_service (mpps.worklist_feedback)."""
+        if self._performed is None or not record.get("status"):
+            return
+        context = record.get("context") or {}
+        self._performed.record(context.get("AccessionNumber"), context.get("Modality"), record["status"], sop_uid)
+
     def _merge_payload_with_context(self, payload: Dict[str, Any], context: Dict[str, str]) -> Dict[str, Any]:
         merged = dict(payload or {})
         for key in ("AccessionNumber", "PatientID", "StudyInstanceUID", "Modality"):
@@ -254,47 +470,93 @@ class MPPSService:
     def _handle_n_create(self, event):
         if not self._is_calling_allowed(event):
             return 0x0124, None  # Refused: Not authorized
-        dataset_obj = getattr(event, "attribute_list", None)
-        payload = _event_payload(event, dataset_obj)
+        return self._dispatch("N-CREATE", event, getattr(event, "attribute_list", None), self._process_n_create)
+
+    def _handle_n_set(self, event):
+        if not self._is_calling_allowed(event):
+            return 0x0124, None
+        return self._dispatch("N-SET", event, getattr(event, "modification_list", None), self._process_n_set)
+
+    def _process_n_create(self, payload: Dict[str, Any], dataset_obj) -> Dict[str, Any]:
+        view = MPPSEventView("N-CREATE", payload, dataset_obj)
         sop_uid = str(payload.get("sop_instance_uid") or "").strip()
         if sop_uid:
-            self._context_by_sop_uid[sop_uid] = self._extract_context(payload, dataset_obj)
-        if self.mpps_cfg.get("debug_output"):
-            logging.info("MPPS DEBUG N-CREATE payload: %s", json.dumps(payload, ensure_ascii=False))
-            logging.info(
-                "MPPS DEBUG N-CREATE dataset: %s",
-                json.dumps(_dataset_to_debug_dict(dataset_obj), ensure_ascii=False),
+            record = self._steps.merge(
+                sop_uid,
+                _dataset_to_json(dataset_obj),
+                self._extract_context(view),
+                status=str(payload.get("PerformedProcedureStepStatus") or ""),
             )
-        result = execute_mpps_actions(self.mpps_cfg, self.db_cfg, "N-CREATE", payload, dataset_obj, root_dir=BASE_DIR)
-        if self.mpps_cfg.get("debug_output"):
-            logging.info("MPPS DEBUG N-CREATE action-result: %s", json.dumps(result, ensure_ascii=False))
+            self._record_performed(sop_uid, record)
+        capture = self._debug is not None and self._debug.should_capture(payload)
+        result = execute_mpps_actions(
+            self.mpps_cfg,
+            self.db_cfg,
+            "N-CREATE",
+            payload,
+            dataset_obj,
+            root_dir=BASE_DIR,
+            event_view=view,
+            debug_output=capture,
+        )
+        if capture:
+            self._debug.submit("N-CREATE", view, result)
         if not result.get("ok", True):
             logging.error("MPPS N-CREATE action errors: %s", result)
-        return 0x0000, None
+        return result
 
-    def _handle_n_set(self, event):
-        if not self._is_calling_allowed(event):
-            return 0x0124, None
-        dataset_obj = getattr(event, "modification_list", None)
-        payload = _event_payload(event, dataset_obj)
+    def _process_n_set(self, payload: Dict[str, Any], dataset_obj) -> Dict[str, Any]:
+        view = MPPSEventView("N-SET", payload, dataset_obj)
         sop_uid = str(payload.get("sop_instance_uid") or "").strip()
-        if sop_uid and sop_uid in self._context_by_sop_uid:
-            payload = self._merge_payload_with_context(payload, self._context_by_sop_uid[sop_uid])
-        elif sop_uid:
-            # Update cache even if incomplete; useful when modality sends staggered content.
-            self._context_by_sop_uid[sop_uid] = self._extract_context(payload, dataset_obj)
-        if self.mpps_cfg.get("debug_output"):
-            logging.info("MPPS DEBUG N-SET payload: %s", json.dumps(payload, ensure_ascii=False))
-            logging.info(
-                "MPPS DEBUG N-SET dataset: %s",
-                json.dumps(_dataset_to_debug_dict(dataset_obj), ensure_ascii=False),
+        if sop_uid:
+            context = self._steps.context(sop_uid) or {}
+            # Extract from this N-SET while there is no stored context (no N-CREATE seen,
+            # e.g. after a restart or TTL expiry) or it still has gaps (staggered content).
+            fresh = self._extract_context(view) if not context or not all(context.values()) else None
+            record = self._steps.merge(
+                sop_uid,
+                _dataset_to_json(dataset_obj),
+                fresh,
+                status=str(payload.get("PerformedProcedureStepStatus") or ""),
             )
-        result = execute_mpps_actions(self.mpps_cfg, self.db_cfg, "N-SET", payload, dataset_obj, root_dir=BASE_DIR)
-        if self.mpps_cfg.get("debug_output"):
-            logging.info("MPPS DEBUG N-SET action-result: %s", json.dumps(result, ensure_ascii=False))
+            self._record_performed(sop_uid, record)
+            if context:
+                payload = self._merge_payload_with_context(payload, record.get("context") or {})
+                view = view.with_payload(payload)
+        capture = self._debug is not None and self._debug.should_capture(payload)
+        result = execute_mpps_actions(
+            self.mpps_cfg,
+            self.db_cfg,
+            "N-SET",
+            payload,
+            dataset_obj,
+            root_dir=BASE_DIR,
+            event_view=view,
+            debug_output=capture,
+        )
+        if capture:
+            self._debug.submit("N-SET", view, result)
         if not result.get("ok", True):
             logging.error("MPPS N-SET action errors: %s", result)
-        return 0x0000, None
+        return result
+
+    def _handle_n_get(self, event):
+        if not self._is_calling_allowed(event):
+            return 0x0124, None
+        req = getattr(event, "request", None)
+        sop_uid = str(getattr(req, "RequestedSOPInstanceUID", "") or "").strip()
+        attributes = self._steps.attributes(sop_uid) if sop_uid else None
+        if attributes is None:
+            return 0x0112, None  # No such SOP Instance
+        try:
+            ds = Dataset.from_json(attributes)
+        except Exception as exc:
+            logging.error("MPPS N-GET could not rebuild %s: %s", sop_uid, exc)
+            return 0x0110, None  # Processing failure
+        identifiers = getattr(req, "AttributeIdentifierList", None)
+        if identifiers:
+            ds = _project_attributes(ds, identifiers)
+        return 0x0000, ds
 
     def run(self):
         listener = self.mpps_cfg.get("listener") or {}
@@ -304,22 +566,61 @@ class MPPSService:
 
         ae = AE(ae_title=aet.encode("ascii", errors="ignore"))
         ae.add_supported_context(self.MPPS_SOP_CLASS_UID)
+        ae.add_supported_context(self.MPPS_RETRIEVE_SOP_CLASS_UID)
         handlers = [
             (evt.EVT_N_CREATE, self._handle_n_create),
             (evt.EVT_N_SET, self._handle_n_set),
+            (evt.EVT_N_GET, self._handle_n_get),
         ]
         logging.info("Starting MPPS SCP on %s:%s (AE=%s)", host, port, aet)
-        logging.info("MPPS debug_output=%s", "ON" if self.mpps_cfg.get("debug_output") else "OFF")
+        logging.info(
+            "MPPS debug_output=%s%s",
+            "ON" if self._debug is not None else "OFF",
+            f" (sample_rate={self._debug.sample_rate}, logs/mpps_debug.log)" if self._debug is not None else "",
+        )
         self.server = ae.start_server((host, port), block=False, evt_handlers=handlers)
+        next_status_at = 0.0
         while not self.stop_event.is_set():
+            if time.monotonic() >= next_status_at:
+                self._publish_status()
+                next_status_at = time.monotonic() + STATUS_INTERVAL_SECONDS
             time.sleep(0.5)
         try:
             if self.server:
                 self.server.shutdown()
         except Exception:
             pass
+        flush_sql_batches()
+        self._steps.close()
+        if self._performed is not None:
+            self._performed.close()
+        if self._debug is not None:
+            self._debug.close()
+        if self._journal is not None:
+            self._journal.close()
         logging.info("MPPS SCP stopped")
 
+    def _status_snapshot(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "updated_at": datetime.now().isoformat(),
+            "context_store": self._steps.stats(),
+            "sql_batches": sql_batch_stats(),
+            "circuit_breakers": circuit_breaker_stats(),
+            "executors": executor_stats(),
+            "action_metrics": action_metrics(),
+            "journal": self._journal.stats() if self._journal is not None else None,
+            "dedup": self._dedup.stats() if self._dedup is not None else None,
+            "debug": self._debug.stats() if self._debug is not None else None,
+        }
+
+    def _publish_status(self):
+        try:
+            self._steps.purge_expired()
+            write_status_snapshot(BASE_DIR, self._status_snapshot())
+        except Exception as exc:
+            logging.warning("MPPS status snapshot failed: %s", exc)
+
     def stop(self):
         self.stop_event.set()
 
@@ -0,0 +1,469 @@
+import json
+import logging
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+
+STATUS_FILE_NAME = "mpps_status.json"
+STORE_FILE_NAME = "mpps_state.sqlite3"
+PERFORMED_FILE_NAME = "mpps_performed.sqlite3"
+JOURNAL_DIR_NAME = "journal"
+JOURNAL_SUFFIX = ".mpj"
+
+# Journal record frame: header length, body length (big-endian), JSON header, DICOM bytes.
+_JOURNAL_FRAME = struct.Struct(">II")
+
+# Steps in these states receive no further N-SET.
+FINAL_STEP_STATUSES = ("COMPLETED", "DISCONTINUED")
+
+
+def data_dir(root_dir: Path) -> Path:
+    p = Path(root_dir) / "mpps-data"
+    p.mkdir(parents=True, exist_ok=True)
+    return p
+
+
+def write_status_snapshot(root_dir: Path, snapshot: Dict[str, Any]) -> None:
+    path = data_dir(root_dir) / STATUS_FILE_NAME
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(snapshot, indent=2, default=str), encoding="utf-8")
+    tmp.replace(path)
+
+
+def read_status_snapshot(root_dir: Path) -> Dict[str, Any]:
+    path = Path(root_dir) / "mpps-data" / STATUS_FILE_NAME
+    if not path.exists():
+        return {}
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+class ProcedureStepStore:
+    """Merged state of each performed procedure step, keyed by SOP Instance UID.
+
+    Each record holds the step's attributes as a DICOM JSON dict (N-CREATE
+    attributes with N-SET modifications applied) and the correlation context
+    (AccessionNumber, PatientID, ...) used to enrich N-SET payloads. Memory is an
+    LRU bounded by max_entries; SQLite keeps records across restarts. Records
+    expire ttl_seconds after their last update, or final_ttl_seconds once the
+    step is COMPLETED/DISCONTINUED, so they can still answer N-GET for a while.
+    """
+
+    def __init__(
+        self,
+        db_path: Path | None,
+        max_entries: int = 10000,
+        ttl_seconds: float = 86400,
+        final_ttl_seconds: float = 3600,
+    ):
+        self.db_path = Path(db_path) if db_path else None
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = max(1.0, float(ttl_seconds))
+        self.final_ttl_seconds = max(1.0, float(final_ttl_seconds))
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._conn: sqlite3.Connection | None = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.db_path:
+            try:
+                self.db_path.parent.mkdir(parents=True, exist_ok=True)
+                self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS mpps_step ("
+                    "sop_uid TEXT PRIMARY KEY, record_json TEXT NOT NULL, status TEXT NOT NULL DEFAULT '', "
+                    "updated_at REAL NOT NULL, expires_at REAL NOT NULL)"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS ix_mpps_step_expires ON mpps_step(expires_at)")
+                self._conn.commit()
+                self.purge_expired()
+            except Exception as exc:
+                logging.warning("MPPS step store persistence disabled (%s): %s", self.db_path, exc)
+                self._conn = None
+
+    def get(self, sop_uid: str) -> Dict[str, Any] | None:
+        """Return the record ({"status", "context", "attributes"}) for a step, if known."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(sop_uid)
+            if entry is not None:
+                record, expires_at = entry
+                if now <= expires_at:
+                    self._entries.move_to_end(sop_uid)
+                    self.hits += 1
+                    return record
+                self._entries.pop(sop_uid, None)
+                self.evictions += 1
+            loaded = self._db_get(sop_uid, now)
+            if loaded is None:
+                self.misses += 1
+                return None
+            record, expires_at = loaded
+            self.hits += 1
+            self._remember(sop_uid, record, expires_at)
+            return record
+
+    def context(self, sop_uid: str) -> Dict[str, str] | None:
+        record = self.get(sop_uid)
+        return dict(record.get("context") or {}) if record else None
+
+    def attributes(self, sop_uid: str) -> Dict[str, Any] | None:
+        record = self.get(sop_uid)
+        return record.get("attributes") if record else None
+
+    def merge(
+        self,
+        sop_uid: str,
+        attributes: Dict[str, Any] | None,
+        context: Dict[str, str] | None,
+        status: str = "",
+    ) -> Dict[str, Any]:
+        """Apply N-CREATE/N-SET attributes and fill blank context fields; returns the record."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(sop_uid)
+            previous = entry[0] if entry is not None else None
+            if previous is None:
+                loaded = self._db_get(sop_uid, now)
+                previous = loaded[0] if loaded else None
+            merged_attrs = dict((previous or {}).get("attributes") or {})
+            merged_attrs.update(attributes or {})
+            merged_ctx = dict((previous or {}).get("context") or {})
+            for key, value in (context or {}).items():
+                if value and not merged_ctx.get(key):
+                    merged_ctx[key] = value
+            step_status = (status or (previous or {}).get("status") or "").strip().upper()
+            record = {"status": step_status, "context": merged_ctx, "attributes": merged_attrs}
+            ttl = self.final_ttl_seconds if step_status in FINAL_STEP_STATUSES else self.ttl_seconds
+            expires_at = now + ttl
+            self._remember(sop_uid, record, expires_at)
+            if self._conn is not None:
+                try:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO mpps_step (sop_uid, record_json, status, updated_at, expires_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (sop_uid, json.dumps(record, ensure_ascii=False), step_status, now, expires_at),
+                    )
+                    self._conn.commit()
+                except Exception as exc:
+                    logging.warning("MPPS step store write failed for %s: %s", sop_uid, exc)
+            return record
+
+    def discard(self, sop_uid: str) -> None:
+        with self._lock:
+            if self._entries.pop(sop_uid, None) is not None:
+                self.evictions += 1
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute("DELETE FROM mpps_step WHERE sop_uid = ?", (sop_uid,))
+                self._conn.commit()
+            except Exception as exc:
+                logging.warning("MPPS step store delete failed for %s: %s", sop_uid, exc)
+
+    def purge_expired(self) -> None:
+        now = time.time()
+        with self._lock:
+            for sop_uid in [k for k, (_, exp) in self._entries.items() if exp < now]:
+                self._entries.pop(sop_uid, None)
+                self.evictions += 1
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute("DELETE FROM mpps_step WHERE expires_at < ?", (now,))
+                self._conn.execute(
+                    "DELETE FROM mpps_step WHERE sop_uid NOT IN "
+                    "(SELECT sop_uid FROM mpps_step ORDER BY updated_at DESC LIMIT ?)",
+                    (self.max_entries,),
+                )
+                self._conn.commit()
+            except Exception as exc:
+                logging.warning("MPPS step store purge failed: %s", exc)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "final_ttl_seconds": self.final_ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "persistent": self._conn is not None,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.close()
+                except Exception:
+                    pass
+                self._conn = None
+
+    def _remember(self, sop_uid: str, record: Dict[str, Any], expires_at: float) -> None:
+        self._entries[sop_uid] = (record, expires_at)
+        self._entries.move_to_end(sop_uid)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _db_get(self, sop_uid: str, now: float) -> tuple[Dict[str, Any], float] | None:
+        if self._conn is None:
+            return None
+        try:
+            row = self._conn.execute(
+                "SELECT record_json, expires_at FROM mpps_step WHERE sop_uid = ?", (sop_uid,)
+            ).fetchone()
+        except Exception as exc:
+            logging.warning("MPPS step store read failed for %s: %s", sop_uid, exc)
+            return None
+        if not row or now > float(row[1]):
+            return None
+        try:
+            record = json.loads(row[0])
+        except Exception:
+            return None
+        return (record, float(row[1])) if isinstance(record, dict) else None
+
+
+class PerformedStepIndex:
+    """Latest MPPS status per (AccessionNumber, Modality), shared with the MWL server.
+
+    The MPPS listener records step status changes; mwl_service reads the index to
+    drop or flag orders that were already performed, without waiting for the HIS
+    query to stop selecting them. SQLite in WAL mode lets the two processes use
+    the file concurrently. Readers cache the index for refresh_seconds.
+    """
+
+    def __init__(self, db_path: Path, retention_seconds: float = 48 * 3600, refresh_seconds: float = 2.0):
+        self.db_path = Path(db_path)
+        self.retention_seconds = max(60.0, float(retention_seconds))
+        self.refresh_seconds = max(0.0, float(refresh_seconds))
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._cache: Dict[tuple[str, str], str] = {}
+        self._cache_at = 0.0
+        self._purged_at = 0.0
+
+    def _connection(self, create: bool) -> sqlite3.Connection | None:
+        if self._conn is not None:
+            return self._conn
+        if not create and not self.db_path.exists():
+            return None
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.db_path), timeout=5, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS mpps_performed ("
+            "accession_number TEXT NOT NULL, modality TEXT NOT NULL DEFAULT '', status TEXT NOT NULL, "
+            "sop_uid TEXT NOT NULL DEFAULT '', updated_at REAL NOT NULL, "
+            "PRIMARY KEY (accession_number, modality))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_mpps_performed_updated ON mpps_performed(updated_at)")
+        conn.commit()
+        self._conn = conn
+        return conn
+
+    def record(self, accession_number: str, modality: str, status: str, sop_uid: str = "") -> None:
+        accession_number = str(accession_number or "").strip()
+        status = str(status or "").strip().upper()
+        if not accession_number or not status:
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection(create=True)
+                conn.execute(
+                    "INSERT OR REPLACE INTO mpps_performed (accession_number, modality, status, sop_uid, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (accession_number, str(modality or "").strip().upper(), status, sop_uid or "", now),
+                )
+                if now - self._purged_at > 60:
+                    conn.execute("DELETE FROM mpps_performed WHERE updated_at < ?", (now - self.retention_seconds,))
+                    self._purged_at = now
+                conn.commit()
+            except Exception as exc:
+                logging.warning("MPPS performed-step index write failed for %s: %s", accession_number, exc)
+
+    def snapshot(self) -> Dict[tuple[str, str], str]:
+        """{(accession_number, modality): status}; modality "" applies to every modality."""
+        now = time.time()
+        with self._lock:
+            if now - self._cache_at < self.refresh_seconds:
+                return self._cache
+            try:
+                conn = self._connection(create=False)
+                rows = [] if conn is None else conn.execute(
+                    "SELECT accession_number, modality, status FROM mpps_performed WHERE updated_at >= ?",
+                    (now - self.retention_seconds,),
+                ).fetchall()
+                self._cache = {(str(a), str(m)): str(s) for a, m, s in rows}
+            except Exception as exc:
+                logging.warning("MPPS performed-step index read failed: %s", exc)
+            self._cache_at = now
+            return self._cache
+
+    def status_for(self, accession_number: str, modality: str) -> str:
+        index = self.snapshot()
+        key = str(accession_number or "").strip()
+        return index.get((key, str(modality or "").strip().upper())) or index.get((key, "")) or ""
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.close()
+                except Exception:
+                    pass
+                self._conn = None
+
+
+class EventDeduplicator:
+    """Recognizes N-CREATE/N-SET events that were already handled.
+
+    Modalities resend identical requests, e.g. after an association timeout.
+    An event key (SOP Instance UID, status, attribute hash) is remembered for
+    window_seconds once its actions succeeded, and while it is still running, so
+    a resend racing the original is not executed twice. Failed events are
+    forgotten so a resend retries them.
+    """
+
+    def __init__(self, window_seconds: float = 600, max_entries: int = 10000):
+        self.window_seconds = max(1.0, float(window_seconds))
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        self._seen: "OrderedDict[str, float | None]" = OrderedDict()  # key -> expiry, None while in flight
+        self.skipped = 0
+
+    def begin(self, key: str) -> bool:
+        """Claim key; False means it is a duplicate and must not run again."""
+        now = time.monotonic()
+        with self._lock:
+            if key in self._seen:
+                expires_at = self._seen[key]
+                if expires_at is None or now <= expires_at:
+                    self.skipped += 1
+                    return False
+            self._seen[key] = None
+            self._seen.move_to_end(key)
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            return True
+
+    def finish(self, key: str, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                self._seen[key] = time.monotonic() + self.window_seconds
+            else:
+                self._seen.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, exp in self._seen.items() if exp is not None and exp < now]:
+                self._seen.pop(key, None)
+            return {"size": len(self._seen), "window_seconds": self.window_seconds, "skipped": self.skipped}
+
+
+class MPPSJournal:
+    """Append-only journal of received N-CREATE/N-SET datasets.
+
+    Each record is the dataset exactly as encoded on the wire plus a small JSON
+    header (event, time, AE titles, SOP Instance UID, transfer syntax), so
+    mpps_replay.py can re-send a site's real traffic. Files rotate at
+    max_file_bytes and only the newest max_files are kept.
+    """
+
+    def __init__(self, directory: Path, max_file_bytes: int = 64 * 1024 * 1024, max_files: int = 20):
+        self.directory = Path(directory)
+        self.max_file_bytes = max(1024, int(max_file_bytes))
+        self.max_files = max(1, int(max_files))
+        self._lock = threading.Lock()
+        self._fh = None
+        self._path: Path | None = None
+        self._size = 0
+        self.records = 0
+        self.bytes_written = 0
+        self.errors = 0
+
+    def append(self, header: Dict[str, Any], body: bytes) -> None:
+        head = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        frame = _JOURNAL_FRAME.pack(len(head), len(body)) + head + body
+        with self._lock:
+            try:
+                if self._fh is None or self._size + len(frame) > self.max_file_bytes:
+                    self._rotate()
+                self._fh.write(frame)
+                self._fh.flush()
+                self._size += len(frame)
+                self.records += 1
+                self.bytes_written += len(frame)
+            except Exception as exc:
+                self.errors += 1
+                logging.warning("MPPS journal write failed: %s", exc)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "file": str(self._path) if self._path else "",
+                "records": self.records,
+                "bytes": self.bytes_written,
+                "errors": self.errors,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fh is not None:
+                try:
+                    self._fh.close()
+                except Exception:
+                    pass
+                self._fh = None
+
+    def _rotate(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        self._path = self.directory / f"mpps-{stamp}{JOURNAL_SUFFIX}"
+        self._fh = open(self._path, "ab")
+        self._size = self._path.stat().st_size
+        for old in sorted(self.directory.glob(f"*{JOURNAL_SUFFIX}"))[: -self.max_files]:
+            try:
+                old.unlink()
+            except Exception:
+                pass
+
+
+def journal_dir(root_dir: Path) -> Path:
+    return data_dir(root_dir) / JOURNAL_DIR_NAME
+
+
+def iter_journal(path: Path) -> Iterator[tuple[Dict[str, Any], bytes]]:
+    """Yield (header, body) records from a journal file; a truncated tail is ignored."""
+    with open(path, "rb") as fh:
+        while True:
+            frame = fh.read(_JOURNAL_FRAME.size)
+            if len(frame) < _JOURNAL_FRAME.size:
+                return
+            head_len, body_len = _JOURNAL_FRAME.unpack(frame)
+            head = fh.read(head_len)
+            body = fh.read(body_len)
+            if len(head) < head_len or len(body) < body_len:
+                return
+            yield json.loads(head.decode("utf-8")), body
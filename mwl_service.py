@@ -37,6 +37,8 @@ from pydicom.valuerep import PersonName
 from pynetdicom import AE, evt, StoragePresentationContexts
 from pynetdicom.sop_class import ModalityWorklistInformationFind
 from dicom_printer_service import DicomPrinterRuntime
+from mpps_actions import merge_mpps_config
+from mpps_store import FINAL_STEP_STATUSES, PERFORMED_FILE_NAME, PerformedStepIndex
 
 # --- LOCKFILE PARA EVITAR EXECUÇÃO DO CÓDIGO DUPLICADO ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -373,6 +375,20 @@ SQL_QUERY = DB_CFG.get("query")
 DICOM_PRINTER_CFG = config.get("dicom_printer", {}) if isinstance(config.get("dicom_printer"), dict) else {}
 DICOM_PRINTER_ENABLED = bool(DICOM_PRINTER_CFG.get("enabled", False))
 
+# --- MPPS WORKLIST FEEDBACK ---
+# Steps reported by the MPPS listener are dropped (drop) or returned with their status (flag).
+MPPS_FEEDBACK_CFG = merge_mpps_config(config.get("mpps"), Path(BASE_DIR))["worklist_feedback"]
+MPPS_FEEDBACK_MODE = MPPS_FEEDBACK_CFG["mode"]
+PERFORMED_STEPS = (
+    PerformedStepIndex(
+        Path(BASE_DIR) / "mpps-data" / PERFORMED_FILE_NAME,
+        retention_seconds=float(MPPS_FEEDBACK_CFG["retention_hours"]) * 3600,
+    )
+    if MPPS_FEEDBACK_MODE != "off"
+    else None
+)
+MPPS_TO_SPS_STATUS = {"IN PROGRESS": "STARTED", "COMPLETED": "COMPLETED", "DISCONTINUED": "DISCONTINUED"}
+
 
 
 def _parse_dsn_ip_port_db(dsn_str: str, default_port: int) -> Tuple[str, int, str]:
@@ -794,6 +810,11 @@ def handle_find_mwl(event, worklist_provider: WorklistProvider):
             logging.debug(f"  ScheduledTime filter mismatch: '{db_scheduled_time}' != '{scheduled_time_filter}'")
             continue
 
+        performed_status = PERFORMED_STEPS.status_for(db_accession_number, db_modality_norm) if PERFORMED_STEPS else ''
+        if MPPS_FEEDBACK_MODE == 'drop' and performed_status in FINAL_STEP_STATUSES:
+            logging.debug(f"  Skipped: MPPS reported {performed_status} for AccessionNumber '{db_accession_number}'")
+            continue
+
         logging.info(f"Item PASSED all filters. Returning: PatientName={db_patient_name}, PatientID={db_patient_id}")
         
         # Monta o Dataset MWL (1 item por PED_RX)
@@ -866,6 +887,8 @@ def handle_find_mwl(event, worklist_provider: WorklistProvider):
         sps.ScheduledStationAETitle = CLIENT_AE_TITLE.decode()
         medico = sanitize_string(primeira.get('medico_responsavel', '')).replace(" ", "^")
         sps.ScheduledPerformingPhysicianName = PersonName(medico if medico else "^")
+        if MPPS_FEEDBACK_MODE == 'flag' and performed_status in MPPS_TO_SPS_STATUS:
+            sps.ScheduledProcedureStepStatus = MPPS_TO_SPS_STATUS[performed_status]
 
         # Adiciona todos os protocolos solicitados no SPS
         if scheduled_protocol_codes:
@@ -64,6 +64,15 @@ logging.basicConfig(
 app_logger = logging.getLogger('flowworklist.app')
 DCMTK_MANUAL_URL = "https://dicom.offis.de/en/dcmtk/dcmtk-tools/"
 ORACLE_PY_PACKAGES = ['oracledb', 'cx_Oracle']
+MPPS_CFG_KEYS_NOT_IN_FORM = (
+    "execution",
+    "circuit_breaker",
+    "context_store",
+    "journal",
+    "dedup",
+    "worklist_feedback",
+    "debug",
+)
 
 
 def detect_oracle_client_dirs(configured_path=""):
@@ -139,6 +148,8 @@ def default_printer_config():
             "port": 4100,
             "target_host": "127.0.0.1",
             "dcmtk_bin": r"C:\dcmtk\bin",
+            "mode": "dcmtk",
+            "bind_address": "",
         },
         "worker": {
             "database_dir": str(base / "database"),
@@ -151,6 +162,29 @@ def default_printer_config():
             "delete_after_success": False,
             "sp_time_window_seconds": 120,
             "poll_interval_seconds": 1.0,
+            "stable_seconds": 0.5,
+            "stable_timeout_seconds": 300,
+            "watch_mode": "auto",
+            "reconcile_interval_seconds": 60,
+            "render_workers": 2,
+            "compose_workers": 2,
+            "spool_workers": 1,
+            "stage_queue_size": 16,
+            "session_gap_seconds": 10,
+            "batch_max_films": 20,
+            "batch_max_wait_seconds": 5,
+            "processed_retention_days": 30,
+            "processed_max_entries": 100000,
+            "retention_days": 0,
+            "disk_quota_mb": 0,
+            "sweep_interval_seconds": 600,
+            "renderer": "auto",
+            "print_dpi": 0,
+            "pdf_compression": "lossless",
+            "jpeg_quality": 90,
+            "retry_max_attempts": 5,
+            "retry_backoff_seconds": 10,
+            "retry_backoff_max_seconds": 600,
         },
     }
 
@@ -890,16 +924,23 @@ def printer_config():
         else:
             config_data = {"server": {}, "database": {}}
 
+        previous_printer = config_data.get("dicom_printer") if isinstance(config_data.get("dicom_printer"), dict) else {}
+        previous_worker = previous_printer.get("worker") if isinstance(previous_printer.get("worker"), dict) else {}
+        previous_receiver = previous_printer.get("receiver") if isinstance(previous_printer.get("receiver"), dict) else {}
         config_data["dicom_printer"] = {
             "enabled": bool(request.form.get("enabled")),
             "receiver": {
+                **previous_receiver,
                 "aet": request.form.get("receiver_aet", "VPRINTSCP").strip() or "VPRINTSCP",
                 "profile": request.form.get("receiver_profile", "FLOWWORKLIST_PRINTER").strip() or "FLOWWORKLIST_PRINTER",
                 "port": _to_int(request.form.get("receiver_port"), 4100),
                 "target_host": request.form.get("receiver_target_host", "127.0.0.1").strip() or "127.0.0.1",
                 "dcmtk_bin": request.form.get("receiver_dcmtk_bin", r"C:\dcmtk\bin").strip() or r"C:\dcmtk\bin",
+                "mode": "native" if request.form.get("receiver_mode") == "native" else "dcmtk",
             },
             "worker": {
+                # Keep worker settings that are not on this form.
+                **previous_worker,
                 "database_dir": request.form.get("worker_database_dir", str(ROOT / "dicom-printer" / "database")).strip(),
                 "spool_dir": request.form.get("worker_spool_dir", str(ROOT / "dicom-printer" / "spool")).strip(),
                 "out_dir": request.form.get("worker_out_dir", str(ROOT / "dicom-printer" / "out")).strip(),
@@ -910,6 +951,15 @@ def printer_config():
                 "delete_after_success": bool(request.form.get("worker_delete_after_success")),
                 "sp_time_window_seconds": _to_int(request.form.get("worker_sp_time_window_seconds"), 120),
                 "poll_interval_seconds": _to_float(request.form.get("worker_poll_interval_seconds"), 1.0),
+                "watch_mode": request.form.get("worker_watch_mode", "auto").strip().lower() or "auto",
+                "renderer": request.form.get("worker_renderer", "auto").strip().lower() or "auto",
+                "print_dpi": _to_int(request.form.get("worker_print_dpi"), 0),
+                "pdf_compression": request.form.get("worker_pdf_compression", "lossless").strip().lower() or "lossless",
+                "jpeg_quality": _to_int(request.form.get("worker_jpeg_quality"), 90),
+                "batch_max_films": _to_int(request.form.get("worker_batch_max_films"), 20),
+                "batch_max_wait_seconds": _to_float(request.form.get("worker_batch_max_wait_seconds"), 5.0),
+                "retention_days": _to_float(request.form.get("worker_retention_days"), 0.0),
+                "disk_quota_mb": _to_int(request.form.get("worker_disk_quota_mb"), 0),
             },
         }
 
@@ -967,6 +1017,7 @@ def mpps_config():
                 config_data = {"server": {}, "database": {}}
         else:
             config_data = {"server": {}, "database": {}}
+        previous_mpps = config_data.get("mpps") if isinstance(config_data.get("mpps"), dict) else {}
         config_data["mpps"] = {
             "enabled": _to_bool(request.form.get("enabled")),
             "start_with_worklist": _to_bool(request.form.get("start_with_worklist")),
@@ -980,6 +1031,10 @@ def mpps_config():
             },
             "test_payload_json": request.form.get("test_payload_json", "{}"),
         }
+        # Sections edited only in config.json survive a save from this page.
+        for key in MPPS_CFG_KEYS_NOT_IN_FORM:
+            if key in previous_mpps:
+                config_data["mpps"][key] = previous_mpps[key]
         try:
             cfg_path.write_text(json.dumps(config_data, indent=2))
             return redirect(url_for('mpps_config', notice='config_saved', status='success'))
@@ -1040,6 +1095,7 @@ def mpps_action_save():
             'modality_filter_mode': (request.form.get('action_modality_filter_mode') or 'ANY').strip().upper(),
             'trigger_modalities': [str(s).strip().upper() for s in (request.form.get('action_trigger_modalities', '') or '').split(',') if str(s).strip()],
             'include_raw_dataset': bool(request.form.get('action_include_raw_dataset')),
+            'depends_on': [str(s).strip() for s in (request.form.get('action_depends_on', '') or '').split(',') if str(s).strip()],
             'api': {
                 'url': request.form.get('action_api_url', '').strip(),
                 'method': (request.form.get('action_api_method') or 'POST').strip().upper(),
@@ -1050,6 +1106,9 @@ def mpps_action_save():
             'sql': {
                 'on_n_create': request.form.get('action_sql_on_n_create', '').strip(),
                 'on_n_set': request.form.get('action_sql_on_n_set', '').strip(),
+                'batch_enabled': bool(request.form.get('action_sql_batch_enabled')),
+                'batch_window_ms': _to_int(request.form.get('action_sql_batch_window_ms'), 250),
+                'batch_max_size': _to_int(request.form.get('action_sql_batch_max_size'), 50),
             },
         }
         saved = save_action_file(ROOT, action_cfg)
@@ -1944,6 +2003,15 @@ def test_mpps():
             dataset_obj=None,
             root_dir=ROOT
         )
+        # Batched SQL legs are only queued; wait for their commit to report the real outcome.
+        for outcome in result.pop("pending_sql", None) or []:
+            try:
+                error = outcome.result(timeout=30)
+            except Exception as exc:
+                error = str(exc) or "SQL batch not committed within 30s"
+            if error is not None:
+                result["ok"] = False
+                result.setdefault("batch_errors", []).append(error)
         if result.get("ok"):
             return jsonify({
                 'ok': True,